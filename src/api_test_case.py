@@ -0,0 +1,82 @@
+from flask_testing import TestCase
+
+import app
+import database
+
+
+class ApiTestCase(TestCase):
+    """Base for tests that drive the API: each test starts on an empty database
+    with the admin and every user in ``users`` registered and logged in."""
+
+    users = ["bob"]
+
+    def create_app(self):
+        return app.app
+
+    def setUp(self) -> None:
+        database.recreate_db()
+        if app.result_cache:
+            app.result_cache.clear()
+        app.create_admin_user()
+        self.tokens = {}
+        self.login(admin, "admin")
+        for user in self.users:
+            self.register(user)
+
+    def tearDown(self):
+        database.recreate_db()
+
+    def register(self, user, expected_calories_per_day=2000):
+        """Register a regular user and log them in."""
+        self.post(
+            "/users",
+            data={
+                "username": user,
+                "password": "password",
+                "expected_calories_per_day": expected_calories_per_day,
+            },
+        )
+        return self.login(user)
+
+    def login(self, user, password="password"):
+        body, _ = self.post("/login", data={"username": user, "password": password})
+        self.tokens[user] = body["auth_token"]
+        return self.tokens[user]
+
+    def headers(self, user):
+        return {"access-token": self.tokens[user]} if user else {}
+
+    def get(self, url, user):
+        response = self.client.get(url, headers=self.headers(user))
+        return response.json, response.status_code
+
+    def delete(self, url, user):
+        response = self.client.delete(url, headers=self.headers(user))
+        return response.json, response.status_code
+
+    def post(self, url, user=None, data=None):
+        response = self.client.post(url, headers=self.headers(user), json=data)
+        return response.json, response.status_code
+
+    def put(self, url, user, data):
+        response = self.client.put(url, headers=self.headers(user), json=data)
+        return response.json, response.status_code
+
+    def create(
+        self,
+        user,
+        text="kiwi",
+        number_of_calories=None,
+        date="2020-06-01",
+        time="12:00",
+    ):
+        """Log a calorie entry as ``user`` and return it."""
+        calorie = {"date": date, "time": time, "text": text, "username": user}
+        if number_of_calories is not None:
+            calorie["number_of_calories"] = number_of_calories
+        body, code = self.post("/calories", user, calorie)
+        self.assertEqual(200, code, body.get("error", ""))
+        return body["calorie"]
+
+
+admin = "admin"
@@ -1,26 +1,60 @@
 import datetime
+import hashlib
+import json
+import math
 import os
-import traceback
+import re
+import threading
+import time
+import urllib.parse
+import uuid
 
 import jwt
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
+from sqlalchemy import event
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from exceptions import (
     InvalidTokenException,
     InvalidRequestException,
-    UnknownCalorieException,
-    NotAllowedException,
-    UnknownUserException,
-    InitialAdminRoleException,
-    UserAlreadyExistsException,
+    RateLimitedException,
+    OverloadedException,
+    error_response,
+    error_responses,
 )
+import changes
+import database
+import export
+import idempotency
+import importer
+import profiler
+from cache import result_cache_from_env, calorie_scopes, normalize_filter
+from logs import access_logger, logger
+from ratelimit import rate_limiter_from_env, admission_control_from_env
+from rollups import rollup_worker_from_env
 from users import Users, UserManagement
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = (
     os.environ["SECRET_KEY"] if "SECRET_KEY" in os.environ else "bad_secret"
 )
+max_batch_requests = 50
+batched = "health.batched"  # Set in the WSGI environ of POST /batch sub-requests
+list_shapes = [
+    "object",
+    "array",
+    "columns",
+]  # Values of format= on GET /users and /calories
+rate_limiter = rate_limiter_from_env()
+admission_control = admission_control_from_env(database.pool_connections)
+result_cache = result_cache_from_env()
+rollup_worker = rollup_worker_from_env()
+change_log = changes.change_log_from_env()
+archive_watcher = changes.archive_watcher_from_env()
+process_profiler = profiler.profiler_from_env()
+idempotency_store = idempotency.idempotency_store_from_env()
 
 
 def check_token_and_set_session(user_manage):
@@ -28,10 +62,29 @@ def check_token_and_set_session(user_manage):
         token = request.headers["access-token"]
     else:
         raise InvalidTokenException
-    data = jwt.decode(token, app.config["SECRET_KEY"])
+    data = g.get("token_data") or jwt.decode(token, app.config["SECRET_KEY"])
+    g.username = data["username"]
     user_manage.set_user_session(data["username"])
 
 
+def idempotent(user_manage, create):
+    """create(user_manage), or the response to an earlier request with the same Idempotency-Key."""
+    key = request.headers.get("Idempotency-Key")
+    if not key or not idempotency_store:
+        return create(user_manage)
+
+    def respond():
+        response = create(user_manage)
+        return response.status_code, response.mimetype, response.get_data()
+
+    status, mimetype, body = idempotency_store.run(
+        (g.get("username"), request.path, key),
+        hashlib.sha256(request.get_data()).hexdigest(),
+        respond,
+    )
+    return app.response_class(body, status, mimetype=mimetype)
+
+
 #  Create user
 def register(user_manager):
     request_data = request.get_json()
@@ -50,9 +103,124 @@ def register(user_manager):
     return jsonify({"message": "Successfully registered."})
 
 
+def cached_json(user_manage, key_parts, scopes, produce):
+    """Respond with produce()'s JSON, reusing the serialized body while scopes are unchanged.
+
+    Bodies read from a replica aren't stored: it may not have the writes that bumped the scopes.
+    """
+    if not result_cache:
+        return jsonify(produce())
+    replica_queries = user_manage.replica_queries()
+    body = result_cache.get_or_create(
+        key_parts,
+        scopes,
+        lambda: jsonify(produce()).get_data(),
+        lambda: user_manage.replica_queries() == replica_queries,
+    )
+    return app.response_class(body, mimetype=app.config["JSONIFY_MIMETYPE"])
+
+
+def list_fields(args):
+    """Pops fields= from args. Returns the projected columns, or None for all of them."""
+    fields = args.pop("fields", None)
+    return list(dict.fromkeys(fields.split(","))) if fields else None
+
+
+def list_params(args):
+    """Pops format= and fields= from args. Returns the listing shape and list_fields()."""
+    args.pop("profile", None)  # Handled by profile_request
+    shape = args.pop("format", "object")
+    if shape not in list_shapes:
+        raise InvalidRequestException
+    return shape, list_fields(args)
+
+
+def shaped_list(columns, rows, shape):
+    """Listing as an object keyed by id (rows then start with the key), an array of objects, or
+    column names and row arrays."""
+    if shape == "object":
+        return {row[0]: dict(zip(columns, row[1:])) for row in rows}
+    if shape == "columns":
+        return {"columns": columns, "rows": rows}
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def sync_calories(calories, username, search_filter, shape, fields, args):
+    """Listing of the entries changed since updated_since, with the ids of deleted ones."""
+    columns = fields or calories.columns
+    key = ["id"] if shape == "object" else []
+    rows, deleted, updated_at, reset = calories.read_changed(
+        args.pop("updated_since"), username, search_filter, key + columns
+    )
+    return {
+        "calories": shaped_list(columns, rows, shape),
+        "deleted": deleted,
+        "updated_at": updated_at,
+        "reset": reset,
+    }
+
+
+def list_users(user_manage: Users, shape, fields):
+    if shape == "object" and not fields:
+        return {"users": user_manage.read()}
+    columns = fields or user_manage.columns
+    key = ["username"] if shape == "object" else []
+    rows = user_manage.read_rows(key + columns)
+    return {"users": shaped_list(columns, rows, shape)}
+
+
+def list_calories(calories, username, search_filter, shape, fields, args):
+    if "updated_since" in args:
+        return sync_calories(calories, username, search_filter, shape, fields, args)
+    if "ids" in args:
+        columns = fields or calories.columns
+        key = ["id"] if shape == "object" else []
+        rows = calories.read_ids(args.pop("ids").split(","), key + columns)
+        return {"calories": shaped_list(columns, rows, shape)}
+    if shape == "object" and not fields:
+        read = calories.read(filter=search_filter, username=username, **args)
+        return {"calories": read}
+    columns = fields or calories.columns
+    key = ["id"] if shape == "object" else []
+    rows = calories.read_rows(username, search_filter, key + columns)
+    return {"calories": shaped_list(columns, rows, shape)}
+
+
 def read_users(user_manage: Users):
-    user_dict = user_manage.read()
-    return jsonify({"users": user_dict})
+    shape, fields = list_params(request.args.to_dict())
+    return cached_json(
+        user_manage,
+        ("users", *user_manage.read_scope(), shape, fields),
+        ["users"],
+        lambda: list_users(user_manage, shape, fields),
+    )
+
+
+def read_changes(user_manage: Users):
+    try:
+        since = int(request.args.get("since", 0))
+        wait = min(float(request.args.get("wait", 0)), changes.max_wait)
+    except ValueError:
+        raise InvalidRequestException
+    deadline = time.monotonic() + wait
+    while True:
+        generation = change_log.generation if change_log else None
+        feed = user_manage.read_changes(since)
+        remaining = deadline - time.monotonic()
+        if feed["changes"] or feed["reset"] or remaining <= 0 or not change_log:
+            return jsonify(feed)
+        # Waiting holds no database connection, so the admission slot goes to other requests
+        if g.admitted:
+            g.admitted = False
+            admission_control.leave()
+        # Wakes early for this process's writes, polls for other processes' every second
+        change_log.wait(generation, min(remaining, 1))
+        if admission_control:
+            try:
+                admission_control.enter()
+            except OverloadedException:
+                return jsonify(feed)  # Nothing new yet, the client polls again
+            g.admitted = True
 
 
 def read_user(user_manage: Users, username):
@@ -60,6 +228,74 @@ def read_user(user_manage: Users, username):
     return jsonify({"user": user_dict})
 
 
+def read_rollups(user_manage: Users, username):
+    if "from" not in request.args or "to" not in request.args:
+        raise InvalidRequestException
+    rollups = user_manage.calories.rollups(
+        username, request.args["from"], request.args["to"], request.args.get("period")
+    )
+    return jsonify({"rollups": rollups})
+
+
+def read_profile(user_manage: Users):
+    user_manage.check_admin()
+    return jsonify({"profile": process_profiler.status()})
+
+
+def start_profile(user_manage: Users):
+    user_manage.check_admin()
+    request_data = request.get_json() or {}
+    try:
+        status = process_profiler.start(
+            request_data.get("seconds"), request_data.get("requests")
+        )
+    except TypeError:
+        raise InvalidRequestException
+    return jsonify({"profile": status})
+
+
+def stop_profile(user_manage: Users):
+    user_manage.check_admin()
+    process_profiler.finish()
+    return jsonify({"profile": process_profiler.status()})
+
+
+def read_stats(user_manage: Users, username):
+    calories = user_manage.calories
+    scope = calories.read_scope(username)
+    args = (request.args.get("from"), request.args.get("to"))
+    window = request.args.get("window", 7)
+    return cached_json(
+        user_manage,
+        ("stats", *scope, *args, window),
+        calorie_scopes(username) + ["users"],  # users for expected calories
+        lambda: {"stats": calories.stats(username, *args, window)},
+    )
+
+
+def read_cohort(user_manage: Users):
+    if "from" not in request.args or "to" not in request.args:
+        raise InvalidRequestException
+    args = (request.args["from"], request.args["to"], request.args.get("limit", 10))
+    source = request.args.get("source", "calories")
+    if source == "rollups":
+        if not rollup_worker:
+            raise InvalidRequestException
+        # Rollups trail the writes they follow, so they aren't cached against them
+        return jsonify({"cohort": user_manage.cohort(*args, source)})
+    return cached_json(
+        user_manage,
+        ("cohort", *user_manage.read_scope(), *args),
+        calorie_scopes() + ["users"],
+        lambda: {"cohort": user_manage.cohort(*args, source)},
+    )
+
+
+def remove_users(user_manage: Users):
+    users, calories = user_manage.bulk_remove(request.args.get("filter"))
+    return jsonify({"deleted": {"users": users, "calories": calories}})
+
+
 def remove_user(user_manage: Users, username):
     user_manage.remove(username)
     return jsonify({"message": "User successfully deleted."})
@@ -90,8 +326,71 @@ def create_calorie(user_manager: Users):
 
 
 def read_calories(user_manager: Users):
-    calories_dict = user_manager.calories.read(**request.args)
-    return jsonify({"calories": calories_dict})
+    calories = user_manager.calories
+    args = request.args.to_dict()
+    shape, fields = list_params(args)
+    username = args.pop("username", None)
+    scope = calories.read_scope(username)
+    search_filter = normalize_filter(args.pop("filter", None))
+    # Delta syncs depend on the time. Reads by id are permission checked per entry, which the
+    # listing scope doesn't capture.
+    if "updated_since" in args or "ids" in args:
+        return jsonify(
+            list_calories(calories, username, search_filter, shape, fields, args)
+        )
+    return cached_json(
+        user_manager,
+        ("calories", *scope, search_filter, shape, fields, sorted(args.items())),
+        calorie_scopes(scope[1]),
+        lambda: list_calories(calories, username, search_filter, shape, fields, args),
+    )
+
+
+def search_calories(user_manager: Users):
+    try:
+        limit = min(int(request.args.get("limit", 50)), 500)
+    except ValueError:
+        raise InvalidRequestException
+    calories = user_manager.calories.search(
+        request.args.get("q", ""), request.args.get("username"), limit
+    )
+    return jsonify({"calories": calories})
+
+
+def suggest_foods(user_manager: Users):
+    try:
+        limit = min(int(request.args.get("limit", 10)), 50)
+    except ValueError:
+        raise InvalidRequestException
+    foods = user_manager.calories.suggest(request.args.get("prefix", ""), limit)
+    return jsonify({"foods": foods})
+
+
+def export_calories(user_manager: Users):
+    format = request.args.get("format", "ndjson")
+    if format not in export.formats:
+        raise InvalidRequestException
+    mimetype, serialize = export.formats[format]
+    fields = list_fields(request.args.to_dict())
+    columns = fields or user_manager.calories.columns
+    batches = user_manager.calories.export(
+        columns, request.args.get("username"), request.args.get("filter")
+    )
+    return app.response_class(
+        serialize(columns, batches),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=calories.{format}"},
+    )
+
+
+def import_calories(user_manager: Users):
+    format = request.args.get("format", "csv")
+    if format not in ("csv", "ndjson"):
+        raise InvalidRequestException
+    report = user_manager.calories.bulk_import(
+        importer.read_rows(request.stream, format)
+    )
+    return jsonify({"imported": report})
 
 
 def read_calorie(user_manager: Users, calorie_id):
@@ -99,35 +398,218 @@ def read_calorie(user_manager: Users, calorie_id):
     return jsonify({"calorie": calorie_dict})
 
 
+def run_batch(user_manage: Users):
+    """Runs the GET sub-requests in {"requests": [{"method": "GET", "path": ...}]} with this
+    request's user and database session. Returns each one's status and JSON body, in order.
+    """
+    sub_requests = (request.get_json() or {}).get("requests")
+    if not isinstance(sub_requests, list) or not (
+        0 < len(sub_requests) <= max_batch_requests
+    ):
+        raise InvalidRequestException
+    urls = app.url_map.bind("localhost")
+    return jsonify(
+        {"responses": [batch_response(user_manage, urls, sub) for sub in sub_requests]}
+    )
+
+
+def batch_response(user_manage, urls, sub_request):
+    path = sub_request.get("path") if isinstance(sub_request, dict) else None
+    if not isinstance(path, str) or sub_request.get("method", "GET") != "GET":
+        return batch_error(*error_responses[InvalidRequestException])
+    try:
+        rule, view_args = urls.match(
+            urllib.parse.urlsplit(path).path, "GET", return_rule=True
+        )
+        environ = EnvironBuilder(path=path, method="GET").get_environ()
+    except (HTTPException, ValueError):
+        return batch_error(*error_responses[InvalidRequestException])
+    endpoint = rule.endpoint
+    if endpoint not in _batch_reads:
+        return batch_error(*error_responses[InvalidRequestException])
+    if rate_limiter:  # Each sub-request costs what it would on its own
+        try:
+            rate_limiter.check(rate_limit_key(), f"GET {rule.rule}")
+        except RateLimitedException:
+            return batch_error(429, "Too many requests.")
+    environ[batched] = True
+    try:
+        with app.request_context(environ):
+            response = app.make_response(
+                _batch_reads[endpoint](user_manage, **view_args)
+            )
+    except tuple(error_responses) as e:
+        return batch_error(*error_response(e))
+    except HTTPException as e:
+        return batch_error(e.code, e.description)
+    except Exception as e:
+        logger.error(
+            "Error on batched GET %s, request %s", path, g.request_id, exc_info=e
+        )
+        return batch_error(500, str(e))
+    return {"status": response.status_code, "body": response.get_json()}
+
+
+def batch_error(status, message):
+    return {"status": status, "body": {"error": message}}
+
+
+def remove_calories(user_manager: Users):
+    calories = user_manager.calories.bulk_remove(
+        request.args.get("username"), request.args.get("before")
+    )
+    return jsonify({"deleted": {"calories": calories}})
+
+
 def remove_calorie(user_manager: Users, calorie_id):
     user_manager.calories.remove(calorie_id)
     return jsonify({"message": "Calorie successfully deleted."})
 
 
-def eval_and_respond(user_manage, funcs):
-    ret_val = {}
-    try:
-        for func in funcs:
-            if isinstance(func, list):
-                ret_val = func[0](user_manage, *func[1:])
-            else:
-                ret_val = func(user_manage)
-    except UnknownCalorieException:
-        return jsonify({"error": "Calorie not found."}), 404
-    except NotAllowedException:
-        return jsonify({"error": "Not authorized."}), 403
-    except UserAlreadyExistsException:
-        return jsonify({"error": "User already exists."}), 400
-    except InvalidRequestException:
-        return jsonify({"error": "Invalid request."}), 400
-    except UnknownUserException:
-        return jsonify({"error": "User not found."}), 404
-    except InitialAdminRoleException:
-        return jsonify({"error": "Can't change admin username or role."}), 400
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
-    return ret_val
+def error_handler(status, message):
+    """Handler returning a body serialized once, when the handler is registered."""
+    body = json.dumps({"error": message})
+
+    def handle(e):
+        return app.response_class(body, status, mimetype="application/json")
+
+    return handle
+
+
+for exception, (status, message) in error_responses.items():
+    app.register_error_handler(exception, error_handler(status, message))
+
+
+@app.errorhandler(Exception)
+def unexpected_error(e):
+    if isinstance(e, HTTPException):
+        return e  # Flask's own responses, e.g. 404 for unknown URLs
+    logger.error(
+        "Error on %s %s, request %s",
+        request.method,
+        request.path,
+        g.get("request_id"),
+        exc_info=e,
+    )
+    return jsonify({"error": str(e)}), 500
+
+
+def rate_limit_key():
+    """JWT username when the request carries a valid token, otherwise the client IP."""
+    if "access-token" in request.headers:
+        try:
+            g.token_data = jwt.decode(
+                request.headers["access-token"], app.config["SECRET_KEY"]
+            )
+            return "user:" + g.token_data["username"]
+        except jwt.InvalidTokenError:
+            pass
+    return "ip:" + str(request.remote_addr)
+
+
+_request_id = re.compile(r"^[\w.-]{1,64}$")
+_db_time = threading.local()  # Query time and count of the request on this thread
+
+
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution, so a query that raises leaves nothing behind on the connection
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    if getattr(_db_time, "tracking", False):
+        _db_time.seconds += elapsed
+        _db_time.queries += 1
+
+
+if access_logger:
+    for engine in [database.engine, *database.replica_engines]:
+        event.listen(engine, "before_cursor_execute", _start_query)
+        event.listen(engine, "after_cursor_execute", _end_query)
+
+
+@app.before_request
+def start_request():
+    """Runs first, so requests turned away by admit_request are logged too."""
+    request_id = request.headers.get("X-Request-ID", "")
+    g.request_id = request_id if _request_id.match(request_id) else uuid.uuid4().hex
+    g.started = time.perf_counter()
+    _db_time.tracking, _db_time.seconds, _db_time.queries = True, 0.0, 0
+
+
+@app.before_request
+def profile_request():
+    g.sampler = None
+    if process_profiler.per_request and request.args.get("profile") == "1":
+        g.sampler = process_profiler.profile_request()
+
+
+@app.after_request
+def finish_profile(response):
+    if g.get("sampler"):
+        path = process_profiler.finish_request(g.sampler, g.request_id)
+        response.headers["X-Profile"] = path
+    if request.endpoint != "profile":  # Don't count starting or stopping a profile
+        process_profiler.request_finished()
+    return response
+
+
+@app.after_request
+def log_request(response):
+    response.headers["X-Request-ID"] = g.request_id
+    _db_time.tracking = False
+    if access_logger:
+        access_logger.info(
+            {
+                "request_id": g.request_id,
+                "method": request.method,
+                "route": request.url_rule.rule if request.url_rule else None,
+                "path": request.path,
+                "user": g.get("username"),
+                "status": response.status_code,
+                "latency_ms": round((time.perf_counter() - g.started) * 1000, 2),
+                "db_ms": round(_db_time.seconds * 1000, 2),
+                "db_queries": _db_time.queries,
+            }
+        )
+    return response
+
+
+@app.before_request
+def admit_request():
+    """Shed load and apply rate limits before any database work is done."""
+    g.token_data = None
+    g.admitted = False
+    if admission_control:
+        try:
+            admission_control.enter()
+        except OverloadedException:
+            return jsonify({"error": "Server busy."}), 503, {"Retry-After": "1"}
+        g.admitted = True
+    if rate_limiter and request.url_rule:
+        route = f"{request.method} {request.url_rule.rule}"
+        try:
+            rate_limiter.check(rate_limit_key(), route)
+        except RateLimitedException as e:
+            retry_after = str(math.ceil(e.retry_after))
+            return (
+                jsonify({"error": "Too many requests."}),
+                429,
+                {"Retry-After": retry_after},
+            )
+
+
+@app.teardown_request
+def release_request(exc):
+    # Batched sub-requests share the batch's g and are torn down before it finishes
+    if g.get("admitted") and not request.environ.get(batched):
+        g.admitted = False
+        admission_control.leave()
 
 
 def create_admin_user():
@@ -155,54 +637,142 @@ def login():
     return jsonify({"error": "Wrong username or password."}), 401
 
 
-@app.route("/users", methods=["GET", "POST"])
+@app.route("/users", methods=["GET", "POST", "DELETE"])
 def users():
     with UserManagement() as user_manage:
+        if request.method == "POST":
+            return idempotent(user_manage, register)
+        check_token_and_set_session(user_manage)
         if request.method == "GET":
-            funcs = [check_token_and_set_session, read_users]
-        else:  # POST
-            funcs = [register]
-        response = eval_and_respond(user_manage, funcs)
-    return response
+            return read_users(user_manage)
+        return remove_users(user_manage)
+
+
+@app.route("/changes", methods=["GET"])
+def changes_feed():
+    with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
+        return read_changes(user_manage)
+
+
+@app.route("/admin/profile", methods=["GET", "POST", "DELETE"])
+def profile():
+    with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
+        if request.method == "GET":
+            return read_profile(user_manage)
+        if request.method == "DELETE":
+            return stop_profile(user_manage)
+        return start_profile(user_manage)
 
 
 @app.route("/users/<username>", methods=["GET", "PUT", "DELETE"])
 def user(username):
     with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
         if request.method == "GET":
-            funcs = [check_token_and_set_session, [read_user, username]]
-            response = eval_and_respond(user_manage, funcs)
-        elif request.method == "DELETE":
-            funcs = [check_token_and_set_session, [remove_user, username]]
-            response = eval_and_respond(user_manage, funcs)
-        else:  # PUT
-            funcs = [check_token_and_set_session, [update_user, username]]
-            response = eval_and_respond(user_manage, funcs)
-    return response
+            return read_user(user_manage, username)
+        if request.method == "DELETE":
+            return remove_user(user_manage, username)
+        return update_user(user_manage, username)
+
+
+@app.route("/users/<username>/rollups", methods=["GET"])
+def user_rollups(username):
+    with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
+        return read_rollups(user_manage, username)
+
 
+@app.route("/users/<username>/stats", methods=["GET"])
+def user_stats(username):
+    with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
+        return read_stats(user_manage, username)
+
+
+@app.route("/cohort", methods=["GET"])
+def cohort():
+    with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
+        return read_cohort(user_manage)
 
-@app.route("/calories", methods=["GET", "POST"])
+
+@app.route("/calories", methods=["GET", "POST", "DELETE"])
 def calories():
     with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
         if request.method == "GET":
-            funcs = [check_token_and_set_session, read_calories]
-        else:  # POST
-            funcs = [check_token_and_set_session, create_calorie]
-        response = eval_and_respond(user_manage, funcs)
+            return read_calories(user_manage)
+        if request.method == "DELETE":
+            return remove_calories(user_manage)
+        return idempotent(user_manage, create_calorie)
+
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
+        return run_batch(user_manage)
+
+
+@app.route("/calories/search", methods=["GET"])
+def calories_search():
+    with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
+        return search_calories(user_manage)
+
+
+@app.route("/calories/export", methods=["GET"])
+def calories_export():
+    # The session has to outlive this function, the rows are read while the body streams
+    user_management = UserManagement()
+    user_manage = user_management.__enter__()
+    try:
+        check_token_and_set_session(user_manage)
+        response = export_calories(user_manage)
+    except Exception:
+        user_management.__exit__(None, None, None)
+        raise
+    response.call_on_close(lambda: user_management.__exit__(None, None, None))
     return response
 
 
+@app.route("/calories/import", methods=["POST"])
+def calories_import():
+    with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
+        return import_calories(user_manage)
+
+
+@app.route("/foods/suggest", methods=["GET"])
+def foods_suggest():
+    with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
+        return suggest_foods(user_manage)
+
+
 @app.route("/calories/<calorie_id>", methods=["GET", "PUT", "DELETE"])
 def calorie(calorie_id):
     with UserManagement() as user_manage:
+        check_token_and_set_session(user_manage)
         if request.method == "GET":
-            funcs = [check_token_and_set_session, [read_calorie, calorie_id]]
-            response = eval_and_respond(user_manage, funcs)
-        else:  # DELETE:
-            funcs = [check_token_and_set_session, [remove_calorie, calorie_id]]
-            response = eval_and_respond(user_manage, funcs)
-    return response
-
+            return read_calorie(user_manage, calorie_id)
+        return remove_calorie(user_manage, calorie_id)  # DELETE
+
+
+# Handlers POST /batch may run, by endpoint
+_batch_reads = {
+    "users": read_users,
+    "user": read_user,
+    "user_rollups": read_rollups,
+    "user_stats": read_stats,
+    "cohort": read_cohort,
+    "calories": read_calories,
+    "calorie": read_calorie,
+    "calories_search": search_calories,
+    "foods_suggest": suggest_foods,
+}
 
 create_admin_user()
 
@@ -0,0 +1,137 @@
+"""Archives calorie entries older than a retention window to gzip compressed NDJSON files.
+
+Run periodically, e.g. daily from cron in the src directory:
+
+    python archive.py --retention-days 365 --directory /data/archive
+
+Each month goes to its own file, calorie-YYYY-MM.<run>.ndjson.gz, which is synced to disk before
+the archived rows are deleted. With monthly partitioning on Postgres, a month that is entirely
+archived is removed by dropping its partition instead.
+"""
+
+import argparse
+import datetime
+import gzip
+import json
+import os
+import time
+
+from sqlalchemy import and_, func, select
+
+import changes
+import database
+import events
+import partitions
+import rollups
+from database import Calorie
+
+columns = [
+    Calorie.id,
+    Calorie.text,
+    Calorie.number_of_calories,
+    Calorie.username,
+    Calorie.date,
+    Calorie.time,
+    Calorie.below_expected,
+]
+
+
+def archive(before, directory, batch_size=5000):
+    """Move entries dated before before (YYYY-MM-DD) into directory. Returns the number moved."""
+    run = time.strftime("%Y%m%dT%H%M%S")
+    archived = 0
+    with database.engine.connect() as connection:
+        month = func.substr(Calorie.date, 1, 7)
+        months = [
+            row[0]
+            for row in connection.execute(
+                select([month]).where(Calorie.date < before).distinct().order_by(month)
+            )
+        ]
+        for month in months:
+            archived += _archive_month(
+                connection, month, before, directory, run, batch_size
+            )
+    if archived:
+        events.publish("calories_archived", before=before)
+    return archived
+
+
+def _archive_month(connection, month, before, directory, run, batch_size):
+    end = min(partitions.next_month(month), before)
+    in_month = and_(Calorie.date >= month, Calorie.date < end)
+    path = os.path.join(directory, f"calorie-{month}.{run}.ndjson.gz")
+    count = 0
+    last_id = 0
+    with open(path + ".tmp", "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as compressed:
+            while True:  # Keyset pagination keeps memory flat for any size of month
+                rows = connection.execute(
+                    select(columns)
+                    .where(in_month)
+                    .where(Calorie.id > last_id)
+                    .order_by(Calorie.id)
+                    .limit(batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    compressed.write((json.dumps(dict(row)) + "\n").encode())
+                count += len(rows)
+                last_id = rows[-1].id
+        raw.flush()
+        os.fsync(raw.fileno())
+    if not count:
+        os.remove(path + ".tmp")
+        return 0
+    os.replace(path + ".tmp", path)
+
+    # Rows added meanwhile have higher ids and are left for the next run
+    with connection.begin():
+        archived = and_(in_month, Calorie.id <= last_id)
+        days = connection.execute(
+            select(
+                [
+                    Calorie.username,
+                    Calorie.date,
+                    func.coalesce(func.sum(Calorie.number_of_calories), 0),
+                    func.count(),
+                ]
+            )
+            .where(archived)
+            .group_by(Calorie.username, Calorie.date)
+        )
+        rollups.add_archived(
+            connection,
+            {(username, date): totals for username, date, *totals in days},
+        )
+        remaining = None
+        if database.calorie_partitioning and end == partitions.next_month(month):
+            remaining = connection.execute(
+                select([func.count()]).where(in_month).where(Calorie.id > last_id)
+            ).scalar()
+        if remaining == 0:
+            partitions.drop_partition(connection, month)
+        else:
+            connection.execute(Calorie.__table__.delete().where(archived))
+        changes.record(connection, "calorie", "archive", key=before)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directory", required=True)
+    parser.add_argument(
+        "--retention-days",
+        type=int,
+        default=(
+            int(os.environ["ARCHIVE_RETENTION_DAYS"])
+            if "ARCHIVE_RETENTION_DAYS" in os.environ
+            else 365
+        ),
+    )
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+    cutoff = datetime.date.today() - datetime.timedelta(days=args.retention_days)
+    moved = archive(cutoff.isoformat(), args.directory, args.batch_size)
+    print(f"Archived {moved} entries dated before {cutoff.isoformat()}")
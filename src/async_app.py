@@ -0,0 +1,236 @@
+"""Asyncio serving mode for the REST API.
+
+Exposes the same interface as app.py as an ASGI application (e.g. ``uvicorn async_app:app``).
+The Users/Calories managers stay synchronous, so each request's unit of work (token check,
+business rules, database calls) runs on a bounded thread pool while the event loop keeps
+accepting and overlapping other requests.
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import jwt
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app import app as flask_app, list_calories, list_params, list_users
+from exceptions import (
+    InvalidTokenException,
+    InvalidRequestException,
+    error_response,
+    error_responses,
+)
+from logs import logger
+from users import UserManagement
+
+db_workers = (
+    int(os.environ["ASYNC_DB_WORKERS"]) if "ASYNC_DB_WORKERS" in os.environ else 16
+)
+_executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="db")
+
+
+class _Request:
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {
+            key.decode("latin-1").lower(): value.decode("latin-1")
+            for key, value in scope["headers"]
+        }
+        self.args = dict(parse_qsl(scope["query_string"].decode()))
+        try:
+            self.json = json.loads(body) if body else None
+        except ValueError:
+            self.json = None
+
+
+def check_token_and_set_session(user_manage, request):
+    if "access-token" not in request.headers:
+        raise InvalidTokenException
+    data = jwt.decode(request.headers["access-token"], flask_app.config["SECRET_KEY"])
+    user_manage.set_user_session(data["username"])
+
+
+def login(user_manage, request):
+    user_orm = user_manage.non_session_read(request.json["username"])
+    if not user_orm or not check_password_hash(
+        user_orm.hashed_password, request.json["password"]
+    ):
+        return 401, {"error": "Wrong username or password."}
+    payload = {
+        "username": request.json["username"],
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=30),
+    }
+    token = jwt.encode(payload, flask_app.config["SECRET_KEY"])
+    return 200, {"auth_token": token.decode()}
+
+
+def register(user_manage, request):
+    request_data = request.json or {}
+    if (
+        "username" not in request_data
+        or "password" not in request_data
+        or "expected_calories_per_day" not in request_data
+    ):
+        raise InvalidRequestException
+    user_manage.create(
+        request_data["username"],
+        generate_password_hash(request_data["password"]),
+        request_data["expected_calories_per_day"],
+    )
+    return 200, {"message": "Successfully registered."}
+
+
+def read_users(user_manage, request):
+    check_token_and_set_session(user_manage, request)
+    return 200, list_users(user_manage, *list_params(dict(request.args)))
+
+
+def read_user(user_manage, request, username):
+    check_token_and_set_session(user_manage, request)
+    return 200, {"user": user_manage.read(username)}
+
+
+def remove_user(user_manage, request, username):
+    check_token_and_set_session(user_manage, request)
+    user_manage.remove(username)
+    return 200, {"message": "User successfully deleted."}
+
+
+def update_user(user_manage, request, username):
+    check_token_and_set_session(user_manage, request)
+    if not request.json or len(request.json) != 1:
+        raise InvalidRequestException
+    if "password" in request.json:
+        password_hash = generate_password_hash(request.json["password"])
+        user_manage.update_password(username, password_hash)
+    elif "expected_calories_per_day" in request.json:
+        user_dict = user_manage.update_expected_calories_per_day(
+            username, request.json["expected_calories_per_day"]
+        )
+        return 200, {"user": user_dict}
+    elif "role" in request.json:
+        user_dict = user_manage.update_role(username, request.json["role"])
+        return 200, {"user": user_dict}
+    else:
+        raise InvalidRequestException
+    return 200, {"message": "Password successfully changed."}
+
+
+def create_calorie(user_manage, request):
+    check_token_and_set_session(user_manage, request)
+    return 200, {"calorie": user_manage.calories.create(**request.json)}
+
+
+def read_calories(user_manage, request):
+    check_token_and_set_session(user_manage, request)
+    args = dict(request.args)
+    shape, fields = list_params(args)
+    username = args.pop("username", None)
+    search_filter = args.pop("filter", None)
+    calories = user_manage.calories
+    return 200, list_calories(calories, username, search_filter, shape, fields, args)
+
+
+def read_calorie(user_manage, request, calorie_id):
+    check_token_and_set_session(user_manage, request)
+    return 200, {"calorie": user_manage.calories.read(calorie_id)}
+
+
+def remove_calorie(user_manage, request, calorie_id):
+    check_token_and_set_session(user_manage, request)
+    user_manage.calories.remove(calorie_id)
+    return 200, {"message": "Calorie successfully deleted."}
+
+
+_routes = [
+    ("POST", re.compile(r"^/login$"), login),
+    ("GET", re.compile(r"^/users$"), read_users),
+    ("POST", re.compile(r"^/users$"), register),
+    ("GET", re.compile(r"^/users/([^/]+)$"), read_user),
+    ("PUT", re.compile(r"^/users/([^/]+)$"), update_user),
+    ("DELETE", re.compile(r"^/users/([^/]+)$"), remove_user),
+    ("GET", re.compile(r"^/calories$"), read_calories),
+    ("POST", re.compile(r"^/calories$"), create_calorie),
+    ("GET", re.compile(r"^/calories/([^/]+)$"), read_calorie),
+    ("DELETE", re.compile(r"^/calories/([^/]+)$"), remove_calorie),
+]
+
+
+def eval_and_respond(handler, request, *args):
+    """Runs on a pool thread: one database session per request, errors mapped to responses."""
+    with UserManagement() as user_manage:
+        try:
+            return handler(user_manage, request, *args)
+        except tuple(error_responses) as e:
+            status, message = error_response(e)
+            return status, {"error": message}
+        except Exception as e:
+            logger.exception("Error on %s %s", request.method, request.path)
+            return 500, {"error": str(e)}
+
+
+async def dispatch(request):
+    path_matched = False
+    for method, pattern, handler in _routes:
+        match = pattern.match(request.path)
+        if not match:
+            continue
+        path_matched = True
+        if method != request.method:
+            continue
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _executor, eval_and_respond, handler, request, *match.groups()
+        )
+    if path_matched:
+        return 405, {"error": "Method not allowed."}
+    return 404, {"error": "Not found."}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+    status, payload = await dispatch(_Request(scope, body))
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send(
+        {
+            "type": "http.response.body",
+            "body": json.dumps(payload, sort_keys=True).encode(),
+        }
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=5000)
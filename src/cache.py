@@ -0,0 +1,191 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import events
+
+
+class LRUBackend:
+    """Bounded in-process store. Generation counters are kept apart so they are never evicted."""
+
+    def __init__(self, max_entries=1024):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+
+class StoreBackend:
+    """Store shared between processes, via a client with redis-style get/set/incr/delete."""
+
+    def __init__(self, client, ttl=300, prefix="result-cache:"):
+        self._client = client
+        self._ttl = ttl
+        self._prefix = prefix
+
+    def get(self, key):
+        return self._client.get(self._prefix + key)
+
+    def set(self, key, value):
+        self._client.set(self._prefix + key, value, ex=self._ttl)
+
+    def counter(self, key):
+        value = self._client.get(self._prefix + "gen:" + key)
+        return int(value) if value else 0
+
+    def incr(self, key):
+        self._client.incr(self._prefix + "gen:" + key)
+
+    def clear(self):
+        pass  # Shared entries age out after ttl
+
+
+class ResultCache:
+    """Caches serialized read responses.
+
+    Each entry is keyed by the request's scope plus the current generation of every data set it
+    depends on. Writes bump generations, so stale entries are never looked up again and age out.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_or_create(self, key_parts, scopes, produce, keep=None):
+        """The cached body, or produce()'s, which is stored unless keep() says otherwise."""
+        key = "|".join(
+            [repr(part) for part in key_parts]
+            + [f"{scope}@{self.backend.counter(scope)}" for scope in scopes]
+        )
+        body = self.backend.get(key)
+        if body is None:
+            body = produce()
+            if keep is None or keep():
+                self.backend.set(key, body)
+        return body
+
+    def invalidate(self, *scopes):
+        for scope in scopes:
+            self.backend.incr(scope)
+
+    def clear(self):
+        self.backend.clear()
+
+
+def calorie_scopes(username=None):
+    """Data sets a calorie listing depends on: one user's entries or everyone's."""
+    return ["calories:" + username, "calories-bulk"] if username else ["calories"]
+
+
+def normalize_filter(search_filter):
+    """Collapse whitespace outside quoted literals so equivalent filters share an entry."""
+    if not search_filter:
+        return None
+    parts = search_filter.strip().split("'")
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "'".join(parts)
+
+
+def invalidate_on_writes(result_cache):
+    def calorie_changed(calorie, seq=None):
+        result_cache.invalidate("calories", "calories:" + calorie["username"])
+
+    def user_removed(username):
+        result_cache.invalidate("users", "calories", "calories:" + username)
+
+    def calories_removed(username, days, seq=None):
+        if username:
+            result_cache.invalidate("calories", "calories:" + username)
+        else:
+            result_cache.invalidate("calories", "calories-bulk")
+
+    events.subscribe("calorie_created", calorie_changed)
+    events.subscribe("calorie_removed", calorie_changed)
+    events.subscribe("user_changed", lambda username: result_cache.invalidate("users"))
+    events.subscribe("user_removed", user_removed)
+    events.subscribe("calories_removed", calories_removed)
+    events.subscribe(
+        "calories_imported",
+        lambda usernames: result_cache.invalidate(
+            "calories", *("calories:" + username for username in usernames)
+        ),
+    )
+    events.subscribe(
+        "calories_archived",
+        lambda before: result_cache.invalidate("calories", "calories-bulk"),
+    )
+    events.subscribe(
+        "users_removed",
+        lambda: result_cache.invalidate("users", "calories", "calories-bulk"),
+    )
+
+
+def redis_client_from_env():
+    """Client of the redis at REDIS_URL (default redis://localhost:6379/0), for stores shared
+    between processes."""
+    import redis  # Only needed for shared stores
+
+    return redis.Redis.from_url(
+        os.environ["REDIS_URL"]
+        if "REDIS_URL" in os.environ
+        else "redis://localhost:6379/0"
+    )
+
+
+def result_cache_from_env():
+    """In-process LRU of RESULT_CACHE_SIZE responses (default 1024, 0 disables).
+
+    RESULT_CACHE_BACKEND=redis shares the cache between processes instead, through
+    redis_client_from_env(), with entries expiring after RESULT_CACHE_TTL_SECONDS (default 300).
+    """
+    max_entries = (
+        int(os.environ["RESULT_CACHE_SIZE"])
+        if "RESULT_CACHE_SIZE" in os.environ
+        else 1024
+    )
+    if max_entries <= 0:
+        return None
+    kind = (
+        os.environ["RESULT_CACHE_BACKEND"]
+        if "RESULT_CACHE_BACKEND" in os.environ
+        else "lru"
+    )
+    if kind == "redis":
+        ttl = (
+            int(os.environ["RESULT_CACHE_TTL_SECONDS"])
+            if "RESULT_CACHE_TTL_SECONDS" in os.environ
+            else 300
+        )
+        backend = StoreBackend(redis_client_from_env(), ttl)
+    else:
+        backend = LRUBackend(max_entries)
+    result_cache = ResultCache(backend)
+    invalidate_on_writes(result_cache)
+    return result_cache
@@ -1,12 +1,54 @@
 from role import Role
-from exceptions import NotAllowedException, UnknownCalorieException
-from database import Calorie
+from exceptions import (
+    InvalidRequestException,
+    NotAllowedException,
+    UnknownCalorieException,
+    UnknownUserException,
+)
+from database import (
+    Calorie,
+    CalorieRollup,
+    CalorieTombstone,
+    DBSession,
+    User,
+    calorie_partitioning,
+    filter_to_sql,
+    utc_timestamp,
+)
+from sqlalchemy import and_, exists, func, literal, select, text
+from concurrent.futures import Future
+import changes
+import csv
+import database
+import datetime
+import events
+import foods
+import importer
+import io
+from logs import logger
+import partitions
+import queue
+import rollups
+import search
+import stats
 import os
+import threading
+import time
 import requests
 import urllib.parse
 
 
 class Calories:
+    columns = [
+        "id",
+        "text",
+        "number_of_calories",
+        "username",
+        "date",
+        "time",
+        "below_expected",
+    ]
+
     def __init__(self, db_session):
         self._storage = _Storage(db_session)
         self._current_user = None
@@ -17,12 +59,27 @@ class Calories:
         self._current_user = username
         self._current_role = role
         self._expected_calories_per_day = exp_cal_pd
+        self._storage.set_session_user(username)
 
     def create(self, username, date, time, text, number_of_calories=0):
         if self._current_user != username and self._current_role != Role.ADMIN:
             raise NotAllowedException
 
-        calories_today = self._storage.get_total_calories_for_day(date)
+        if group_writer:
+            entry = {
+                "text": text,
+                "number_of_calories": number_of_calories,
+                "username": username,
+                "date": date,
+                "time": time,
+            }
+            cal_dict, seq = group_writer.submit(entry, self._expected_calories_per_day)
+            if self._current_user != username:
+                database.note_writes([self._current_user])
+            events.publish("calorie_created", calorie=cal_dict, seq=seq)
+            return cal_dict
+
+        calories_today = self._storage.get_total_calories_for_day(username, date)
         below_expected = True
         if calories_today + number_of_calories > self._expected_calories_per_day:
             below_expected = False
@@ -35,8 +92,9 @@ class Calories:
             time=time,
             below_expected=below_expected,
         )
-        cal_dict = self._storage.create(calorie).__dict__.copy()
-        cal_dict.pop("_sa_instance_state")
+        calorie, seq = self._storage.create(calorie)
+        cal_dict = self.as_dict(calorie)
+        events.publish("calorie_created", calorie=cal_dict, seq=seq)
         return cal_dict
 
     def remove(self, entry_id):
@@ -49,7 +107,238 @@ class Calories:
             and self._current_role != Role.ADMIN
         ):
             raise NotAllowedException
-        self._storage.remove(entry_id)
+        entry_dict = self.as_dict(entry)
+        seq = self._storage.remove(entry_id, entry.username)
+        events.publish("calorie_removed", calorie=entry_dict, seq=seq)
+
+    def bulk_remove(self, username=None, before=None):
+        """Admin only. Remove all entries, optionally only username's or those dated before before."""
+        if self._current_role != Role.ADMIN:
+            raise NotAllowedException
+        count, days, seq = self._storage.remove_where(username, before)
+        events.publish("calories_removed", username=username, days=days, seq=seq)
+        return count
+
+    def bulk_import(self, rows, chunk_size=5000, progress=None):
+        """Admin only. Insert (line number, row dict) pairs, chunk_size rows per transaction.
+
+        below_expected is worked out from running per user-day totals, seeded by one grouped query
+        per chunk. Returns counts and the first max_import_errors rejected rows.
+        """
+        if self._current_role != Role.ADMIN:
+            raise NotAllowedException
+        report = {"calories": 0, "rejected": 0, "errors": []}
+        expected = {}  # Expected calories per day by username, None for unknown users
+        totals = {}  # Calories so far by (username, date)
+        usernames = set()
+        chunk = []
+        for line, row in rows:
+            try:
+                chunk.append((line, importer.validate(row)))
+            except ValueError as e:
+                _reject(report, line, str(e))
+            if len(chunk) == chunk_size:
+                self._import_chunk(chunk, expected, totals, usernames, report)
+                chunk = []
+                if progress:
+                    progress(report["calories"], report["rejected"])
+        if chunk:
+            self._import_chunk(chunk, expected, totals, usernames, report)
+        if progress:
+            progress(report["calories"], report["rejected"])
+        if usernames:
+            events.publish("calories_imported", usernames=usernames)
+        report["errors"].sort(key=lambda error: error["line"])
+        return report
+
+    def _import_chunk(self, chunk, expected, totals, usernames, report):
+        new_users = {entry["username"] for _, entry in chunk} - expected.keys()
+        expected.update(self._storage.get_expected_calories(new_users))
+        new_days = {
+            (entry["username"], entry["date"])
+            for _, entry in chunk
+            if expected[entry["username"]] is not None
+        } - totals.keys()
+        totals.update(self._storage.get_daily_totals(new_days))
+        entries = []
+        for line, entry in chunk:
+            if expected[entry["username"]] is None:
+                _reject(report, line, "unknown user " + entry["username"])
+                continue
+            day = (entry["username"], entry["date"])
+            totals[day] += entry["number_of_calories"]
+            entry["below_expected"] = totals[day] <= expected[entry["username"]]
+            entries.append(entry)
+        if entries:
+            self._storage.create_many(entries)
+            usernames.update(entry["username"] for entry in entries)
+        report["calories"] += len(entries)
+
+    def read_scope(self, username=None):
+        """Permission checked scope of a listing. Listings with equal scopes have equal results."""
+        if (
+            username
+            and self._current_user != username
+            and self._current_role != Role.ADMIN
+        ):
+            raise NotAllowedException
+        return self._current_role, username
+
+    def export(self, columns, username=None, filter=None, batch_size=1000):
+        """Same entries as read(), as an iterator of row batches from a server-side cursor."""
+        self.read_scope(username)
+        columns = self._projection(columns)
+        return self._storage.iter_batches(columns, username, filter, batch_size)
+
+    def read_rows(self, username=None, filter=None, columns=None):
+        """Same entries as read(), as tuples of columns (default all of them) ordered by id."""
+        self.read_scope(username)
+        return self._storage.get_rows(self._projection(columns), username, filter)
+
+    def read_ids(self, ids, columns=None):
+        """Entries with the given ids, as read_rows() does, from one query. Ids that don't exist
+        are left out. Like read(), only admins may read other users' entries."""
+        try:
+            ids = sorted({int(entry_id) for entry_id in ids})
+        except (TypeError, ValueError):
+            raise InvalidRequestException
+        if not ids or len(ids) > max_read_ids:
+            raise InvalidRequestException
+        rows = self._storage.get_rows(
+            ["username", *self._projection(columns)], None, None, ids=ids
+        )
+        if self._current_role != Role.ADMIN and any(
+            row[0] != self._current_user for row in rows
+        ):
+            raise NotAllowedException
+        return [row[1:] for row in rows]
+
+    def read_changed(self, since, username=None, filter=None, columns=None):
+        """Delta sync: entries created or updated after the timestamp since, as read_rows() does,
+        and the ids of entries deleted after it.
+
+        Returns (rows, deleted ids, timestamp to pass as since next time, reset). reset means
+        deletions that far back are no longer kept: rows are then every entry, to replace what
+        the client has. Archived entries are not reported as deleted.
+        """
+        self.read_scope(username)
+        columns = self._projection(columns)
+        try:
+            since = datetime.datetime.fromisoformat(since.rstrip("Z"))
+        except (AttributeError, ValueError):
+            raise InvalidRequestException
+        now = datetime.datetime.utcnow()
+        if since < now - tombstone_retention:
+            rows = self._storage.get_rows(columns, username, filter)
+            return rows, [], utc_timestamp(now), True
+        # Transactions that began before since was handed out may commit after it, so each sync
+        # overlaps the previous one. Clients apply deletions first, then the changed entries.
+        after = utc_timestamp(since - sync_overlap)
+        rows = self._storage.get_rows(columns, username, filter, after)
+        deleted = self._storage.get_deleted(username, after)
+        return rows, deleted, utc_timestamp(now), False
+
+    @classmethod
+    def as_dict(cls, cal_obj):
+        return {column: getattr(cal_obj, column) for column in cls.columns}
+
+    def _projection(self, columns):
+        if not columns:
+            return self.columns
+        if not set(columns) <= set(self.columns):
+            raise InvalidRequestException
+        return columns
+
+    def search(self, query, username=None, limit=50):
+        """Entries whose text has every word of query, the last as a prefix, best match first.
+
+        Admins search every user's entries unless given a username, everyone else their own.
+        """
+        if not search.words(query):
+            raise InvalidRequestException
+        if not username and self._current_role != Role.ADMIN:
+            username = self._current_user
+        self.read_scope(username)
+        return [
+            dict(zip(self.columns, row))
+            for row in self._storage.search(query, username, limit)
+        ]
+
+    def suggest(self, prefix, limit=10):
+        """Foods starting with prefix for the current user's next entry, as text and calories.
+
+        The user's own foods come first, then other users' most entered ones.
+        """
+        if not food_index:
+            return []
+        username = self._current_user
+        suggestions = food_index.suggest(
+            username,
+            prefix,
+            limit,
+            lambda: self._storage.get_foods(username),
+            self._storage.get_food_counts,
+        )
+        return [
+            {"text": text, "number_of_calories": calories}
+            for text, calories in suggestions
+        ]
+
+    def rollups(self, username, start, end, period=None):
+        """username's totals by period for the inclusive range start to end (YYYY-MM-DD).
+
+        Periods overlapping the range are included whole. By default the period is the coarsest one
+        lining up with the range, so a year from January 1st reads twelve month rows.
+        """
+        self.read_scope(username)
+        try:
+            if not period:
+                period = rollups.coarsest_period(start, end)
+            elif period not in rollups.periods:
+                raise InvalidRequestException
+            first = rollups.period_start(period, start)
+        except (TypeError, ValueError):
+            raise InvalidRequestException
+        totals = [
+            {"start": period_start, "calories": calories, "entries": entries}
+            for period_start, calories, entries in self._storage.get_rollups(
+                username, period, first, end
+            )
+        ]
+        return {
+            "period": period,
+            "totals": totals,
+            "calories": sum(total["calories"] for total in totals),
+            "entries": sum(total["entries"] for total in totals),
+        }
+
+    def stats(self, username, start=None, end=None, window=7):
+        """username's calorie trends over the inclusive range start to end, see stats.trends."""
+        self.read_scope(username)
+        try:
+            for date in (start, end):
+                if date:
+                    datetime.date.fromisoformat(date)
+            window = int(window)
+        except (TypeError, ValueError):
+            raise InvalidRequestException
+        if not 0 < window <= 366:
+            raise InvalidRequestException
+        expected = self._storage.get_expected_calories([username])[username]
+        if expected is None:
+            raise UnknownUserException
+        days = self._storage.get_day_totals(username, start, end)
+        try:
+            return stats.trends(
+                [date for date, _ in days],
+                [total for _, total in days],
+                expected,
+                start,
+                end,
+                window,
+            )
+        except ValueError:
+            raise InvalidRequestException
 
     def read(self, entry_id=None, filter=None, username=None):
         if entry_id:
@@ -62,13 +351,10 @@ class Calories:
                 and self._current_role != Role.ADMIN
             ):
                 raise NotAllowedException
-            entry_dict = vars(entry)
-            entry_dict.pop("_sa_instance_state")
-            return entry_dict
+            return self.as_dict(entry)
 
         if username:
-            if self._current_user != username and self._current_role != Role.ADMIN:
-                raise NotAllowedException
+            self.read_scope(username)
             if filter:
                 entries = self._storage.get_where(filter, username)
                 ret_val = {}
@@ -86,9 +372,7 @@ class Calories:
                 entries = self._storage.get_by_username(username)
                 ret_val = {}
                 for entry in entries:
-                    entry_dict = vars(entry)
-                    entry_dict.pop("_sa_instance_state")
-                    ret_val[entry.id] = entry_dict
+                    ret_val[entry.id] = self.as_dict(entry)
                 return ret_val
         else:
             if filter:
@@ -108,9 +392,7 @@ class Calories:
                 entries = self._storage.get_all()
                 ret_val = {}
                 for entry in entries:
-                    entry_dict = vars(entry)
-                    entry_dict.pop("_sa_instance_state")
-                    ret_val[entry.id] = entry_dict
+                    ret_val[entry.id] = self.as_dict(entry)
                 return ret_val
 
 
@@ -118,38 +400,411 @@ class _Storage:
     def __init__(self, db_session):
         self._db_session = db_session
 
-    def remove(self, entry_id):
+    def set_session_user(self, username):
+        """Lets the session keep this user's reads on the primary after they write."""
+        self._db_session.info["username"] = username
+
+    def remove(self, entry_id, username):
+        insert_tombstones(self._db_session, Calorie.id == entry_id)
         self._db_session.query(Calorie).filter(Calorie.id == entry_id).delete()
+        seq = changes.record(self._db_session, "calorie", "delete", entry_id, username)
         self._db_session.commit()
+        return seq
+
+    def remove_where(self, username=None, before=None):
+        query = self._db_session.query(Calorie)
+        if username:
+            query = query.filter(Calorie.username == username)
+        if before:
+            query = query.filter(Calorie.date < before)
+        days = {
+            (name, date): (calories or 0, entries)
+            for name, date, calories, entries in query.with_entities(
+                Calorie.username,
+                Calorie.date,
+                func.sum(Calorie.number_of_calories),
+                func.count(),
+            ).group_by(Calorie.username, Calorie.date)
+        }
+        insert_tombstones(self._db_session, query.whereclause)
+        count = query.delete(synchronize_session=False)
+        seq = changes.record(
+            self._db_session, "calorie", "bulk_delete", username=username
+        )
+        self._db_session.commit()
+        return count, days, seq
 
     def create(self, cal_obj):
+        if calorie_partitioning:
+            partitions.ensure_partition(self._db_session.get_bind(), cal_obj.date)
         self._db_session.add(cal_obj)
+        self._db_session.flush()
+        seq = _record_created(self._db_session, cal_obj)
+        self._db_session.commit()
+        return self._db_session.query(Calorie).get(cal_obj.id), seq
+
+    def create_all(self, cal_objs):
+        if calorie_partitioning:
+            for date in {cal_obj.date for cal_obj in cal_objs}:
+                partitions.ensure_partition(self._db_session.get_bind(), date)
+        self._db_session.add_all(cal_objs)
+        self._db_session.flush()
+        seqs = [_record_created(self._db_session, cal_obj) for cal_obj in cal_objs]
         self._db_session.commit()
-        return self._db_session.query(Calorie).get(cal_obj.id)
+        return seqs
+
+    def create_many(self, entries):
+        now = utc_timestamp()
+        for entry in entries:
+            entry["created_at"] = entry["updated_at"] = now
+        if calorie_partitioning:
+            for date in {entry["date"][:7] + "-01" for entry in entries}:
+                partitions.ensure_partition(self._db_session.get_bind(), date)
+        connection = self._db_session.connection()
+        if connection.dialect.name == "postgresql":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(
+                [entry[column] for column in _copy_columns] for entry in entries
+            )
+            buffer.seek(0)
+            cursor = connection.connection.cursor()
+            cursor.copy_expert(
+                f"COPY calorie ({', '.join(_copy_columns)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        else:
+            connection.execute(Calorie.__table__.insert(), entries)
+        for username in sorted({entry["username"] for entry in entries}):
+            changes.record(self._db_session, "calorie", "import", username=username)
+        self._db_session.commit()
+
+    def get_expected_calories(self, usernames):
+        """Expected calories per day of each of usernames, None for those that don't exist."""
+        expected = dict.fromkeys(usernames)
+        if usernames:
+            query = self._db_session.query(
+                User.username, User.expected_calories_per_day
+            ).filter(User.username.in_(usernames))
+            expected.update(query.all())
+        return expected
+
+    def get_daily_totals(self, days):
+        """Total calories of each (username, date) in days, from one grouped query."""
+        totals = dict.fromkeys(days, 0)
+        if days:
+            dates = [date for _, date in days]
+            query = (
+                self._db_session.query(
+                    Calorie.username, Calorie.date, func.sum(Calorie.number_of_calories)
+                )
+                .filter(Calorie.username.in_({username for username, _ in days}))
+                .filter(Calorie.date.between(min(dates), max(dates)))
+                .group_by(Calorie.username, Calorie.date)
+            )
+            for username, date, total in query:
+                if (username, date) in totals:
+                    totals[username, date] = total or 0
+        return totals
 
     def get(self, entry_id):
         return self._db_session.query(Calorie).get(entry_id)
 
     def get_all(self):
-        return self._db_session.query(Calorie)
+        with self._db_session.replica_reads():
+            return self._db_session.query(Calorie).all()
 
     def get_by_username(self, username):
-        return self._db_session.query(Calorie).filter(Calorie.username == username)
+        with self._db_session.replica_reads():
+            return (
+                self._db_session.query(Calorie)
+                .filter(Calorie.username == username)
+                .all()
+            )
 
     def get_where(self, search_filter, username=None):
         query = "SELECT * FROM calorie WHERE "
-        query += (
-            search_filter.replace("eq", "=")
-            .replace("ne", "<>")
-            .replace("gt", ">")
-            .replace("lt", "<")
-        )
+        query += filter_to_sql(search_filter)
         query += f" AND username = '{username}'" if username else ""
-        print(query)
-        return self._db_session.execute(query)
-
-    def get_total_calories_for_day(self, the_date):
-        query = f"SELECT SUM(number_of_calories) FROM calorie WHERE date='{the_date}'"
-        for x in self._db_session.execute(query):
-            return x[0] if x[0] else 0
-        return 0
+        logger.debug("Filter query: %s", query)
+        with self._db_session.replica_reads():
+            return self._db_session.execute(query).fetchall()
+
+    def _select(self, columns, username, search_filter, updated_after=None, ids=None):
+        query = self._db_session.query(
+            *[getattr(Calorie, column) for column in columns]
+        )
+        if username:
+            query = query.filter(Calorie.username == username)
+        if search_filter:
+            query = query.filter(text(filter_to_sql(search_filter)))
+        if updated_after:
+            query = query.filter(Calorie.updated_at > updated_after)
+        if ids:
+            query = query.filter(Calorie.id.in_(ids))
+        return query.order_by(Calorie.id)
+
+    def get_rows(self, columns, username, search_filter, updated_after=None, ids=None):
+        query = self._select(columns, username, search_filter, updated_after, ids)
+        with self._db_session.replica_reads():
+            return query.all()
+
+    def get_deleted(self, username, deleted_after):
+        # SQLite reuses the id of the newest entry once it is deleted
+        reused = exists().where(
+            and_(
+                Calorie.id == CalorieTombstone.id,
+                Calorie.created_at >= CalorieTombstone.deleted_at,
+            )
+        )
+        query = self._db_session.query(CalorieTombstone.id).filter(
+            CalorieTombstone.deleted_at > deleted_after, ~reused
+        )
+        if username:
+            query = query.filter(CalorieTombstone.username == username)
+        with self._db_session.replica_reads():
+            return [entry_id for entry_id, in query.order_by(CalorieTombstone.id)]
+
+    def iter_batches(self, columns, username, search_filter, batch_size):
+        query = self._select(columns, username, search_filter)
+        with self._db_session.replica_reads():
+            connection = self._db_session.connection()
+        result = connection.execution_options(stream_results=True).execute(
+            query.statement
+        )
+        return _batches(result, batch_size)
+
+    def search(self, query, username, limit):
+        dialect = self._db_session.get_bind().dialect.name
+        statement, params = search.search_statement(dialect, query, username, limit)
+        with self._db_session.replica_reads():
+            return self._db_session.execute(statement, params).fetchall()
+
+    def get_foods(self, username):
+        query = (
+            self._db_session.query(Calorie.text, Calorie.number_of_calories)
+            .filter(Calorie.username == username)
+            .order_by(Calorie.id)
+        )
+        with self._db_session.replica_reads():
+            return query.all()
+
+    def get_food_counts(self):
+        """(text, calories, count) of every food, the most common calories of a food last."""
+        count = func.count()
+        query = (
+            self._db_session.query(Calorie.text, Calorie.number_of_calories, count)
+            .group_by(Calorie.text, Calorie.number_of_calories)
+            .order_by(count)
+        )
+        with self._db_session.replica_reads():
+            return query.all()
+
+    def get_rollups(self, username, period, first, end):
+        query = (
+            self._db_session.query(
+                CalorieRollup.period_start,
+                CalorieRollup.calories,
+                CalorieRollup.entries,
+            )
+            .filter(
+                CalorieRollup.username == username,
+                CalorieRollup.period == period,
+                CalorieRollup.period_start.between(first, end),
+                CalorieRollup.entries > 0,
+            )
+            .order_by(CalorieRollup.period_start)
+        )
+        with self._db_session.replica_reads():
+            return query.all()
+
+    def get_day_totals(self, username, start=None, end=None):
+        """(date, calories) of each of username's days with entries, in date order."""
+        query = self._db_session.query(
+            Calorie.date, func.coalesce(func.sum(Calorie.number_of_calories), 0)
+        ).filter(Calorie.username == username)
+        if start:
+            query = query.filter(Calorie.date >= start)
+        if end:
+            query = query.filter(Calorie.date <= end)
+        with self._db_session.replica_reads():
+            return query.group_by(Calorie.date).order_by(Calorie.date).all()
+
+    def get_total_calories_for_day(self, username, the_date):
+        total = (
+            self._db_session.query(func.sum(Calorie.number_of_calories))
+            .filter(Calorie.username == username, Calorie.date == the_date)
+            .scalar()
+        )
+        return total if total else 0
+
+
+class GroupCommitWriter:
+    """Coalesces concurrent Calories.create calls into one transaction on a writer thread.
+
+    A transaction takes the entries submitted within max_wait_ms of its first one, up to max_batch.
+    below_expected comes from running per user-day totals read inside that transaction.
+    """
+
+    def __init__(self, session_factory=DBSession, max_wait_ms=2, max_batch=500):
+        self.session_factory = session_factory
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+        self.commits = 0
+        self.entries = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def submit(self, entry, expected_calories_per_day):
+        """Blocks until entry is committed. Returns it as a dict, like Calories.create, and the
+        seq of its change."""
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="group-commit", daemon=True
+                )
+                self._thread.start()
+        future = Future()
+        self._queue.put((entry, expected_calories_per_day, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(
+                        self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                    )
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        try:
+            cal_objs, seqs = self._write(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][2].set_exception(e)
+                return
+            # Retry the entries one by one, so only the one at fault fails
+            for item in batch:
+                self._commit([item])
+            return
+        self.commits += 1
+        self.entries += len(batch)
+        # The writer's session has no user, so record the owners' writes for replica reads
+        database.note_writes({entry["username"] for entry, _, _ in batch})
+        for cal_obj, seq, (_, _, future) in zip(cal_objs, seqs, batch):
+            future.set_result((Calories.as_dict(cal_obj), seq))
+
+    def _write(self, batch):
+        """Inserts the batch's entries in one transaction. Returns their Calorie objects and
+        change seqs."""
+        db_session = self.session_factory(expire_on_commit=False)
+        storage = _Storage(db_session)
+        try:
+            totals = storage.get_daily_totals(
+                {(entry["username"], entry["date"]) for entry, _, _ in batch}
+            )
+            cal_objs = []
+            for entry, expected, _ in batch:
+                day = (entry["username"], entry["date"])
+                totals[day] += entry["number_of_calories"]
+                cal_objs.append(
+                    Calorie(**entry, below_expected=totals[day] <= expected)
+                )
+            return cal_objs, storage.create_all(cal_objs)
+        except Exception:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.close()
+
+
+def group_commit_from_env():
+    """GROUP_COMMIT_MS > 0 turns on group commit of calorie creates (default 0, off).
+
+    GROUP_COMMIT_MAX_BATCH (default 500) caps the entries per transaction.
+    """
+    max_wait_ms = (
+        float(os.environ["GROUP_COMMIT_MS"]) if "GROUP_COMMIT_MS" in os.environ else 0
+    )
+    if max_wait_ms <= 0:
+        return None
+    max_batch = (
+        int(os.environ["GROUP_COMMIT_MAX_BATCH"])
+        if "GROUP_COMMIT_MAX_BATCH" in os.environ
+        else 500
+    )
+    return GroupCommitWriter(DBSession, max_wait_ms, max_batch)
+
+
+def _record_created(db_session, cal_obj):
+    change = Calories.as_dict(cal_obj)
+    return changes.record(
+        db_session, "calorie", "create", cal_obj.id, cal_obj.username, change
+    )
+
+
+def insert_tombstones(db_session, condition=None):
+    """Record the entries matching condition (all if None) as deleted, in db_session's
+    transaction, before they are deleted. Also drops tombstones older than tombstone_retention.
+    """
+    now = datetime.datetime.utcnow()
+    tombstone = CalorieTombstone.__table__
+    db_session.execute(
+        tombstone.delete().where(
+            tombstone.c.deleted_at < utc_timestamp(now - tombstone_retention)
+        )
+    )
+    deleted = select([Calorie.id, Calorie.username, literal(utc_timestamp(now))])
+    if condition is not None:
+        deleted = deleted.where(condition)
+    db_session.execute(
+        tombstone.insert().from_select(["id", "username", "deleted_at"], deleted)
+    )
+
+
+group_writer = group_commit_from_env()
+food_index = foods.food_index_from_env()
+
+_copy_columns = [
+    "text",
+    "number_of_calories",
+    "username",
+    "date",
+    "time",
+    "below_expected",
+    "created_at",
+    "updated_at",
+]
+max_import_errors = 100
+max_read_ids = 1000  # Ids per GET /calories?ids=
+# How long deletions are kept for delta syncs, older syncs start over
+tombstone_retention = datetime.timedelta(
+    days=(
+        float(os.environ["TOMBSTONE_RETENTION_DAYS"])
+        if "TOMBSTONE_RETENTION_DAYS" in os.environ
+        else 30
+    )
+)
+sync_overlap = datetime.timedelta(seconds=5)
+
+
+def _reject(report, line, error):
+    report["rejected"] += 1
+    if len(report["errors"]) < max_import_errors:
+        report["errors"].append({"line": line, "error": error})
+
+
+def _batches(result, batch_size):
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [tuple(row) for row in rows]
+    finally:
+        result.close()
@@ -0,0 +1,173 @@
+"""Change feed of calorie and user writes for incremental sync, read with GET /changes?since=.
+
+Every write adds a row to change_log with an increasing seq, in the transaction of the write
+itself, so a change is committed exactly when its write is. On PostgreSQL the change log is
+locked from the insert until the commit, so seqs commit in order even across processes and a
+client that has seen seq never misses a smaller one. SQLite has one writer at a time anyway.
+Bulk operations are recorded as one change telling clients to reload.
+
+ops by entity:
+
+* calorie: create (data is the entry), delete, bulk_delete and import (reload the user's
+  entries, everyone's if username is None), archive (entries dated before key were archived)
+* user: update (includes creation), delete, bulk_delete
+"""
+
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+import database
+import events
+import partitions
+from database import Change
+from logs import logger
+
+max_wait = 30  # Longest long-poll, in seconds
+
+
+# Serializes change log writers on PostgreSQL, see record()
+_lock_key = 0x6368616E6765
+
+
+def record(db, entity, op, key=None, username=None, data=None):
+    """Adds a change in the transaction of db, a session or connection, just before it commits.
+
+    Returns its seq, or None when the change feed is off.
+    """
+    if not enabled:
+        return None
+    change = Change.__table__
+    bind = db.get_bind() if isinstance(db, Session) else db
+    if bind.dialect.name == "postgresql":
+        db.execute(select([func.pg_advisory_xact_lock(_lock_key)]))
+    seq = db.execute(
+        change.insert().values(
+            entity=entity,
+            op=op,
+            key=None if key is None else str(key),
+            username=username,
+            data=None if data is None else json.dumps(data),
+        )
+    ).inserted_primary_key[0]
+    if retention and seq % 1000 == 0:
+        db.execute(change.delete().where(change.c.seq <= seq - retention))
+    return seq
+
+
+class ChangeLog:
+    """Wakes long polls when this process commits a write. Other processes' writes are found by
+    the polls re-reading change_log."""
+
+    def __init__(self):
+        self.generation = 0  # Writes committed by this process
+        self._changed = threading.Condition()
+
+    def subscribe(self):
+        for event in _write_events:
+            events.subscribe(event, lambda **kwargs: self.notify())
+
+    def notify(self):
+        with self._changed:
+            self.generation += 1
+            self._changed.notify_all()
+
+    def wait(self, generation, timeout):
+        """Until this process has committed a write after generation, or timeout seconds."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.generation != generation, timeout)
+
+
+class ArchiveWatcher:
+    """Publishes calories_archived in this process for each archive change in change_log.
+
+    archive.py runs as its own process, so its writes only reach the server's result cache and
+    long polls through the change it records. The months it may have dropped partitions of are
+    forgotten too, so the next insert for one of them creates the partition again.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        with engine.connect() as connection:
+            self.seq = self._newest_seq(connection)
+
+    def start(self, interval):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception("Polling for archive runs failed")
+
+        threading.Thread(target=run, name="archive-watcher", daemon=True).start()
+
+    def poll(self):
+        with self.engine.connect() as connection:
+            newest = self._newest_seq(connection)
+            archived = connection.execute(
+                select([Change.key])
+                .where(
+                    and_(
+                        Change.seq > self.seq,
+                        Change.seq <= newest,
+                        Change.entity == "calorie",
+                        Change.op == "archive",
+                    )
+                )
+                .order_by(Change.seq)
+            ).fetchall()
+        self.seq = newest
+        for (before,) in archived:
+            partitions.forget_before(before)
+            events.publish("calories_archived", before=before)
+
+    @staticmethod
+    def _newest_seq(connection):
+        return connection.execute(select([func.max(Change.seq)])).scalar() or 0
+
+
+def change_log_from_env():
+    """None when CHANGE_FEED=off."""
+    if not enabled:
+        return None
+    change_log = ChangeLog()
+    change_log.subscribe()
+    return change_log
+
+
+def archive_watcher_from_env():
+    """Polls every ARCHIVE_POLL_SECONDS (default 60, 0 disables). Needs the change feed, and is
+    off for the in-memory test database, which has no other processes."""
+    interval = (
+        float(os.environ["ARCHIVE_POLL_SECONDS"])
+        if "ARCHIVE_POLL_SECONDS" in os.environ
+        else 60
+    )
+    in_memory = database.sql_connect in ("sqlite://", "sqlite:///:memory:")
+    if not enabled or in_memory or interval <= 0:
+        return None
+    watcher = ArchiveWatcher(database.engine)
+    watcher.start(interval)
+    return watcher
+
+
+_write_events = [
+    "calorie_created",
+    "calorie_removed",
+    "calories_removed",
+    "calories_imported",
+    "calories_archived",
+    "user_changed",
+    "user_removed",
+    "users_removed",
+]
+# CHANGE_FEED=off disables recording. CHANGE_RETENTION (default 100000) changes are kept.
+enabled = not ("CHANGE_FEED" in os.environ and os.environ["CHANGE_FEED"] == "off")
+retention = (
+    int(os.environ["CHANGE_RETENTION"]) if "CHANGE_RETENTION" in os.environ else 100000
+)
@@ -0,0 +1,25 @@
+"""In-process notifications about committed writes.
+
+Published by Users and Calories after each commit:
+
+* calorie_created(calorie, seq) / calorie_removed(calorie, seq) - calorie is the entry as a dict
+* calories_removed(username, days, seq) - bulk removal, of every user's entries if username is
+  None. days holds the (calories, entries) removed for each (username, date)
+
+seq is the write's change_log seq, None when the change feed is off.
+* calories_imported(usernames) - bulk import of entries owned by the set usernames
+* calories_archived(before) - entries dated before before moved to cold storage
+* user_changed(username) / user_removed(username)
+* users_removed() - bulk removal of users and their calories
+"""
+
+_subscribers = {}
+
+
+def subscribe(event, callback):
+    _subscribers.setdefault(event, []).append(callback)
+
+
+def publish(event, **kwargs):
+    for callback in _subscribers.get(event, []):
+        callback(**kwargs)
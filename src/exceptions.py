@@ -24,3 +24,40 @@ class InvalidRequestException(Exception):
 
 class UserAlreadyExistsException(Exception):
     pass
+
+
+class IdempotencyKeyReusedException(Exception):
+    pass
+
+
+class RateLimitedException(Exception):
+    def __init__(self, retry_after=1):
+        super().__init__()
+        self.retry_after = retry_after
+
+
+class OverloadedException(Exception):
+    pass
+
+
+# Status and error message returned for each exception, by app.py and async_app.py
+error_responses = {
+    UnknownCalorieException: (404, "Calorie not found."),
+    NotAllowedException: (403, "Not authorized."),
+    UserAlreadyExistsException: (400, "User already exists."),
+    InvalidRequestException: (400, "Invalid request."),
+    UnknownUserException: (404, "User not found."),
+    InitialAdminRoleException: (400, "Can't change admin username or role."),
+    IdempotencyKeyReusedException: (
+        422,
+        "Idempotency-Key was already used for a different request.",
+    ),
+}
+
+
+def error_response(e):
+    """(status, message) for e, from the nearest of its classes in error_responses."""
+    for cls in type(e).__mro__:
+        if cls in error_responses:
+            return error_responses[cls]
+    return None
@@ -0,0 +1,90 @@
+"""Streaming serializers for calorie exports.
+
+Each takes the column names and an iterator of row batches and yields encoded chunks, one per
+batch, so an export never holds more than a batch in memory.
+"""
+
+import csv
+import io
+import json
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export is optional
+    pyarrow = None
+
+
+def ndjson_stream(columns, batches):
+    for rows in batches:
+        yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+
+
+def csv_stream(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():  # Header only
+        yield buffer.getvalue()
+
+
+class _Chunks(io.RawIOBase):
+    """Write-only file collecting what ParquetWriter wrote since the last drain()."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_type(column):
+    if column in ("id", "number_of_calories"):
+        return pyarrow.int64()
+    if column == "below_expected":
+        return pyarrow.bool_()
+    return pyarrow.string()
+
+
+def parquet_stream(columns, batches):
+    """One row group per batch."""
+    schema = pyarrow.schema([(column, _parquet_type(column)) for column in columns])
+    sink = _Chunks()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for rows in batches:
+        arrays = [
+            pyarrow.array(values, type=field.type)
+            for values, field in zip(zip(*rows), schema)
+        ]
+        writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+formats = {
+    "ndjson": ("application/x-ndjson", ndjson_stream),
+    "csv": ("text/csv", csv_stream),
+}
+if pyarrow:
+    formats["parquet"] = ("application/vnd.apache.parquet", parquet_stream)
@@ -0,0 +1,165 @@
+"""In-memory autocomplete of food names from calorie history.
+
+Each user gets a sorted prefix index of the foods they have entered with the calories they last
+entered for each, and one global index ranks every user's foods by popularity. Indexes are loaded
+from the calorie table the first time they are needed and then follow calorie events.
+"""
+
+import bisect
+import heapq
+import os
+import threading
+from collections import OrderedDict
+
+import events
+
+max_scan = 2000  # Matches ranked per lookup, bounds the work for one letter prefixes
+
+
+def normalize(text):
+    return " ".join(str(text).lower().split())
+
+
+class PrefixIndex:
+    """Foods kept sorted by normalized name, so a prefix is a contiguous range found by bisect."""
+
+    def __init__(self):
+        self._keys = []
+        self._foods = {}  # Normalized name -> [text, calories, count]
+
+    def add(self, text, calories, count=1):
+        key = normalize(text)
+        if not key:
+            return
+        food = self._foods.get(key)
+        if food is None:
+            bisect.insort(self._keys, key)
+            self._foods[key] = [text, calories, count]
+        else:
+            food[0], food[1] = text, calories
+            food[2] += count
+
+    def remove(self, text):
+        key = normalize(text)
+        food = self._foods.get(key)
+        if food is None:
+            return
+        food[2] -= 1
+        if food[2] <= 0:
+            del self._foods[key]
+            del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def suggest(self, prefix, limit):
+        """Up to limit (text, calories, count) starting with prefix, most entered first."""
+        prefix = normalize(prefix)
+        start = bisect.bisect_left(self._keys, prefix)
+        matches = []
+        for key in self._keys[start : start + max_scan]:
+            if not key.startswith(prefix):
+                break
+            matches.append(self._foods[key])
+        return [
+            tuple(food) for food in heapq.nlargest(limit, matches, key=lambda f: f[2])
+        ]
+
+
+class FoodIndex:
+    def __init__(self, max_users=10000):
+        self.max_users = max_users
+        # Username -> PrefixIndex, least recently used first
+        self._users = OrderedDict()
+        self._popular = None
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        events.subscribe("calorie_created", self._calorie_created)
+        events.subscribe("calorie_removed", self._calorie_removed)
+        events.subscribe("calories_imported", self._forget)
+        events.subscribe(
+            "calories_removed",
+            lambda username, days, seq=None: self._forget([username]),
+        )
+        events.subscribe("user_removed", lambda username: self._forget([username]))
+        events.subscribe("users_removed", lambda: self._forget([None]))
+        # Archived entries are still the user's history, so calories_archived changes nothing
+
+    def suggest(self, username, prefix, limit, load_user, load_popular):
+        """username's own foods matching prefix, then popular ones, as (text, calories) pairs.
+
+        load_user() returns username's (text, calories) in entry order, load_popular()
+        (text, calories, count) for every food. Called only when the index isn't loaded.
+        """
+        with self._lock:
+            user_index = self._users.get(username)
+            if user_index is not None:
+                self._users.move_to_end(username)
+            popular = self._popular
+        if user_index is None:
+            user_index = PrefixIndex()
+            for text, calories in load_user():
+                user_index.add(text, calories)
+            with self._lock:
+                user_index = self._users.setdefault(username, user_index)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+        if popular is None:
+            popular = PrefixIndex()
+            for text, calories, count in load_popular():
+                popular.add(text, calories, count)
+            with self._lock:
+                if self._popular is None:
+                    self._popular = popular
+                popular = self._popular
+        with self._lock:
+            suggestions = [food[:2] for food in user_index.suggest(prefix, limit)]
+            seen = {normalize(text) for text, _ in suggestions}
+            for text, calories, _ in popular.suggest(prefix, limit + len(seen)):
+                if len(suggestions) == limit:
+                    break
+                if normalize(text) not in seen:
+                    suggestions.append((text, calories))
+        return suggestions
+
+    def clear(self):
+        self._forget([None])
+
+    def _calorie_created(self, calorie, seq=None):
+        with self._lock:
+            for index in self._indexes(calorie["username"]):
+                index.add(calorie["text"], calorie["number_of_calories"])
+
+    def _calorie_removed(self, calorie, seq=None):
+        with self._lock:
+            for index in self._indexes(calorie["username"]):
+                index.remove(calorie["text"])
+
+    def _indexes(self, username):
+        return [
+            index
+            for index in (self._users.get(username), self._popular)
+            if index is not None
+        ]
+
+    def _forget(self, usernames):
+        """Drop indexes after bulk changes, they reload when next used. None means everyone."""
+        with self._lock:
+            self._popular = None
+            for username in usernames:
+                if username is None:
+                    self._users.clear()
+                else:
+                    self._users.pop(username, None)
+
+
+def food_index_from_env():
+    """Food autocomplete for up to FOOD_INDEX_USERS users at a time (default 10000, 0 disables)."""
+    max_users = (
+        int(os.environ["FOOD_INDEX_USERS"])
+        if "FOOD_INDEX_USERS" in os.environ
+        else 10000
+    )
+    if max_users <= 0:
+        return None
+    food_index = FoodIndex(max_users)
+    food_index.subscribe()
+    return food_index
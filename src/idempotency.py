@@ -0,0 +1,81 @@
+"""Idempotency-Key support for creates, so a retried request doesn't write twice.
+
+The first request with a key runs and its response is kept. Retries with the same key get that
+response back without touching the database, and retries that arrive while the first is still
+running wait for it. Only successful responses are kept: a failed request wrote nothing and may
+be retried for real. The store is a bounded LRU per process, so keys are honoured for
+IDEMPOTENCY_TTL_SECONDS or until evicted, whichever is first.
+"""
+
+import os
+import threading
+import time
+
+from cache import LRUBackend
+from exceptions import IdempotencyKeyReusedException, InvalidRequestException
+
+max_key_length = 255
+
+
+class IdempotencyStore:
+    def __init__(self, backend, ttl=86400):
+        self.backend = backend
+        self.ttl = ttl
+        self._running = {}  # Key -> Event set when the first request finishes
+        self._lock = threading.Lock()
+
+    def run(self, key, fingerprint, produce):
+        """produce()'s (status, mimetype, body), or the one kept for key if a request with it
+        succeeded before. fingerprint identifies the request, a key can't be reused for another.
+        """
+        if len(key[-1]) > max_key_length:
+            raise InvalidRequestException
+        key = repr(key)
+        while True:
+            with self._lock:
+                kept = self._kept(key)
+                if kept is None:
+                    running = self._running.get(key)
+                    if running is None:
+                        self._running[key] = threading.Event()
+                        break
+            if kept is not None:
+                if kept[1] != fingerprint:
+                    raise IdempotencyKeyReusedException
+                return kept[2]
+            running.wait()
+        try:
+            response = produce()
+            if response[0] < 400:
+                self.backend.set(key, (time.monotonic(), fingerprint, response))
+            return response
+        finally:
+            with self._lock:
+                self._running.pop(key).set()
+
+    def _kept(self, key):
+        kept = self.backend.get(key)
+        if kept is None or time.monotonic() - kept[0] > self.ttl:
+            return None
+        return kept
+
+    def clear(self):
+        self.backend.clear()
+
+
+def idempotency_store_from_env():
+    """Keeps the responses of the last IDEMPOTENCY_KEYS keys (default 10000, 0 disables) for
+    IDEMPOTENCY_TTL_SECONDS (default 86400)."""
+    max_keys = (
+        int(os.environ["IDEMPOTENCY_KEYS"])
+        if "IDEMPOTENCY_KEYS" in os.environ
+        else 10000
+    )
+    if max_keys <= 0:
+        return None
+    ttl = (
+        float(os.environ["IDEMPOTENCY_TTL_SECONDS"])
+        if "IDEMPOTENCY_TTL_SECONDS" in os.environ
+        else 86400
+    )
+    return IdempotencyStore(LRUBackend(max_keys), ttl)
@@ -0,0 +1,87 @@
+"""Bulk import of historic calorie entries from CSV or NDJSON files.
+
+Each row needs username, date (YYYY-MM-DD), time (HH:MM) and text, number_of_calories defaults to
+0. Run from this directory against DATABASE_URL, e.g.
+
+    python importer.py --format csv history.csv
+
+or as admin over HTTP with POST /calories/import?format=csv and the file as the request body.
+Rows are inserted in chunks, one transaction each, and invalid rows are reported and skipped.
+"""
+
+import argparse
+import codecs
+import csv
+import datetime
+import json
+import sys
+
+fields = ["username", "date", "time", "text", "number_of_calories"]
+
+
+def read_rows(stream, format):
+    """(line number, row dict) pairs from a binary stream, without reading it all into memory."""
+    lines = codecs.iterdecode(stream, "utf-8")
+    if format == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == "ndjson":
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row
+    else:
+        raise ValueError(f"unknown format {format}")
+
+
+def validate(row):
+    """Raises ValueError with the reason if row is not a valid calorie entry."""
+    if not isinstance(row, dict):
+        raise ValueError("not an object")
+    missing = [field for field in fields[:4] if not row.get(field)]
+    if missing:
+        raise ValueError("missing " + ", ".join(missing))
+    entry = {field: str(row[field]) for field in fields[:4]}
+    datetime.datetime.strptime(entry["date"], "%Y-%m-%d")
+    datetime.datetime.strptime(entry["time"], "%H:%M")
+    try:
+        entry["number_of_calories"] = int(row.get("number_of_calories") or 0)
+    except TypeError:
+        raise ValueError("number_of_calories is not a number")
+    if entry["number_of_calories"] < 0:
+        raise ValueError("negative number_of_calories")
+    return entry
+
+
+if __name__ == "__main__":
+    import database
+    from role import Role
+    from users import Users
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", help="path, or - for stdin")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    db_session = database.get_db_session()
+    calories = Users(db_session).calories
+    calories.set_user_session(None, Role.ADMIN, None)
+    stream = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+    with stream:
+        report = calories.bulk_import(
+            read_rows(stream, args.format),
+            args.chunk_size,
+            lambda imported, rejected: print(
+                f"{imported} imported, {rejected} rejected", file=sys.stderr
+            ),
+        )
+    db_session.close()
+    for error in report["errors"]:
+        print(f"line {error['line']}: {error['error']}")
+    print(f"Imported {report['calories']} entries, rejected {report['rejected']}")
@@ -0,0 +1,146 @@
+"""Non-blocking, sampled logging for the API.
+
+Records go through a bounded in-memory queue to a listener thread that does the formatting
+(including tracebacks) and writes to stderr, so a request thread never waits on the stream.
+Under a storm of errors a per second budget keeps the log readable and the queue short: records
+over budget are dropped and counted, and the count is added to the next record that is written.
+
+Access logs are JSON lines on stdout, one per request (or a sample of them), through a queue of
+their own.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+
+class SamplingFilter(logging.Filter):
+    """Passes up to per_second records each second, 0 for no limit."""
+
+    def __init__(self, per_second=20):
+        super().__init__()
+        self.per_second = per_second
+        self.suppressed = 0
+        self._second = None
+        self._passed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.per_second:
+            return True
+        second = int(time.monotonic())
+        with self._lock:
+            if second != self._second:
+                self._second = second
+                self._passed = 0
+            if self._passed >= self.per_second:
+                self.suppressed += 1
+                return False
+            self._passed += 1
+            suppressed, self.suppressed = self.suppressed, 0
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} earlier records suppressed)"
+        return True
+
+
+class AccessSampler(logging.Filter):
+    """Passes a ratio of access records, and every server error."""
+
+    def __init__(self, ratio=1.0):
+        super().__init__()
+        self.ratio = ratio
+
+    def filter(self, record):
+        return record.msg["status"] >= 500 or random.random() < self.ratio
+
+
+class JsonFormatter(logging.Formatter):
+    """Record messages that are dicts as JSON objects, with the time first."""
+
+    def format(self, record):
+        return json.dumps({"time": self.formatTime(record), **record.msg})
+
+
+class AsyncHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread as they are, dropping them if the queue is full."""
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record  # Formatted by the listener, the queue never leaves the process
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def queued_logger(name, stream, formatter, sampler):
+    """Logger name, writing to stream from a listener thread through a queue of LOG_QUEUE_SIZE
+    (default 10000) records. sampler filters records before they are queued."""
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    queue_size = (
+        int(os.environ["LOG_QUEUE_SIZE"]) if "LOG_QUEUE_SIZE" in os.environ else 10000
+    )
+    handler = AsyncHandler(queue.Queue(queue_size))
+    handler.addFilter(sampler)
+    output = logging.StreamHandler(stream)
+    output.setFormatter(formatter)
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    atexit.register(listener.stop)  # Writes out whatever is still queued
+    logger.addHandler(handler)
+    return logger
+
+
+def logger_from_env():
+    """The API's logger, writing to stderr.
+
+    LOG_LEVEL (default INFO) sets the level, LOG_SAMPLE_PER_SECOND (default 20, 0 for no limit)
+    the records written per second.
+    """
+    per_second = (
+        int(os.environ["LOG_SAMPLE_PER_SECOND"])
+        if "LOG_SAMPLE_PER_SECOND" in os.environ
+        else 20
+    )
+    logger = queued_logger(
+        "health",
+        sys.stderr,
+        logging.Formatter("%(asctime)s %(levelname)s %(threadName)s %(message)s"),
+        SamplingFilter(per_second),
+    )
+    logger.setLevel(os.environ["LOG_LEVEL"] if "LOG_LEVEL" in os.environ else "INFO")
+    return logger
+
+
+def access_logger_from_env():
+    """JSON access log on stdout. ACCESS_LOG_SAMPLE (default 1) is the ratio of requests logged,
+    server errors are always logged. ACCESS_LOG=off disables it."""
+    if "ACCESS_LOG" in os.environ and os.environ["ACCESS_LOG"] == "off":
+        return None
+    ratio = (
+        float(os.environ["ACCESS_LOG_SAMPLE"])
+        if "ACCESS_LOG_SAMPLE" in os.environ
+        else 1.0
+    )
+    access_logger = queued_logger(
+        "health.access", sys.stdout, JsonFormatter(), AccessSampler(ratio)
+    )
+    access_logger.setLevel(logging.INFO)
+    return access_logger
+
+
+logger = logger_from_env()
+access_logger = access_logger_from_env()
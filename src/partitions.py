@@ -0,0 +1,148 @@
+"""Monthly range partitioning of the calorie table on PostgreSQL.
+
+Dates are stored as 'YYYY-MM-DD' strings, so each month is the string range ['YYYY-MM', next
+month). Postgres prunes partitions itself for any query with a date condition, including the
+filters of GET /calories. Rows with dates outside every partition land in calorie_default.
+"""
+
+import threading
+
+from sqlalchemy import exc, text
+
+partitioned_calorie_ddl = """
+CREATE TABLE IF NOT EXISTS calorie (
+    id SERIAL,
+    text VARCHAR,
+    number_of_calories INTEGER,
+    username VARCHAR REFERENCES "user" (username) ON DELETE CASCADE,
+    date VARCHAR NOT NULL,
+    time VARCHAR,
+    below_expected BOOLEAN,
+    created_at VARCHAR,
+    updated_at VARCHAR,
+    PRIMARY KEY (id, date)
+) PARTITION BY RANGE (date)
+"""
+
+_known = set()  # Months with a partition, so inserts only pay for DDL once per month
+_known_lock = threading.Lock()
+
+
+def month_of(date):
+    return date[:7]
+
+
+def next_month(month):
+    year, month_number = int(month[:4]), int(month[5:7])
+    if month_number == 12:
+        return f"{year + 1:04d}-01"
+    return f"{year:04d}-{month_number + 1:02d}"
+
+
+def partition_name(month):
+    return f"calorie_y{month[:4]}m{month[5:7]}"
+
+
+def create_partitioned_table(connection):
+    with _known_lock:
+        _known.clear()
+    connection.execute(text(partitioned_calorie_ddl))
+    connection.execute(
+        text("CREATE TABLE IF NOT EXISTS calorie_default PARTITION OF calorie DEFAULT")
+    )
+
+
+def ensure_partition(engine, date):
+    """Create the partition for date's month if it does not exist yet.
+
+    Runs on its own autocommit connection so the partition survives the caller rolling back.
+    """
+    month = month_of(date)
+    if month in _known or len(month) != 7:
+        return
+    try:
+        engine.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF calorie "
+                f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+            )
+        )
+    except exc.DBAPIError:
+        # Fine if another process created the same partition first
+        if not partition_exists(engine, month):
+            try:
+                _create_from_default(engine, month)
+            except exc.DBAPIError:
+                if not partition_exists(engine, month):
+                    raise
+    with _known_lock:
+        _known.add(month)
+
+
+def _create_from_default(engine, month):
+    """Create month's partition when calorie_default holds rows of the month, which makes
+    CREATE ... PARTITION OF fail. That happens when entries are added for a month whose
+    partition archiving dropped, e.g. by an import of old entries.
+    """
+    name = partition_name(month)
+    with engine.begin() as connection:
+        # Keeps new rows of the month out of calorie_default until the partition is attached
+        connection.execute(
+            text("LOCK TABLE calorie_default IN SHARE ROW EXCLUSIVE MODE")
+        )
+        connection.execute(
+            text(f"CREATE TABLE {name} (LIKE calorie INCLUDING DEFAULTS)")
+        )
+        connection.execute(
+            text(
+                "WITH moved AS (DELETE FROM calorie_default "
+                "WHERE date >= :start AND date < :end RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            ),
+            start=month,
+            end=next_month(month),
+        )
+        connection.execute(
+            text(
+                f"ALTER TABLE calorie ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+            )
+        )
+
+
+def partition_exists(connection, month):
+    return (
+        connection.execute(
+            text("SELECT to_regclass(:name)"), name=partition_name(month)
+        ).scalar()
+        is not None
+    )
+
+
+def drop_partition(connection, month):
+    """Instant removal of a whole month, used by archiving instead of a DELETE."""
+    connection.execute(text(f"DROP TABLE IF EXISTS {partition_name(month)}"))
+    with _known_lock:
+        _known.discard(month)
+
+
+def forget_before(before):
+    """Stop assuming the months entirely before before have a partition, after an archive run
+    in another process may have dropped them."""
+    with _known_lock:
+        _known.difference_update(
+            [month for month in _known if next_month(month) <= before]
+        )
+
+
+def partition_months(connection):
+    """Months that currently have a partition."""
+    rows = connection.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = 'calorie' AND child.relname LIKE 'calorie_y%'"
+        )
+    )
+    return sorted(f"{name[9:13]}-{name[14:16]}" for (name,) in rows)
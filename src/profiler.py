@@ -0,0 +1,162 @@
+"""Sampling profiler that can be switched on while the API is serving.
+
+A background thread reads every thread's stack with sys._current_frames() every few milliseconds,
+so profiled code runs unmodified and the cost is one stack walk per thread per sample. Stacks are
+written in collapsed format, one "thread;outer frame;...;inner frame count" line per stack, which
+flamegraph.pl, speedscope and similar tools read.
+
+Admins start a profile of every thread with POST /admin/profile for a number of seconds or
+requests. With PROFILE_REQUESTS=on, e.g. in development, any request with ?profile=1 is profiled
+on its own and the file is named in the X-Profile response header.
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import threading
+from collections import Counter
+
+from exceptions import InvalidRequestException
+
+max_seconds = 300  # Longest profile, also for those counting requests
+
+
+def collapse(frame, thread_name):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    """Counts the stacks of thread_ids (default every thread but its own) every interval seconds."""
+
+    def __init__(self, interval=0.005, thread_ids=None):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (
+                    self.thread_ids is not None and ident not in self.thread_ids
+                ):
+                    continue
+                self.stacks[collapse(frame, names.get(ident, str(ident)))] += 1
+            self.samples += 1
+
+
+def write_collapsed(stacks, directory, name):
+    """Writes stacks to directory/profile-<time>-<name>.collapsed and returns the path."""
+    os.makedirs(directory, exist_ok=True)
+    started = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(directory, f"profile-{started}-{name}.collapsed")
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+
+class Profiler:
+    """At most one whole process profile at a time, ended by time or a count of requests."""
+
+    def __init__(self, directory, interval=0.005, per_request=False):
+        self.directory = directory
+        self.interval = interval
+        self.per_request = per_request
+        self.last_file = None
+        self._sampler = None
+        self._requests_left = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def start(self, seconds=None, requests=None):
+        """Profile for seconds, or until requests more requests finished, at most max_seconds."""
+        if (seconds is None) == (requests is None):
+            raise InvalidRequestException
+        if (seconds is not None and not 0 < seconds <= max_seconds) or (
+            requests is not None and requests < 1
+        ):
+            raise InvalidRequestException
+        with self._lock:
+            if self._sampler:
+                raise InvalidRequestException  # Already profiling
+            self._sampler = Sampler(self.interval).start()
+            self._requests_left = requests
+            self._timer = threading.Timer(seconds or max_seconds, self.finish)
+            self._timer.daemon = True
+            self._timer.start()
+        return self.status()
+
+    def request_finished(self):
+        with self._lock:
+            if self._requests_left is None:
+                return
+            self._requests_left -= 1
+            if self._requests_left > 0:
+                return
+        self.finish()
+
+    def finish(self):
+        with self._lock:
+            sampler, self._sampler = self._sampler, None
+            self._requests_left = None
+            if self._timer:
+                self._timer.cancel()
+        if sampler:
+            self.last_file = write_collapsed(sampler.stop(), self.directory, "all")
+        return self.last_file
+
+    def status(self):
+        return {
+            "running": self._sampler is not None,
+            "requests_left": self._requests_left,
+            "last_file": self.last_file,
+        }
+
+    def profile_request(self):
+        """A started Sampler of the calling thread, for one request."""
+        return Sampler(self.interval, {threading.get_ident()}).start()
+
+    def finish_request(self, sampler, request_id):
+        return write_collapsed(sampler.stop(), self.directory, request_id)
+
+
+def profiler_from_env():
+    """Profiles go to PROFILE_DIR (default <temp dir>/health-profiles), sampled every
+    PROFILE_INTERVAL_MS (default 5). PROFILE_REQUESTS=on enables ?profile=1."""
+    directory = (
+        os.environ["PROFILE_DIR"]
+        if "PROFILE_DIR" in os.environ
+        else os.path.join(tempfile.gettempdir(), "health-profiles")
+    )
+    interval_ms = (
+        float(os.environ["PROFILE_INTERVAL_MS"])
+        if "PROFILE_INTERVAL_MS" in os.environ
+        else 5
+    )
+    per_request = (
+        "PROFILE_REQUESTS" in os.environ and os.environ["PROFILE_REQUESTS"] == "on"
+    )
+    return Profiler(directory, interval_ms / 1000, per_request)
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+
+from cache import redis_client_from_env
+from exceptions import OverloadedException, RateLimitedException
+from logs import logger
+
+# Tokens each request costs, keyed by "<METHOD> <rule>". Anything not listed costs 1.
+route_costs = {
+    "GET /calories": 5,  # Unfiltered reads are full-table scans
+    "GET /calories/export": 20,
+    "POST /calories/import": 20,
+    "GET /users": 2,
+    "POST /login": 5,  # Password hash check
+    "POST /users": 5,  # Password hashing
+}
+
+
+class InProcessBackend:
+    """Token buckets held in this process, so each worker process limits on its own.
+
+    Any object with the same take() method can replace it, e.g. StoreBackend.
+    """
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, last refill time)
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, capacity, now):
+        """Refill key's bucket and remove cost tokens. Returns 0 if allowed else seconds to wait."""
+        with self._lock:
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate
+
+
+# InProcessBackend.take() as one atomic step in redis. Waits are returned as strings, redis
+# truncates Lua numbers to integers. Idle buckets expire once they would be full again.
+_take_script = """
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "last")
+local cost, rate, capacity, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local tokens = tonumber(bucket[1]) or capacity
+local last = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call("HMSET", KEYS[1], "tokens", tostring(tokens), "last", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class StoreBackend:
+    """Token buckets in a store shared between processes, via a redis client, so limits hold
+    across every worker and host."""
+
+    def __init__(self, client, prefix="rate-limit:"):
+        self._take = client.register_script(_take_script)
+        self._prefix = prefix
+
+    def take(self, key, cost, rate, capacity, now):
+        return float(
+            self._take(keys=[self._prefix + key], args=[cost, rate, capacity, now])
+        )
+
+
+class RateLimiter:
+    def __init__(self, rate, capacity, costs=None, backend=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.costs = route_costs if costs is None else costs
+        self.backend = backend if backend else InProcessBackend()
+
+    def check(self, key, route):
+        cost = min(self.costs.get(route, 1), self.capacity)
+        wait = self.backend.take(key, cost, self.rate, self.capacity, time.time())
+        if wait:
+            raise RateLimitedException(wait)
+
+
+class AdmissionControl:
+    """Caps requests in flight so load is shed before the database pool saturates."""
+
+    def __init__(self, max_in_flight):
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+
+    def enter(self):
+        if not self._slots.acquire(blocking=False):
+            raise OverloadedException
+
+    def leave(self):
+        self._slots.release()
+
+
+def rate_limiter_from_env():
+    """Rate limiting is off unless RATE_LIMIT_PER_SECOND is set.
+
+    Buckets are per process unless RATE_LIMIT_BACKEND=redis shares them through
+    redis_client_from_env().
+    """
+    if "RATE_LIMIT_PER_SECOND" not in os.environ:
+        return None
+    rate = float(os.environ["RATE_LIMIT_PER_SECOND"])
+    capacity = (
+        float(os.environ["RATE_LIMIT_BURST"])
+        if "RATE_LIMIT_BURST" in os.environ
+        else rate * 10
+    )
+    kind = (
+        os.environ["RATE_LIMIT_BACKEND"]
+        if "RATE_LIMIT_BACKEND" in os.environ
+        else "memory"
+    )
+    backend = StoreBackend(redis_client_from_env()) if kind == "redis" else None
+    return RateLimiter(rate, capacity, backend=backend)
+
+
+def admission_control_from_env(pool_connections=None):
+    """MAX_IN_FLIGHT (0 disables) defaults to pool_connections, the database connections the
+    process can use at once, or 64 if there's no limit. More would queue on the pool before any
+    load is shed."""
+    default = pool_connections if pool_connections else 64
+    max_in_flight = (
+        int(os.environ["MAX_IN_FLIGHT"]) if "MAX_IN_FLIGHT" in os.environ else default
+    )
+    if pool_connections and max_in_flight > pool_connections:
+        logger.warning(
+            "MAX_IN_FLIGHT %s is more than the %s pooled database connections, "
+            "requests will queue for a connection instead of being shed",
+            max_in_flight,
+            pool_connections,
+        )
+    return AdmissionControl(max_in_flight) if max_in_flight > 0 else None
@@ -0,0 +1,428 @@
+"""Per user calorie totals by day, week (starting Monday) and month, kept in calorie_rollup.
+
+Creates and removals, including bulk deletes (as the totals of each day deleted), are applied as
+deltas by a background worker, a few milliseconds behind the write. Bulk imports have the
+affected users reconciled against the calorie table instead, and a periodic reconcile repairs
+anything written without events, e.g. by importer.py in another process.
+
+A reconcile records the newest change_log seq it counted (calorie_rollup_mark), and deltas of
+changes up to it are skipped when they arrive later. Day rollups keep the part of their totals
+whose entries were archived, and reconciling sets a day to its live total plus that part.
+Writes made with the change feed off have no seq, so their deltas are always applied.
+
+Run from this directory for a full reconcile, e.g. after restoring a backup:
+
+    python rollups.py
+"""
+
+import datetime
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import and_, bindparam, func, select, text, true
+
+import database
+import events
+from logs import logger
+from database import Calorie, CalorieRollup, CalorieRollupMark, Change, User
+
+periods = ["day", "week", "month"]
+
+_upsert = text(
+    "INSERT INTO calorie_rollup (username, period, period_start, calories, entries) "
+    "VALUES (:username, :period, :period_start, :calories, :entries) "
+    "ON CONFLICT (username, period, period_start) DO UPDATE SET "
+    "calories = calorie_rollup.calories + excluded.calories, "
+    "entries = calorie_rollup.entries + excluded.entries"
+)
+# Taken first by every transaction that reads rollups to write them, in any process: a write to
+# the everyone mark row, which holds its row lock on PostgreSQL and the write lock on SQLite
+_lock = text(
+    "INSERT INTO calorie_rollup_mark (username, seq) VALUES ('', 0) "
+    "ON CONFLICT (username) DO UPDATE SET seq = calorie_rollup_mark.seq"
+)
+_set_mark = text(
+    "INSERT INTO calorie_rollup_mark (username, seq) VALUES (:username, :seq) "
+    "ON CONFLICT (username) DO UPDATE SET seq = excluded.seq"
+)
+
+
+def period_start(period, date):
+    """First day of the day, week or month containing date. Dates are YYYY-MM-DD strings."""
+    day = datetime.date.fromisoformat(date)
+    if period == "month":
+        day = day.replace(day=1)
+    elif period == "week":
+        day -= datetime.timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+def period_end(period, start):
+    """Last day of the period beginning on start."""
+    day = datetime.date.fromisoformat(start)
+    if period == "month":
+        day = (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        day -= datetime.timedelta(days=1)
+    elif period == "week":
+        day += datetime.timedelta(days=6)
+    return day.isoformat()
+
+
+def coarsest_period(start, end):
+    """Coarsest period whose boundaries line up with the inclusive range start to end."""
+    for period in ("month", "week"):
+        if period_start(period, start) == start and (
+            period_end(period, period_start(period, end)) == end
+        ):
+            return period
+    return "day"
+
+
+def _rollup_rows(day_totals, rollup_periods):
+    """Rows for calorie_rollup from {(username, date): (calories, entries)}."""
+    rows = {}
+    for (username, date), (calories, entries) in day_totals.items():
+        try:
+            starts = [(period, period_start(period, date)) for period in rollup_periods]
+        except ValueError:
+            continue  # Not a YYYY-MM-DD date, so not part of any period
+        for period, start in starts:
+            row = rows.setdefault((username, period, start), [0, 0])
+            row[0] += calories
+            row[1] += entries
+    return [
+        {
+            "username": username,
+            "period": period,
+            "period_start": start,
+            "calories": calories,
+            "entries": entries,
+        }
+        for (username, period, start), (calories, entries) in rows.items()
+    ]
+
+
+def add_archived(connection, day_totals):
+    """Count {(username, date): (calories, entries)} as archived in the day rollups, in the
+    transaction that deletes those entries, so reconciling keeps them."""
+    rollup = CalorieRollup.__table__
+    rows = [
+        {
+            "name": username,
+            "start": date,
+            "add_calories": calories,
+            "add_entries": entries,
+        }
+        for (username, date), (calories, entries) in day_totals.items()
+    ]
+    if rows:
+        connection.execute(_lock)
+        connection.execute(
+            rollup.update()
+            .where(
+                and_(
+                    rollup.c.username == bindparam("name"),
+                    rollup.c.period == "day",
+                    rollup.c.period_start == bindparam("start"),
+                )
+            )
+            .values(
+                archived_calories=rollup.c.archived_calories
+                + bindparam("add_calories"),
+                archived_entries=rollup.c.archived_entries + bindparam("add_entries"),
+            ),
+            rows,
+        )
+
+
+class RollupWorker:
+    def __init__(self, engine, background=True, reconcile_seconds=3600):
+        self.engine = engine
+        self.reconcile_seconds = reconcile_seconds
+        self._queue = queue.Queue() if background else None
+        self._lock = threading.Lock()  # One rollup transaction at a time
+
+    def start(self):
+        events.subscribe("calorie_created", self._calorie_created)
+        events.subscribe("calorie_removed", self._calorie_removed)
+        events.subscribe("calories_imported", self._calories_imported)
+        events.subscribe("calories_removed", self._calories_removed)
+        events.subscribe("user_removed", self._user_removed)
+        events.subscribe("users_removed", self._users_removed)
+        # Not calories_archived, rollups outlive the entries they were built from
+        if self._queue is not None:
+            threading.Thread(target=self._run, name="rollups", daemon=True).start()
+
+    def flush(self):
+        """Wait until everything submitted so far has been applied."""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _calorie_created(self, calorie, seq=None):
+        key = (calorie["username"], calorie["date"])
+        self._submit(self.apply, {key: (calorie["number_of_calories"] or 0, 1)}, seq)
+
+    def _calorie_removed(self, calorie, seq=None):
+        key = (calorie["username"], calorie["date"])
+        self._submit(
+            self.apply, {key: (-(calorie["number_of_calories"] or 0), -1)}, seq
+        )
+
+    def _calories_imported(self, usernames):
+        self._submit(self.reconcile, sorted(usernames))
+
+    def _calories_removed(self, username, days, seq=None):
+        # Only the deleted days change, days of archived entries keep their rollups
+        deltas = {
+            key: (-calories, -entries) for key, (calories, entries) in days.items()
+        }
+        self._submit(self.apply, deltas, seq)
+
+    def _user_removed(self, username):
+        self._submit(self.remove_users, [username])
+
+    def _users_removed(self):
+        self._submit(self.remove_users)
+
+    def _submit(self, task, *args):
+        if self._queue is None:
+            task(*args)
+        else:
+            self._queue.put((task, args))
+
+    def _run(self):
+        next_reconcile = time.monotonic() + self.reconcile_seconds
+        while True:
+            timeout = None
+            if self.reconcile_seconds:
+                timeout = max(0, next_reconcile - time.monotonic())
+            try:
+                tasks = [self._queue.get(timeout=timeout)]
+            except queue.Empty:
+                self._safely(self.reconcile)
+                next_reconcile = time.monotonic() + self.reconcile_seconds
+                continue
+            while True:  # Take whatever else is waiting, so bursts share transactions
+                try:
+                    tasks.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            changes = []
+            for task, args in tasks:
+                if task == self.apply:
+                    changes.append(args)
+                    continue
+                if changes:  # Keep deltas in order with other tasks
+                    self._safely(self.apply_all, changes)
+                    changes = []
+                self._safely(task, *args)
+            if changes:
+                self._safely(self.apply_all, changes)
+            for _ in tasks:
+                self._queue.task_done()
+
+    @staticmethod
+    def _safely(task, *args):
+        try:
+            task(*args)
+        except Exception:
+            logger.exception("Rollup task failed")  # The next reconcile repairs it
+
+    def apply(self, deltas, seq=None):
+        """Add {(username, date): (calories, entries)} to every period's rollups, unless a
+        reconcile already counted change seq."""
+        self.apply_all([(deltas, seq)])
+
+    def apply_all(self, changes):
+        """apply() every (deltas, seq) of changes in one transaction."""
+        mark = CalorieRollupMark.__table__
+        usernames = {username for deltas, _ in changes for username, _ in deltas}
+        with self._lock, self.engine.begin() as connection:
+            connection.execute(_lock)
+            marks = dict(
+                connection.execute(
+                    select([mark.c.username, mark.c.seq]).where(
+                        mark.c.username.in_(usernames | {""})
+                    )
+                ).fetchall()
+            )
+            totals = {}
+            for deltas, seq in changes:
+                for key, (calories, entries) in deltas.items():
+                    if seq is not None and seq <= max(marks.get(key[0], 0), marks[""]):
+                        continue
+                    total = totals.get(key, (0, 0))
+                    totals[key] = (total[0] + calories, total[1] + entries)
+            rows = _rollup_rows(totals, periods)
+            if rows:
+                connection.execute(_upsert, rows)
+
+    def reconcile(self, usernames=None):
+        """Set each day's rollup to the calorie table's total plus its archived part, and rebuild
+        the weeks and months that changed. Only users in usernames if given.
+        """
+        live = select(
+            [
+                Calorie.username,
+                Calorie.date,
+                func.coalesce(func.sum(Calorie.number_of_calories), 0).label(
+                    "calories"
+                ),
+                func.count().label("entries"),
+            ]
+        ).group_by(Calorie.username, Calorie.date)
+        day_query = select(
+            [
+                CalorieRollup.username,
+                CalorieRollup.period_start,
+                CalorieRollup.calories,
+                CalorieRollup.entries,
+                CalorieRollup.archived_calories,
+                CalorieRollup.archived_entries,
+            ]
+        ).where(CalorieRollup.period == "day")
+        if usernames is not None:
+            live = live.where(Calorie.username.in_(usernames))
+            day_query = day_query.where(CalorieRollup.username.in_(usernames))
+        live = live.alias("live")
+        newest = select([func.coalesce(func.max(Change.seq), 0).label("seq")]).alias()
+        # One statement, so the totals and the newest change they include share a snapshot
+        live_query = select([newest.c.seq, live]).select_from(
+            newest.outerjoin(live, true())
+        )
+        rollup = CalorieRollup.__table__
+        day = and_(
+            rollup.c.username == bindparam("name"),
+            rollup.c.period == "day",
+            rollup.c.period_start == bindparam("start"),
+        )
+        with self._lock, self.engine.begin() as connection:
+            connection.execute(_lock)
+            rows = connection.execute(live_query).fetchall()
+            seq = rows[0].seq
+            totals = {
+                (row.username, row.date): (row.calories, row.entries)
+                for row in rows
+                if row.entries is not None
+            }
+            days = {
+                (username, date): totals
+                for username, date, *totals in connection.execute(day_query)
+            }
+            for key, (_, _, archived_calories, archived_entries) in days.items():
+                calories, entries = totals.get(key, (0, 0))
+                totals[key] = (calories + archived_calories, entries + archived_entries)
+            changed = {
+                key: total
+                for key, total in totals.items()
+                if key not in days or tuple(days[key][:2]) != total
+            }
+            emptied = [
+                {"name": username, "start": date}
+                for (username, date), (_, entries) in changed.items()
+                if not entries
+            ]
+            updated = [
+                {"name": username, "start": date, "new_calories": c, "new_entries": e}
+                for (username, date), (c, e) in changed.items()
+                if e and (username, date) in days
+            ]
+            added = _rollup_rows(
+                {key: total for key, total in changed.items() if key not in days},
+                ["day"],
+            )
+            if emptied:
+                connection.execute(rollup.delete().where(day), emptied)
+            if updated:
+                connection.execute(
+                    rollup.update()
+                    .where(day)
+                    .values(
+                        calories=bindparam("new_calories"),
+                        entries=bindparam("new_entries"),
+                    ),
+                    updated,
+                )
+            if added:
+                connection.execute(rollup.insert(), added)
+            connection.execute(
+                _set_mark,
+                [
+                    {"username": username, "seq": seq}
+                    for username in (usernames if usernames is not None else [""])
+                ],
+            )
+            affected = sorted({username for username, _ in changed})
+            if affected:
+                self._rebuild_periods(connection, affected)
+
+    @staticmethod
+    def _rebuild_periods(connection, usernames):
+        rollup = CalorieRollup.__table__
+        days = connection.execute(
+            select(
+                [
+                    rollup.c.username,
+                    rollup.c.period_start,
+                    rollup.c.calories,
+                    rollup.c.entries,
+                ]
+            ).where(and_(rollup.c.period == "day", rollup.c.username.in_(usernames)))
+        )
+        rows = _rollup_rows(
+            {
+                (username, date): (calories, entries)
+                for username, date, calories, entries in days
+            },
+            ["week", "month"],
+        )
+        connection.execute(
+            rollup.delete().where(
+                and_(rollup.c.period != "day", rollup.c.username.in_(usernames))
+            )
+        )
+        if rows:
+            connection.execute(rollup.insert(), rows)
+
+    def remove_users(self, usernames=None):
+        """Drop the rollups of usernames, by default of every user that no longer exists."""
+        rollup = CalorieRollup.__table__
+        if usernames is None:
+            condition = ~rollup.c.username.in_(select([User.username]))
+        else:
+            condition = rollup.c.username.in_(usernames)
+        with self._lock, self.engine.begin() as connection:
+            connection.execute(rollup.delete().where(condition))
+
+
+def rollup_worker_from_env():
+    """ROLLUPS=background (default), inline (applied by the writing thread) or off.
+
+    Inline is the default for the in-memory test database, whose one connection can't be shared
+    with a worker thread. ROLLUP_RECONCILE_SECONDS (default 3600, 0 disables) sets how often the
+    background worker reconciles every user.
+    """
+    in_memory = database.sql_connect in ("sqlite://", "sqlite:///:memory:")
+    mode = (
+        os.environ["ROLLUPS"]
+        if "ROLLUPS" in os.environ
+        else ("inline" if in_memory else "background")
+    )
+    if mode == "off":
+        return None
+    reconcile_seconds = (
+        float(os.environ["ROLLUP_RECONCILE_SECONDS"])
+        if "ROLLUP_RECONCILE_SECONDS" in os.environ
+        else 3600
+    )
+    worker = RollupWorker(database.engine, mode == "background", reconcile_seconds)
+    worker.start()
+    return worker
+
+
+if __name__ == "__main__":
+    started = time.monotonic()
+    RollupWorker(database.engine, background=False).reconcile()
+    print(f"Reconciled rollups in {time.monotonic() - started:.1f}s")
@@ -0,0 +1,120 @@
+"""Word and prefix search over calorie text.
+
+SQLite keeps an FTS5 index, calorie_fts, in step with the calorie table through triggers.
+PostgreSQL uses a GIN index on to_tsvector('simple', text) for words and prefixes, and a pg_trgm
+index for substrings. Other databases, or SQLite builds without FTS5, fall back to LIKE scans.
+
+The last word of a query matches as a prefix, so "banana br" finds "banana bread".
+"""
+
+import re
+
+from sqlalchemy import Boolean, Integer, String, exc, text
+
+_sqlite_fts_ddl = [
+    "CREATE VIRTUAL TABLE calorie_fts USING fts5(text, content='calorie', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS calorie_fts_insert AFTER INSERT ON calorie BEGIN "
+    "INSERT INTO calorie_fts (rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS calorie_fts_delete AFTER DELETE ON calorie BEGIN "
+    "INSERT INTO calorie_fts (calorie_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS calorie_fts_update AFTER UPDATE OF text ON calorie BEGIN "
+    "INSERT INTO calorie_fts (calorie_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO calorie_fts (rowid, text) VALUES (new.id, new.text); END",
+    "INSERT INTO calorie_fts (calorie_fts) VALUES ('rebuild')",  # Index existing entries
+]
+_postgresql_ddl = [
+    "CREATE INDEX IF NOT EXISTS ix_calorie_text_tsv ON calorie "
+    "USING gin (to_tsvector('simple', text))",
+    "CREATE INDEX IF NOT EXISTS ix_calorie_text_trgm ON calorie USING gin (text gin_trgm_ops)",
+]
+# Typed so results convert like ORM reads, e.g. below_expected is a bool on SQLite too
+_column_types = {
+    "id": Integer,
+    "text": String,
+    "number_of_calories": Integer,
+    "username": String,
+    "date": String,
+    "time": String,
+    "below_expected": Boolean,
+}
+_columns = ", ".join(f"calorie.{name}" for name in _column_types)
+
+sqlite_fts = False  # Whether the SQLite build has FTS5, set by create_search_index
+
+
+def create_search_index(bind):
+    global sqlite_fts
+    if bind.dialect.name == "sqlite":
+        with bind.begin() as connection:
+            if connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'calorie_fts'")
+            ).first():
+                sqlite_fts = True
+                return
+            try:
+                for statement in _sqlite_fts_ddl:
+                    connection.execute(text(statement))
+                sqlite_fts = True
+            except exc.OperationalError:
+                sqlite_fts = False  # No FTS5 module, search scans instead
+    elif bind.dialect.name == "postgresql":
+        try:
+            bind.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except exc.DBAPIError:
+            pass  # Needs privileges, substring matches then scan
+        for statement in _postgresql_ddl:
+            try:
+                bind.execute(text(statement))
+            except exc.DBAPIError:
+                pass
+
+
+def drop_search_index(bind):
+    if bind.dialect.name == "sqlite":
+        bind.execute(text("DROP TABLE IF EXISTS calorie_fts"))
+
+
+def words(query):
+    return re.findall(r"\w+", query.lower())
+
+
+def search_statement(dialect, query, username=None, limit=50):
+    """Statement and parameters finding entries matching every word of query, best first."""
+    terms = words(query)
+    params = {"username": username, "limit": limit}
+    scope = " AND calorie.username = :username" if username else ""
+    if dialect == "sqlite" and sqlite_fts:
+        params["match"] = " ".join(f'"{term}"' for term in terms) + "*"
+        return (
+            text(
+                f"SELECT {_columns} FROM calorie_fts "
+                "JOIN calorie ON calorie.id = calorie_fts.rowid "
+                f"WHERE calorie_fts MATCH :match{scope} "
+                "ORDER BY calorie_fts.rank, calorie.id LIMIT :limit"
+            ).columns(**_column_types),
+            params,
+        )
+    if dialect == "postgresql":
+        params["tsquery"] = " & ".join(terms) + ":*"
+        params["pattern"] = "%" + re.sub(r"([\\%_])", r"\\\1", query.strip()) + "%"
+        document = "to_tsvector('simple', calorie.text)"
+        tsquery = "to_tsquery('simple', :tsquery)"
+        return (
+            text(
+                f"SELECT {_columns} FROM calorie "
+                f"WHERE ({document} @@ {tsquery} OR calorie.text ILIKE :pattern){scope} "
+                f"ORDER BY ts_rank({document}, {tsquery}) DESC, calorie.id LIMIT :limit"
+            ).columns(**_column_types),
+            params,
+        )
+    conditions = []
+    for i, term in enumerate(terms):
+        params[f"term{i}"] = f"%{term}%"
+        conditions.append(f"lower(calorie.text) LIKE :term{i}")
+    return (
+        text(
+            f"SELECT {_columns} FROM calorie WHERE {' AND '.join(conditions)}{scope} "
+            "ORDER BY calorie.id LIMIT :limit"
+        ).columns(**_column_types),
+        params,
+    )
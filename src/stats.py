@@ -0,0 +1,138 @@
+"""Nutrition trends for one user, computed on NumPy arrays.
+
+A user's history arrives as one row per day with entries, from a grouped query. It is spread
+onto a dense calendar of days, so rolling windows are differences of cumulative sums and streaks
+are runs found with diff, without a Python loop over days.
+"""
+
+import datetime
+
+import numpy as np
+
+max_days = 3660  # Longest range, about ten years
+weekdays = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+
+def to_days(dates):
+    """datetime64[D] array of YYYY-MM-DD strings, and a mask of the ones that are real dates."""
+    try:
+        return np.array(dates, dtype="datetime64[D]"), np.ones(len(dates), dtype=bool)
+    except ValueError:
+        valid = np.array([_is_date(date) for date in dates], dtype=bool)
+        days = np.array(
+            [date if ok else "NaT" for date, ok in zip(dates, valid)],
+            dtype="datetime64[D]",
+        )
+        return days, valid
+
+
+def _is_date(date):
+    try:
+        return len(date) == 10 and bool(datetime.date.fromisoformat(date))
+    except (TypeError, ValueError):
+        return False
+
+
+def _rounded(values):
+    """Floats rounded for JSON, NaN as None."""
+    return [None if np.isnan(value) else round(value, 1) for value in values.tolist()]
+
+
+def trends(dates, totals, expected, start=None, end=None, window=7):
+    """Statistics of daily calorie totals from start to end (default first to last logged day).
+
+    dates are the YYYY-MM-DD days with entries and totals their calories. expected is the user's
+    expected calories per day. Rolling averages are over the days logged within window days.
+    Raises ValueError for ranges longer than max_days.
+    """
+    days, valid = to_days(dates)
+    days = days[valid]
+    totals = np.asarray(totals, dtype=np.int64)[valid]
+    first = np.datetime64(start, "D") if start else (days.min() if len(days) else None)
+    last = np.datetime64(end, "D") if end else (days.max() if len(days) else None)
+    if first is None or last is None or last < first:
+        return _empty(start, end, expected, window)
+
+    span = int((last - first).astype(np.int64)) + 1
+    if span > max_days:
+        raise ValueError(f"more than {max_days} days")
+    in_range = (days >= first) & (days <= last)
+    offsets = (days[in_range] - first).astype(np.int64)
+    calories = np.zeros(span, dtype=np.int64)
+    calories[offsets] = totals[in_range]
+    logged = np.zeros(span, dtype=bool)
+    logged[offsets] = True
+
+    # Rolling sums as differences of running totals, over however much of the window exists
+    window_sums = np.cumsum(calories)
+    window_sums[window:] -= window_sums[:-window].copy()
+    window_logged = np.cumsum(logged)
+    window_logged[window:] -= window_logged[:-window].copy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rolling = np.where(window_logged > 0, window_sums / window_logged, np.nan)
+
+    # Runs of days over expected: +1 where a run starts, -1 just after it ends
+    over = calories > expected
+    edges = np.diff(np.concatenate(([0], over.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    lengths = np.flatnonzero(edges == -1) - starts
+    longest = int(lengths.argmax()) if len(lengths) else None
+
+    # 1970-01-01 was a Thursday, day 3 counting from Monday
+    weekday = (np.arange(span) + first.astype(np.int64) + 3) % 7
+    weekday_calories = np.bincount(weekday[logged], calories[logged], minlength=7)
+    weekday_days = np.bincount(weekday[logged], minlength=7)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weekday_averages = weekday_calories / weekday_days
+
+    days_logged = int(logged.sum())
+    return {
+        "from": str(first),
+        "to": str(last),
+        "days": span,
+        "days_logged": days_logged,
+        "calories": int(calories.sum()),
+        "average": (
+            round(float(calories.sum()) / days_logged, 1) if days_logged else None
+        ),
+        "expected_calories_per_day": expected,
+        "days_over": int(over.sum()),
+        "longest_streak_over": (
+            {
+                "days": int(lengths[longest]),
+                "from": str(first + starts[longest]),
+            }
+            if longest is not None
+            else None
+        ),
+        "current_streak_over": (
+            int(lengths[-1]) if len(lengths) and starts[-1] + lengths[-1] == span else 0
+        ),
+        "weekdays": dict(zip(weekdays, _rounded(weekday_averages))),
+        "rolling": {"window": window, "averages": _rounded(rolling)},
+    }
+
+
+def _empty(start, end, expected, window):
+    return {
+        "from": start,
+        "to": end,
+        "days": 0,
+        "days_logged": 0,
+        "calories": 0,
+        "average": None,
+        "expected_calories_per_day": expected,
+        "days_over": 0,
+        "longest_streak_over": None,
+        "current_streak_over": 0,
+        "weekdays": dict.fromkeys(weekdays),
+        "rolling": {"window": window, "averages": []},
+    }
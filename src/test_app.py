@@ -88,6 +88,75 @@ class TestCalorieCounter(TestCase):
         self.assertEqual(401, code, body.get("error", ""))
         self.assertEqual({"error": "Wrong username or password."}, body)
 
+    def test_bulk_delete(self):
+        for day in ["2020-05-31", "2020-06-01", "2020-06-02"]:
+            self.post("/calories", bob, self.make_calorie(day, "06:30", "kiwi", 42))
+        body, code = self.delete("/calories?username=bob", bob)
+        self.assertEqual(403, code)
+        body, code = self.delete("/users", bob)
+        self.assertEqual(403, code)
+
+        body, code = self.delete("/calories?username=bob&before=2020-06-01", admin)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual({"deleted": {"calories": 1}}, body)
+
+        body, code = self.delete("/users?filter=role+eq+1", admin)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual({"deleted": {"users": 1, "calories": 2}}, body)
+        body, code = self.get("/calories", admin)
+        self.assertEqual({}, body["calories"])
+        body, code = self.get("/users", admin)
+        self.assertEqual([admin], list(body["users"]))
+
+    def test_list_shapes(self):
+        calorie = self.make_calorie("2020-06-01", "06:30", "kiwi", 42)
+        self.post("/calories", bob, calorie)
+        row = [1, "kiwi", 42, bob, "2020-06-01", "06:30", True]
+
+        body, code = self.get("/calories?username=bob&format=array", bob)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual(
+            [{**calorie, "id": 1, "below_expected": True}], body["calories"]
+        )
+
+        body, code = self.get("/calories?format=columns&filter=text eq 'kiwi'", bob)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual(row, body["calories"]["rows"][0])
+        self.assertEqual("below_expected", body["calories"]["columns"][-1])
+
+        body, code = self.get("/users?format=columns", admin)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual([admin, Role.ADMIN, 2000], body["users"]["rows"][0])
+
+        body, code = self.get("/users?format=xml", admin)
+        self.assertEqual(400, code)
+
+    def test_fields(self):
+        self.post(
+            "/calories", bob, self.make_calorie("2020-06-01", "06:30", "kiwi", 42)
+        )
+
+        body, code = self.get(
+            "/calories?username=bob&fields=date,number_of_calories", bob
+        )
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual(
+            {"1": {"date": "2020-06-01", "number_of_calories": 42}}, body["calories"]
+        )
+
+        body, code = self.get("/calories?fields=number_of_calories&format=columns", bob)
+        self.assertEqual(
+            {"columns": ["number_of_calories"], "rows": [[42]]}, body["calories"]
+        )
+
+        body, code = self.get("/users?fields=role&format=array", admin)
+        self.assertEqual([{"role": Role.ADMIN}, {"role": Role.REGULAR}], body["users"])
+
+        body, code = self.get("/users?fields=hashed_password", admin)
+        self.assertEqual(400, code)
+        body, code = self.get("/calories?fields=id,secret", bob)
+        self.assertEqual(400, code)
+
     def test_get_calorie(self):
         calorie = self.make_calorie("2020-06-01", "06:30", "grapefruit", 42)
         expected = {"calorie": {**calorie, "id": 1, "below_expected": True}}
@@ -185,17 +254,10 @@ class TestCalorieCounter(TestCase):
         self.sally_token = None
 
         #  use admin user to remove all users (apart from admin) and calories
-        body, code = self.get("/users", admin)
+        body, code = self.delete("/users", admin)
         self.assertEqual(200, code, body.get("error", ""))
-        for user in body["users"]:
-            if user != "admin":
-                body, code = self.delete(f"/users/{user}", admin)
-                self.assertEqual(200, code, body.get("error", ""))
-        body, code = self.get("/calories", admin)
+        body, code = self.delete("/calories", admin)
         self.assertEqual(200, code, body.get("error", ""))
-        for calorie_id in body["calories"]:
-            body, code = self.delete(f"/calories/{calorie_id}", admin)
-            self.assertEqual(200, code, body.get("error", ""))
 
         # Confirm Bob no longer exist then re-add him
         body, code = self.get("/users", admin)
@@ -0,0 +1,136 @@
+import contextlib
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from sqlalchemy.exc import DBAPIError
+
+import database
+import events
+import partitions
+from archive import archive
+from calories import Calories
+from changes import ArchiveWatcher
+from partitions import next_month, partition_name
+from role import Role
+
+BOB = "bob"
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self) -> None:
+        database.recreate_db()
+        self.db_session = database.get_db_session()
+        self.calories = Calories(self.db_session)
+        self.calories.set_user_session(BOB, Role.REGULAR, 2000)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.db_session.close()
+        self.tmp_dir.cleanup()
+
+    def test_archive_old_entries(self):
+        for date in ["2020-04-30", "2020-05-01", "2020-05-20", "2020-06-01"]:
+            self.calories.create(BOB, date, "09:30", "banana", 89)
+
+        self.assertEqual(3, archive("2020-05-21", self.tmp_dir.name, batch_size=1))
+
+        remaining = self.calories.read(username=BOB)
+        self.assertEqual(["2020-06-01"], [e["date"] for e in remaining.values()])
+        files = sorted(os.listdir(self.tmp_dir.name))
+        self.assertEqual(2, len(files))
+        self.assertTrue(files[0].startswith("calorie-2020-04."))
+        with gzip.open(os.path.join(self.tmp_dir.name, files[1]), "rt") as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(["2020-05-01", "2020-05-20"], [e["date"] for e in entries])
+        self.assertEqual(
+            {
+                "id": 2,
+                "text": "banana",
+                "number_of_calories": 89,
+                "username": BOB,
+                "date": "2020-05-01",
+                "time": "09:30",
+                "below_expected": True,
+            },
+            entries[0],
+        )
+
+    def test_server_hears_of_archive_runs(self):
+        watcher = ArchiveWatcher(database.engine)
+        self.calories.create(BOB, "2020-04-30", "09:30", "banana", 89)
+        archive("2020-05-01", self.tmp_dir.name)
+
+        heard = []
+        partitions._known.update(["2020-04", "2020-05"])
+        subscribers, events._subscribers = events._subscribers, {}
+        try:
+            events.subscribe("calories_archived", lambda before: heard.append(before))
+            watcher.poll()
+            watcher.poll()
+        finally:
+            events._subscribers = subscribers
+            known = set(partitions._known)
+            partitions._known.discard("2020-05")
+        self.assertEqual(["2020-05-01"], heard)
+        # The archive run may have dropped April's partition, not May's
+        self.assertEqual({"2020-05"}, known)
+
+    def test_nothing_to_archive(self):
+        self.calories.create(BOB, "2020-06-01", "09:30", "banana", 89)
+        self.assertEqual(0, archive("2020-01-01", self.tmp_dir.name))
+        self.assertEqual([], os.listdir(self.tmp_dir.name))
+
+    def test_partition_names(self):
+        self.assertEqual("2021-01", next_month("2020-12"))
+        self.assertEqual("2020-07", next_month("2020-06"))
+        self.assertEqual("calorie_y2020m06", partition_name("2020-06"))
+
+    def test_failed_partition_isnt_cached(self):
+        class StandIn:
+            """Engine failing statements that start with failing, with the partition existing
+            if exists is True."""
+
+            def __init__(self, failing, exists=False):
+                self.failing = failing
+                self.exists = exists
+                self.executed = []
+
+            def execute(self, statement, **params):
+                if str(statement).startswith(self.failing):
+                    raise DBAPIError(str(statement), params, Exception("failed"))
+                self.executed.append(str(statement))
+                return StandInResult(self.exists)
+
+            @contextlib.contextmanager
+            def begin(self):
+                yield self
+
+        class StandInResult:
+            def __init__(self, exists):
+                self.exists = exists
+
+            def scalar(self):
+                return "calorie_y2031m01" if self.exists else None
+
+        self.assertRaises(
+            DBAPIError, partitions.ensure_partition, StandIn("CREATE"), "2031-01-15"
+        )
+        self.assertNotIn("2031-01", partitions._known)
+        # Lost a race
+        partitions.ensure_partition(StandIn("CREATE", exists=True), "2031-01-15")
+        self.assertIn("2031-01", partitions._known)
+        partitions._known.discard("2031-01")
+
+        # calorie_default holds rows of the month
+        engine = StandIn("CREATE TABLE IF NOT EXISTS")
+        partitions.ensure_partition(engine, "2031-01-15")
+        self.assertIn("2031-01", partitions._known)
+        partitions._known.discard("2031-01")
+        self.assertTrue(
+            engine.executed[-1].startswith(
+                "ALTER TABLE calorie ATTACH PARTITION calorie_y2031m01"
+            )
+        )
@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import async_app
+from api_test_case import ApiTestCase
+from users import Role
+
+
+class TestAsyncApp(ApiTestCase):
+    users = []
+
+    def setUp(self) -> None:
+        super().setUp()
+        _, code = self.request(
+            "POST", "/users", data={"expected_calories_per_day": 2000, **bob_creds}
+        )
+        self.assertEqual(200, code)
+        body, _ = self.request("POST", "/login", data=bob_creds)
+        self.tokens[bob] = body["auth_token"]
+
+    def test_get_own_user(self):
+        body, code = self.request("GET", f"/users/{bob}", bob)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual(
+            {"username": bob, "role": Role.REGULAR, "expected_calories_per_day": 2000},
+            body["user"],
+        )
+
+    def test_calories(self):
+        calorie = {
+            "date": "2020-06-01",
+            "time": "06:30",
+            "text": "grapefruit",
+            "number_of_calories": 42,
+            "username": bob,
+        }
+        body, code = self.request("POST", "/calories", bob, calorie)
+        self.assertEqual(200, code, body.get("error", ""))
+        expected = {**calorie, "id": 1, "below_expected": True}
+        self.assertEqual({"calorie": expected}, body)
+
+        body, code = self.request("GET", "/calories?username=bob", bob)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual({"calories": {"1": expected}}, body)
+
+        body, code = self.request("GET", "/calories?username=bob&format=array", bob)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual({"calories": [expected]}, body)
+
+    def test_errors(self):
+        body, code = self.request("GET", f"/users/{admin}", bob)
+        self.assertEqual(403, code)
+        self.assertEqual({"error": "Not authorized."}, body)
+        body, code = self.request("GET", "/calories/42", bob)
+        self.assertEqual(404, code)
+        self.assertEqual({"error": "Calorie not found."}, body)
+        _, code = self.request("GET", "/nowhere")
+        self.assertEqual(404, code)
+        _, code = self.request("PATCH", "/users")
+        self.assertEqual(405, code)
+
+    def test_concurrent_requests(self):
+        token = self.tokens[bob]
+
+        async def many():
+            return await asyncio.gather(
+                *[
+                    self.call("GET", f"/users/{bob}", {"access-token": token})
+                    for _ in range(20)
+                ]
+            )
+
+        results = asyncio.run(many())
+        self.assertEqual([200] * 20, [code for _, code in results])
+
+    def request(self, method, url, user=None, data=None):
+        """Drive the ASGI app with one request."""
+        return asyncio.run(self.call(method, url, self.headers(user), data))
+
+    async def call(self, method, url, headers=None, data=None):
+        path, _, query = url.partition("?")
+        scope = {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "query_string": query.encode(),
+            "headers": [
+                (k.encode("latin-1"), v.encode("latin-1"))
+                for k, v in (headers or {}).items()
+            ],
+        }
+        body = json.dumps(data).encode() if data is not None else b""
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await async_app.app(scope, receive, send)
+        return json.loads(sent[1]["body"]), sent[0]["status"]
+
+
+admin = "admin"
+bob = "bob"
+bob_creds = {"username": bob, "password": "password"}
@@ -0,0 +1,129 @@
+import app
+from api_test_case import ApiTestCase
+from exceptions import NotAllowedException, OverloadedException
+from ratelimit import AdmissionControl, RateLimiter
+
+
+class TestBatchReads(ApiTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for user, text in [(bob, "kiwi"), (bob, "apple"), (admin, "pear")]:
+            self.create(user, text, 10)
+
+    def batch(self, requests, user="bob"):
+        return self.post("/batch", user, {"requests": requests})
+
+    def test_ids(self):
+        body, code = self.get("/calories?ids=2,1,99", bob)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual(["1", "2"], sorted(body["calories"]))
+        self.assertEqual(
+            self.get("/calories/1", bob)[0]["calorie"], body["calories"]["1"]
+        )
+
+        body, _ = self.get("/calories?ids=1,2&format=array&fields=text", bob)
+        self.assertEqual([{"text": "kiwi"}, {"text": "apple"}], body["calories"])
+        body, _ = self.get("/calories?ids=1,3", admin)
+        self.assertEqual(["1", "3"], sorted(body["calories"]))
+
+    def test_ids_errors(self):
+        self.assertEqual(403, self.get("/calories?ids=1,3", bob)[1])
+        self.assertEqual(400, self.get("/calories?ids=1,x", bob)[1])
+        self.assertEqual(400, self.get("/calories?ids=", bob)[1])
+        ids = ",".join(str(i) for i in range(1001))
+        self.assertEqual(400, self.get(f"/calories?ids={ids}", bob)[1])
+
+    def test_batch(self):
+        body, code = self.batch(
+            [
+                {"method": "GET", "path": "/calories/1"},
+                {"path": "/calories?username=bob&format=array&fields=text"},
+                {"path": "/calories/3"},
+                {"path": "/calories/99"},
+                {"path": "/users/bob"},
+                {"method": "DELETE", "path": "/calories/1"},
+                {"path": "/nowhere"},
+            ]
+        )
+        self.assertEqual(200, code, body.get("error", ""))
+        responses = body["responses"]
+        self.assertEqual(
+            [200, 200, 403, 404, 200, 400, 400],
+            [response["status"] for response in responses],
+        )
+        self.assertEqual(self.get("/calories/1", bob)[0], responses[0]["body"])
+        self.assertEqual(
+            {"calories": [{"text": "kiwi"}, {"text": "apple"}]}, responses[1]["body"]
+        )
+        self.assertEqual({"error": "Calorie not found."}, responses[3]["body"])
+        self.assertEqual("bob", responses[4]["body"]["user"]["username"])
+        self.assertEqual(2, len(self.get("/calories?username=bob", bob)[0]["calories"]))
+
+    def test_batch_handler_errors(self):
+        class NotOwnerException(NotAllowedException):
+            pass
+
+        def read_user(user_manage, username):
+            if username == bob:
+                raise NotOwnerException
+            return {}["missing"]  # A bug, not a bad request
+
+        saved = app._batch_reads["user"]
+        app._batch_reads["user"] = read_user
+        try:
+            body, _ = self.batch(
+                [{"path": "/users/bob"}, {"path": "/users/admin"}, "/users/bob"]
+            )
+        finally:
+            app._batch_reads["user"] = saved
+        self.assertEqual(
+            [403, 500, 400], [response["status"] for response in body["responses"]]
+        )
+
+    def test_batch_keeps_its_admission_slot(self):
+        saved = app.admission_control, app._batch_reads["user"]
+        app.admission_control = AdmissionControl(1)
+        slot_free = []
+
+        def read_user(user_manage, username):
+            try:
+                app.admission_control.enter()
+                app.admission_control.leave()
+                slot_free.append(True)
+            except OverloadedException:
+                slot_free.append(False)
+            return saved[1](user_manage, username)
+
+        app._batch_reads["user"] = read_user
+        try:
+            body, code = self.batch([{"path": "/users/bob"}] * 3)
+            self.assertEqual(200, code, body.get("error", ""))
+            self.assertEqual([False] * 3, slot_free)
+            app.admission_control.enter()  # Released once the batch finished
+        finally:
+            app.admission_control, app._batch_reads["user"] = saved
+
+    def test_sub_requests_are_rate_limited(self):
+        saved = app.rate_limiter
+        # 1 token for the envelope, then 5 for each GET /calories
+        app.rate_limiter = RateLimiter(0.01, 12)
+        try:
+            body, code = self.batch([{"path": "/calories?username=bob"}] * 3)
+        finally:
+            app.rate_limiter = saved
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual(
+            [200, 200, 429], [response["status"] for response in body["responses"]]
+        )
+        self.assertEqual({"error": "Too many requests."}, body["responses"][2]["body"])
+
+    def test_batch_errors(self):
+        self.assertEqual(400, self.batch([])[1])
+        self.assertEqual(400, self.batch([{"path": "/users/bob"}] * 51)[1])
+        body, _ = self.batch([{"path": 1}, {"method": "GET"}, {"path": "http://[x"}])
+        self.assertEqual([400] * 3, [r["status"] for r in body["responses"]])
+        self.assertEqual(500, self.batch([], None)[1])  # No token, like other routes
+
+
+admin = "admin"
+bob = "bob"
@@ -0,0 +1,117 @@
+import unittest
+
+from sqlalchemy import event
+
+import app
+import database
+from api_test_case import ApiTestCase
+from cache import LRUBackend, ResultCache, StoreBackend, normalize_filter
+
+
+class TestResultCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        backend = LRUBackend(max_entries=2)
+        backend.set("a", 1)
+        backend.set("b", 2)
+        backend.get("a")
+        backend.set("c", 3)
+        self.assertEqual(1, backend.get("a"))
+        self.assertIsNone(backend.get("b"))
+
+    def test_generations(self):
+        result_cache = ResultCache(LRUBackend())
+        produced = []
+
+        def produce():
+            produced.append(1)
+            return b"body"
+
+        result_cache.get_or_create(("calories", "bob"), ["calories:bob"], produce)
+        result_cache.get_or_create(("calories", "bob"), ["calories:bob"], produce)
+        self.assertEqual(1, len(produced))
+        result_cache.invalidate("calories:alice")
+        result_cache.get_or_create(("calories", "bob"), ["calories:bob"], produce)
+        self.assertEqual(1, len(produced))
+        result_cache.invalidate("calories:bob")
+        result_cache.get_or_create(("calories", "bob"), ["calories:bob"], produce)
+        self.assertEqual(2, len(produced))
+
+    def test_shared_store(self):
+        class StandIn(dict):
+            def set(self, key, value, ex=None):
+                self[key] = value
+
+            def incr(self, key):
+                self[key] = self.get(key, 0) + 1
+
+        store = StandIn()
+        result_cache = ResultCache(StoreBackend(store))
+        result_cache.get_or_create(("users",), ["users"], lambda: b"one")
+        self.assertEqual(
+            b"one", result_cache.get_or_create(("users",), ["users"], lambda: b"two")
+        )
+        result_cache.invalidate("users")
+        self.assertEqual(
+            b"two", result_cache.get_or_create(("users",), ["users"], lambda: b"two")
+        )
+        self.assertEqual(1, store["result-cache:gen:users"])
+
+    def test_normalize_filter(self):
+        self.assertEqual(
+            "time eq '12:00' AND text eq 'two  spaces'",
+            normalize_filter("  time   eq '12:00'  AND text eq 'two  spaces' "),
+        )
+        self.assertIsNone(normalize_filter(""))
+
+
+@unittest.skipUnless(app.result_cache, "RESULT_CACHE_SIZE=0 disables the cache")
+class TestCachedRoutes(ApiTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.statements = []
+        event.listen(database.engine, "before_cursor_execute", self.count)
+
+    def tearDown(self):
+        event.remove(database.engine, "before_cursor_execute", self.count)
+        super().tearDown()
+
+    def count(self, conn, cursor, statement, *args):
+        if "FROM calorie" in statement:
+            self.statements.append(statement)
+
+    def test_repeated_reads_skip_sql(self):
+        first = self.get("/calories?username=bob", bob)
+        second = self.get("/calories?username=bob", bob)
+        self.assertEqual(200, second[1])
+        self.assertEqual(first, second)
+        self.assertEqual(1, len(self.statements))
+
+    def test_replica_reads_not_stored(self):
+        # The one database stands in for a replica, which may trail the primary's generations
+        replicas, database.replica_engines = database.replica_engines, [database.engine]
+        database._last_write.clear()
+        try:
+            self.get("/calories?username=bob", bob)
+            self.get("/calories?username=bob", bob)
+        finally:
+            database.replica_engines = replicas
+        self.assertEqual(2, len(self.statements))
+
+    def test_writes_invalidate(self):
+        self.assertEqual({}, self.get("/calories?username=bob", bob)[0]["calories"])
+        self.create(bob, time="06:30")
+        self.assertEqual(1, len(self.get("/calories?username=bob", bob)[0]["calories"]))
+        self.assertEqual(1, len(self.get("/calories", admin)[0]["calories"]))
+
+        self.assertIn(bob, self.get("/users", admin)[0]["users"])
+        self.delete(f"/users/{bob}", admin)
+        self.assertNotIn(bob, self.get("/users", admin)[0]["users"])
+
+    def test_permissions_checked_before_cache(self):
+        self.get("/calories?username=admin", admin)
+        _, code = self.get("/calories?username=admin", bob)
+        self.assertEqual(403, code)
+
+
+admin = "admin"
+bob = "bob"
@@ -1,9 +1,17 @@
+import os
+import tempfile
+import threading
 import unittest
 
-from calories import Calories
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+import calories
+from calories import Calories, GroupCommitWriter
 from users import Role
 from exceptions import NotAllowedException, UnknownCalorieException
 import database
+import events
 
 BOB = "bob"
 ALICE = "alice"
@@ -166,3 +174,82 @@ class TestCalories(unittest.TestCase):
             },
         }
         self.assertEqual(expected, actual)
+
+    def test_daily_total_is_per_user(self):
+        self.create(ALICE, Role.REGULAR, ALICE, "2020-06-01", "09:30", "cake", 1900)
+        entry = self.create(BOB, Role.REGULAR, BOB, "2020-06-01", "09:30", "soup", 200)
+        self.assertTrue(entry["below_expected"])
+        entry = self.create(BOB, Role.REGULAR, BOB, "2020-06-01", "12:00", "pie", 1900)
+        self.assertFalse(entry["below_expected"])
+
+
+class TestGroupCommit(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "group-commit.db")
+        self.engine = database.create_sqlite_file_engine("sqlite:///" + path)
+        database.create_schema(self.engine)
+        self.engine.execute(database.User.__table__.insert(), {"username": BOB})
+        self.session_factory = sessionmaker(
+            class_=database.RoutingSession, bind=self.engine
+        )
+        self.writer = GroupCommitWriter(self.session_factory, max_wait_ms=20)
+        self.saved, calories.group_writer = calories.group_writer, self.writer
+        # Subscribers write to the in-memory database, which can't take concurrent writers
+        self.subscribers, events._subscribers = events._subscribers, {}
+
+    def tearDown(self):
+        events._subscribers = self.subscribers
+        calories.group_writer = self.saved
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_concurrent_creates_share_commits(self):
+        created = []
+
+        def create():
+            db_session = self.session_factory()
+            entries = Calories(db_session)
+            entries.set_user_session(BOB, Role.REGULAR, 1000)
+            created.append(entries.create(BOB, "2020-06-01", "09:30", "toast", 100))
+            db_session.close()
+
+        threads = [threading.Thread(target=create) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(20, self.writer.entries)
+        self.assertLess(self.writer.commits, 20)
+        self.assertEqual(20, len({calorie["id"] for calorie in created}))
+        # Running totals: the first 1000 calories of the day are below expected
+        self.assertEqual(10, sum(calorie["below_expected"] for calorie in created))
+
+    def test_bad_entry_fails_alone(self):
+        results = {}
+        database._last_write.pop(BOB, None)
+
+        def create(owner):
+            db_session = self.session_factory()
+            entries = Calories(db_session)
+            entries.set_user_session(BOB, Role.ADMIN, 1000)
+            try:
+                results[owner] = entries.create(owner, "2020-06-01", "09:30", "tea", 1)
+            except IntegrityError as e:
+                results[owner] = e
+            db_session.close()
+
+        # Nobody is not a user, so with foreign keys on their entry can't be inserted
+        threads = [
+            threading.Thread(target=create, args=[owner]) for owner in [BOB, "nobody"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIsInstance(results["nobody"], IntegrityError)
+        self.assertEqual("tea", results[BOB]["text"])
+        self.assertEqual(1, self.writer.entries)
+        self.assertIn(BOB, database._last_write)  # Bob's reads stay on the primary
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import app
+import changes
+import database
+from api_test_case import ApiTestCase
+from ratelimit import AdmissionControl
+
+
+class TestChangeFeed(ApiTestCase):
+    def changes(self, query, user="bob"):
+        body, code = self.get(f"/changes?{query}", user)
+        self.assertEqual(200, code)
+        return body
+
+    def test_incremental_sync(self):
+        start = self.changes("since=0")
+        self.assertEqual(
+            [("user", "update", "bob")],
+            [(c["entity"], c["op"], c["key"]) for c in start["changes"]],
+        )
+        kiwi = self.create(bob, "kiwi")
+        self.create(admin, "pear")
+        self.delete(f"/calories/{kiwi['id']}", bob)
+
+        feed = self.changes(f"since={start['seq']}")
+        self.assertEqual(
+            [("create", kiwi), ("delete", None)],
+            [(c["op"], c["data"]) for c in feed["changes"]],
+        )
+        self.assertFalse(feed["reset"])
+        self.assertEqual([], self.changes(f"since={feed['seq']}")["changes"])
+
+        # Admins see every user's changes
+        admin_feed = self.changes(f"since={start['seq']}", admin)
+        self.assertEqual(3, len(admin_feed["changes"]))
+        self.assertEqual(admin_feed["seq"], feed["seq"])
+
+    def test_bulk_changes_reach_everyone(self):
+        seq = self.changes("since=0")["seq"]
+        self.delete("/calories", admin)
+        feed = self.changes(f"since={seq}")
+        self.assertEqual(
+            [("calorie", "bulk_delete", None)],
+            [(c["entity"], c["op"], c["username"]) for c in feed["changes"]],
+        )
+
+    def test_long_poll(self):
+        seq = self.changes("since=0")["seq"]
+        started = time.monotonic()
+        self.assertEqual([], self.changes(f"since={seq}&wait=0.3")["changes"])
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+        notifier = threading.Timer(0.1, app.change_log.notify)
+        notifier.start()
+        started = time.monotonic()
+        app.change_log.wait(app.change_log.generation, 5)
+        notifier.join()
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_long_polls_leave_their_admission_slot(self):
+        seq = self.changes("since=0")["seq"]
+        saved = app.admission_control
+        app.admission_control = AdmissionControl(2)
+        codes = []
+
+        def poll():
+            codes.append(self.get(f"/changes?since={seq}&wait=1.5", bob)[1])
+
+        polls = [threading.Thread(target=poll) for _ in range(2)]
+        try:
+            for thread in polls:
+                thread.start()
+            try:
+                time.sleep(0.3)
+                self.assertEqual(200, self.get(f"/users/{bob}", bob)[1])
+            finally:
+                for thread in polls:
+                    thread.join()
+            self.assertEqual([200, 200], codes)
+            app.admission_control.enter()  # Every slot was given back
+            app.admission_control.enter()
+        finally:
+            app.admission_control = saved
+
+    def test_changes_commit_with_their_write(self):
+        seq = self.changes("since=0")["seq"]
+        db_session = database.DBSession()
+        try:
+            db_session.execute(
+                database.User.__table__.delete().where(database.User.username == bob)
+            )
+            changes.record(db_session, "user", "delete", bob, bob)
+            db_session.rollback()
+        finally:
+            db_session.close()
+        self.assertEqual([], self.changes(f"since={seq}")["changes"])
+
+    def test_reset(self):
+        feed = self.changes("since=1000")
+        self.assertTrue(feed["reset"])
+        self.assertEqual(2, feed["seq"])  # Admin and bob registering
+
+
+admin = "admin"
+bob = "bob"
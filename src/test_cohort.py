@@ -0,0 +1,79 @@
+from api_test_case import ApiTestCase
+from role import Role
+
+
+class TestCohort(ApiTestCase):
+    users = ["bob", "carol", "dave", "manager"]
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.put(f"/users/{manager}", admin, {"role": Role.USER_MANAGER})
+        for user, date, calories in [
+            (bob, "2020-06-01", 1500),
+            (bob, "2020-06-01", 1000),
+            (bob, "2020-06-02", 1900),
+            (carol, "2020-06-01", 2100),
+            (carol, "2020-06-02", 2200),
+            (dave, "2020-06-02", 1200),
+            (dave, "2020-07-01", 5000),
+            (admin, "2020-06-01", 9000),
+        ]:
+            self.create(user, number_of_calories=calories, date=date)
+
+    def test_cohort(self):
+        body, code = self.get("/cohort?from=2020-06-01&to=2020-06-30", manager)
+        self.assertEqual(200, code, body.get("error", ""))
+        cohort = body["cohort"]
+        self.assertEqual(3, cohort["users_logged"])  # Not the admin, nor the manager
+        self.assertEqual(
+            [carol, bob, dave], [user["username"] for user in cohort["users"]]
+        )
+        self.assertEqual(
+            {
+                "username": bob,
+                "expected_calories_per_day": 2000,
+                "days_logged": 2,
+                "days_over": 1,
+                "share_over": 0.5,
+                "average": 2200.0,
+            },
+            cohort["users"][1],
+        )
+
+        body, _ = self.get("/cohort?from=2020-06-01&to=2020-06-30&limit=1", admin)
+        self.assertEqual(4, body["cohort"]["users_logged"])
+        self.assertEqual(
+            [admin], [user["username"] for user in body["cohort"]["users"]]
+        )
+
+    def test_rollups_and_writes(self):
+        url = "/cohort?from=2020-06-01&to=2020-06-30&limit=2"
+        body, _ = self.get(url, manager)
+        self.assertEqual([carol, bob], [u["username"] for u in body["cohort"]["users"]])
+        rollups, _ = self.get(url + "&source=rollups", manager)
+        self.assertEqual("rollups", rollups["cohort"]["source"])
+        self.assertEqual(body["cohort"]["users"], rollups["cohort"]["users"])
+
+        self.create(dave, number_of_calories=3000, date="2020-06-03")
+        self.create(dave, number_of_calories=3000, date="2020-06-04")
+        body, _ = self.get(url, manager)
+        self.assertEqual(
+            [carol, dave], [u["username"] for u in body["cohort"]["users"]]
+        )
+
+    def test_errors(self):
+        self.assertEqual(403, self.get("/cohort?from=2020-06-01&to=2020-06-30", bob)[1])
+        self.assertEqual(400, self.get("/cohort?from=2020-06-01", manager)[1])
+        self.assertEqual(400, self.get("/cohort?from=June&to=2020-06-30", manager)[1])
+        for query in ("limit=0", "limit=x", "limit=1001", "source=cache"):
+            self.assertEqual(
+                400,
+                self.get(f"/cohort?from=2020-06-01&to=2020-06-30&{query}", manager)[1],
+            )
+
+
+admin = "admin"
+bob = "bob"
+carol = "carol"
+dave = "dave"
+manager = "manager"
@@ -0,0 +1,222 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from sqlalchemy import create_engine
+
+from calories import Calories
+import database
+import events
+from database import Base, RoutingSession
+from role import Role
+from users import Users
+
+BOB = "bob"
+
+
+class TestReplicaRouting(unittest.TestCase):
+    def setUp(self) -> None:
+        database._last_write.clear()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.primary = self.make_engine("primary.db")
+        self.replicas = [
+            self.make_engine("replica1.db"),
+            self.make_engine("replica2.db"),
+        ]
+
+    def tearDown(self):
+        for engine in [self.primary, *self.replicas]:
+            engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def make_engine(self, name):
+        engine = create_engine("sqlite:///" + os.path.join(self.tmp_dir.name, name))
+        Base.metadata.create_all(engine)
+        return engine
+
+    def session(self, replicas=None):
+        return RoutingSession(
+            bind=self.primary, replicas=self.replicas if replicas is None else replicas
+        )
+
+    def test_writes_primary_reads_replica(self):
+        db_session = self.session()
+        Users(db_session).create(BOB, "hash", 2000)
+        db_session.close()
+
+        db_session = self.session()
+        # Nothing has been replicated, so the replica list is empty
+        self.assertEqual([], Users(db_session)._storage.get_all())
+        self.assertIsNotNone(Users(db_session).non_session_read(BOB))
+        db_session.close()
+
+    def test_read_your_writes(self):
+        db_session = self.session()
+        Users(db_session).create(BOB, "hash", 2000)
+        calories = Calories(db_session)
+        calories.set_user_session(BOB, Role.REGULAR, 2000)
+        calories.create(BOB, "2020-06-01", "09:30", "banana", 89)
+        # Bob just wrote, so his listing comes from the primary
+        self.assertEqual(1, len(calories.read(username=BOB)))
+        db_session.close()
+
+        db_session = self.session()
+        calories = Calories(db_session)
+        calories.set_user_session("alice", Role.ADMIN, 2000)
+        self.assertEqual({}, calories.read(username=BOB))
+        db_session.close()
+
+    def test_reads_that_commit_are_not_writes(self):
+        db_session = self.session()
+        db_session.info["username"] = BOB
+        Users(db_session)._storage.get_change_range()
+        db_session.close()
+        self.assertNotIn(BOB, database._last_write)
+
+    def test_round_robin(self):
+        with self.replicas[0].connect() as connection:
+            connection.execute("INSERT INTO user (username) VALUES ('on_replica_1')")
+        seen = set()
+        for _ in range(4):
+            db_session = self.session()
+            seen.add(len(Users(db_session)._storage.get_all()))
+            db_session.close()
+        self.assertEqual({0, 1}, seen)
+
+    def test_no_replicas(self):
+        db_session = self.session(replicas=[])
+        Users(db_session).create(BOB, "hash", 2000)
+        self.assertEqual(1, len(Users(db_session)._storage.get_all()))
+        db_session.close()
+
+
+class TestSqliteProfile(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.engine = database.create_sqlite_file_engine(
+            "sqlite:///" + os.path.join(self.tmp_dir.name, "health.db")
+        )
+        Base.metadata.create_all(self.engine)
+        # Subscribers write to the in-memory database, which can't take concurrent writers
+        self.subscribers, events._subscribers = events._subscribers, {}
+
+    def tearDown(self):
+        events._subscribers = self.subscribers
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_pragmas(self):
+        with self.engine.connect() as connection:
+            self.assertEqual("wal", connection.execute("PRAGMA journal_mode").scalar())
+            self.assertEqual(1, connection.execute("PRAGMA synchronous").scalar())
+            self.assertEqual(1, connection.execute("PRAGMA foreign_keys").scalar())
+
+    def test_concurrent_writers_queue(self):
+        Users(RoutingSession(bind=self.engine, replicas=[])).create(BOB, "hash", 2000)
+        errors = []
+
+        def write():
+            db_session = RoutingSession(bind=self.engine, replicas=[])
+            calories = Calories(db_session)
+            calories.set_user_session(BOB, Role.REGULAR, 2000)
+            try:
+                for _ in range(10):
+                    calories.create(BOB, "2020-06-01", "09:30", "banana", 89)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db_session.close()
+
+        threads = [threading.Thread(target=write) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        with self.engine.connect() as connection:
+            count = connection.execute("SELECT COUNT(*) FROM calorie").scalar()
+        self.assertEqual(80, count)
+
+    def test_reads_not_blocked_by_writer(self):
+        writer = RoutingSession(bind=self.engine, replicas=[])
+        Users(writer).create(BOB, "hash", 2000)
+        writer.execute("UPDATE user SET role = 2")  # Holds the write lock until commit
+        result = []
+        reader = threading.Thread(
+            target=lambda: result.append(
+                len(Users(RoutingSession(bind=self.engine))._storage.get_all())
+            )
+        )
+        reader.start()
+        reader.join(timeout=5)
+        self.assertEqual([1], result)
+        writer.rollback()
+        writer.close()
+
+
+class TestSchemaUpgrade(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(
+            "sqlite:///" + os.path.join(self.tmp_dir.name, "old.db")
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_calorie_timestamps_added(self):
+        # The calorie table as it was before delta sync
+        self.engine.execute(
+            "CREATE TABLE calorie (id INTEGER PRIMARY KEY, text VARCHAR, "
+            "number_of_calories INTEGER, username VARCHAR, date VARCHAR, "
+            "time VARCHAR, below_expected BOOLEAN)"
+        )
+        self.engine.execute(
+            "INSERT INTO calorie (username, date, text) VALUES ('bob', '2020-06-01', 'kiwi')"
+        )
+        database.create_schema(self.engine)
+        database.create_schema(self.engine)  # Nothing left to do the second time
+
+        created_at, updated_at = self.engine.execute(
+            "SELECT created_at, updated_at FROM calorie"
+        ).first()
+        self.assertIsNotNone(updated_at)
+        self.assertEqual(created_at, updated_at)
+        indexes = {
+            index["name"]
+            for index in database.inspect(self.engine).get_indexes("calorie")
+        }
+        self.assertLessEqual(
+            {"ix_calorie_updated_at", "ix_calorie_username_updated_at"}, indexes
+        )
+
+    def test_archived_parts_of_rollups_added(self):
+        # The rollups as they were before they kept archived parts
+        self.engine.execute(
+            "CREATE TABLE calorie_rollup (username VARCHAR, period VARCHAR, "
+            "period_start VARCHAR, calories INTEGER, entries INTEGER, "
+            "PRIMARY KEY (username, period, period_start))"
+        )
+        self.engine.execute(
+            "INSERT INTO calorie_rollup VALUES ('bob', 'day', '2020-06-01', 300, 3), "
+            "('bob', 'day', '2020-06-02', 50, 1), ('bob', 'month', '2020-06-01', 350, 4)"
+        )
+        database.Calorie.__table__.create(self.engine)
+        self.engine.execute(
+            "INSERT INTO calorie (username, date, number_of_calories) "
+            "VALUES ('bob', '2020-06-01', 100)"
+        )
+        database.create_schema(self.engine)
+
+        self.assertEqual(
+            [("2020-06-01", 200, 2), ("2020-06-02", 50, 1)],
+            [
+                tuple(row)
+                for row in self.engine.execute(
+                    "SELECT period_start, archived_calories, archived_entries "
+                    "FROM calorie_rollup WHERE period = 'day' ORDER BY period_start"
+                )
+            ],
+        )
@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+import unittest
+
+import database
+import export
+from api_test_case import ApiTestCase
+from calories import Calories
+from role import Role
+from users import Users
+
+
+class TestExport(ApiTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for user, date, text in [
+            (bob, "2020-06-01", "kiwi"),
+            (bob, "2020-06-02", "apple"),
+            (admin, "2020-06-01", "pear"),
+        ]:
+            self.create(user, text, 50, date, "06:30")
+
+    def download(self, query, user):
+        return self.client.get(f"/calories/export?{query}", headers=self.headers(user))
+
+    def test_ndjson(self):
+        response = self.download("username=bob", bob)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("application/x-ndjson", response.mimetype)
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(["kiwi", "apple"], [row["text"] for row in rows])
+        self.assertEqual(Calories.columns, list(rows[0]))
+
+    def test_csv_with_filter(self):
+        response = self.download("format=csv&filter=date eq '2020-06-01'", admin)
+        self.assertEqual(200, response.status_code)
+        rows = list(csv.reader(io.StringIO(response.data.decode())))
+        self.assertEqual(Calories.columns, rows[0])
+        self.assertEqual(["kiwi", "pear"], [row[1] for row in rows[1:]])
+
+    def test_batches(self):
+        db_session = database.get_db_session()
+        calories = Users(db_session).calories
+        calories.set_user_session(admin, Role.ADMIN, 2000)
+        batches = list(calories.export(["id", "text"], batch_size=2))
+        db_session.close()
+        self.assertEqual([2, 1], [len(batch) for batch in batches])
+
+    @unittest.skipUnless(export.pyarrow, "pyarrow is not installed")
+    def test_parquet(self):
+        response = self.download("format=parquet&username=bob", bob)
+        self.assertEqual(200, response.status_code)
+        table = export.pyarrow.parquet.read_table(io.BytesIO(response.data))
+        self.assertEqual(["kiwi", "apple"], table.column("text").to_pylist())
+
+    def test_permissions(self):
+        response = self.download("username=admin", bob)
+        self.assertEqual(403, response.status_code)
+
+    def test_unknown_format(self):
+        response = self.download("format=xml", bob)
+        self.assertEqual(400, response.status_code)
+
+
+admin = "admin"
+bob = "bob"
@@ -0,0 +1,68 @@
+import unittest
+
+import calories
+from api_test_case import ApiTestCase
+from foods import PrefixIndex
+
+
+class TestPrefixIndex(unittest.TestCase):
+    def test_suggest(self):
+        index = PrefixIndex()
+        for text, calories_ in [
+            ("Banana", 89),
+            ("banana bread", 196),
+            ("Bagel", 245),
+            ("banana", 105),
+            ("apple", 52),
+        ]:
+            index.add(text, calories_)
+        self.assertEqual(
+            [("banana", 105, 2), ("banana bread", 196, 1)], index.suggest("BAN", 5)
+        )
+        self.assertEqual(3, len(index.suggest("b", 5)))
+        self.assertEqual(1, len(index.suggest("b", 1)))
+        index.remove("banana bread")
+        self.assertEqual([("banana", 105, 2)], index.suggest("ban", 5))
+
+
+class TestSuggestRoute(ApiTestCase):
+    def setUp(self) -> None:
+        calories.food_index.clear()
+        super().setUp()
+        self.create(admin, "Pizza", 300)
+        self.create(admin, "pizza", 280)
+        self.create(admin, "Pie", 350)
+        self.create(bob, "pie", 320)
+
+    def suggest(self, prefix, user="bob"):
+        body, code = self.get(f"/foods/suggest?prefix={prefix}", user)
+        self.assertEqual(200, code)
+        return body["foods"]
+
+    def test_own_foods_first(self):
+        self.assertEqual(
+            [
+                {"text": "pie", "number_of_calories": 320},
+                {"text": "pizza", "number_of_calories": 280},
+            ],
+            self.suggest("pi"),
+        )
+
+    def test_follows_creates(self):
+        self.suggest("pi")  # Loads the indexes
+        self.create(bob, "Pizza", 250)
+        self.assertEqual(
+            [
+                {"text": "Pizza", "number_of_calories": 250},
+                {"text": "pie", "number_of_calories": 320},
+            ],
+            self.suggest("piz") + self.suggest("pie"),
+        )
+        self.delete("/calories?username=bob", admin)
+        self.assertEqual(
+            ["pizza", "Pie"], [food["text"] for food in self.suggest("pi")]
+        )
+
+
+admin = "admin"
+bob = "bob"
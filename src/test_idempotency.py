@@ -0,0 +1,110 @@
+import threading
+import time
+import unittest
+
+import app
+from api_test_case import ApiTestCase
+from cache import LRUBackend
+from exceptions import IdempotencyKeyReusedException, InvalidRequestException
+from idempotency import IdempotencyStore
+
+
+class TestIdempotencyStore(unittest.TestCase):
+    def test_retries_wait_for_the_first_request(self):
+        store = IdempotencyStore(LRUBackend(10))
+        calls = []
+
+        def produce():
+            calls.append(1)
+            time.sleep(0.05)
+            return 200, "application/json", b"{}"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(store.run(("bob", "k"), "f", produce))
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(calls))
+        self.assertEqual([(200, "application/json", b"{}")] * 4, results)
+
+    def test_failures_and_expiry(self):
+        store = IdempotencyStore(LRUBackend(10), ttl=0.05)
+        calls = []
+
+        def produce(status):
+            calls.append(status)
+            return status, "application/json", b"{}"
+
+        store.run(("bob", "k"), "f", lambda: produce(500))
+        store.run(("bob", "k"), "f", lambda: produce(200))
+        store.run(("bob", "k"), "f", lambda: produce(200))
+        self.assertEqual([500, 200], calls)
+        with self.assertRaises(IdempotencyKeyReusedException):
+            store.run(("bob", "k"), "other", lambda: produce(200))
+        time.sleep(0.06)
+        store.run(("bob", "k"), "other", lambda: produce(200))
+        self.assertEqual([500, 200, 200], calls)
+        with self.assertRaises(InvalidRequestException):
+            store.run(("bob", "k" * 256), "f", lambda: produce(200))
+
+
+class TestIdempotencyKeys(ApiTestCase):
+    users = []
+
+    def setUp(self) -> None:
+        app.idempotency_store.clear()
+        super().setUp()
+        self.register_once("bob", "key-1")
+        self.login("bob")
+
+    def register_once(self, username, key):
+        return self.client.post(
+            "/users",
+            headers={"Idempotency-Key": key},
+            json={
+                "username": username,
+                "password": "password",
+                "expected_calories_per_day": 2000,
+            },
+        )
+
+    def create(self, key, text="kiwi"):
+        return self.client.post(
+            "/calories",
+            headers={**self.headers("bob"), "Idempotency-Key": key},
+            json={
+                "date": "2020-06-01",
+                "time": "12:00",
+                "text": text,
+                "number_of_calories": 100,
+                "username": "bob",
+            },
+        )
+
+    def test_retried_create(self):
+        first = self.create("key-1")
+        retry = self.create("key-1")
+        self.assertEqual(200, retry.status_code)
+        self.assertEqual(first.json, retry.json)
+        self.assertEqual(2, self.create("key-2").json["calorie"]["id"])
+        body, _ = self.get("/calories?username=bob", "bob")
+        self.assertEqual(["1", "2"], sorted(body["calories"]))
+
+        response = self.create("key-1", "apple")
+        self.assertEqual(422, response.status_code)
+        self.assertEqual(
+            {"error": "Idempotency-Key was already used for a different request."},
+            response.json,
+        )
+
+    def test_retried_register(self):
+        retry = self.register_once("bob", "key-1")
+        self.assertEqual(200, retry.status_code)
+        self.assertEqual({"message": "Successfully registered."}, retry.json)
+        self.assertEqual(400, self.register_once("bob", "key-2").status_code)
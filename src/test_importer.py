@@ -0,0 +1,94 @@
+import json
+
+import database
+from api_test_case import ApiTestCase
+from role import Role
+from users import Users
+
+
+class TestImport(ApiTestCase):
+    def upload(self, format, data, user="admin"):
+        return self.client.post(
+            f"/calories/import?format={format}", data=data, headers=self.headers(user)
+        )
+
+    def read(self):
+        body, _ = self.get("/calories?username=bob", bob)
+        return sorted(body["calories"].values(), key=lambda c: c["id"])
+
+    def test_csv(self):
+        self.create(bob, "pancakes", 1500, time="06:30")
+        self.assertEqual(1, len(self.read()))
+        data = (
+            "username,date,time,text,number_of_calories\n"
+            "bob,2020-06-01,12:00,salad,400\n"
+            "bob,2020-06-01,18:00,pizza,900\n"
+            "bob,2020-06-02,12:00,soup,300\n"
+            "carol,2020-06-01,12:00,soup,300\n"
+            "bob,2020-13-01,12:00,soup,300\n"
+        )
+        response = self.upload("csv", data)
+        self.assertEqual(200, response.status_code)
+        report = response.json["imported"]
+        self.assertEqual(3, report["calories"])
+        self.assertEqual(2, report["rejected"])
+        self.assertEqual([5, 6], [error["line"] for error in report["errors"]])
+        self.assertEqual(
+            [("pancakes", True), ("salad", True), ("pizza", False), ("soup", True)],
+            [(c["text"], c["below_expected"]) for c in self.read()],
+        )
+
+    def test_ndjson(self):
+        rows = [
+            {"username": bob, "date": "2020-06-01", "time": "12:00", "text": "kiwi"},
+            {"username": bob, "date": "2020-06-01", "text": "no time"},
+        ]
+        data = "\n".join(json.dumps(row) for row in rows) + "\nnot json\n"
+        report = self.upload("ndjson", data).json["imported"]
+        self.assertEqual(1, report["calories"])
+        self.assertEqual(
+            [
+                {"line": 2, "error": "missing time"},
+                {"line": 3, "error": "not an object"},
+            ],
+            report["errors"],
+        )
+        self.assertEqual(0, self.read()[0]["number_of_calories"])
+
+    def test_chunks(self):
+        db_session = database.get_db_session()
+        calories = Users(db_session).calories
+        calories.set_user_session(admin, Role.ADMIN, 2000)
+        progress = []
+        rows = [
+            (
+                line,
+                {
+                    "username": bob,
+                    "date": "2020-06-01",
+                    "time": "12:00",
+                    "text": "nut",
+                    "number_of_calories": 500,
+                },
+            )
+            for line in range(1, 6)
+        ]
+        report = calories.bulk_import(
+            rows, chunk_size=2, progress=lambda *counts: progress.append(counts)
+        )
+        db_session.close()
+        self.assertEqual(5, report["calories"])
+        self.assertEqual([(2, 0), (4, 0), (5, 0)], progress)
+        self.assertEqual(
+            [True] * 4 + [False], [c["below_expected"] for c in self.read()]
+        )
+
+    def test_admin_only(self):
+        data = "username,date,time,text\nbob,2020-06-01,12:00,kiwi\n"
+        self.assertEqual(403, self.upload("csv", data, bob).status_code)
+        self.assertEqual(400, self.upload("xml", data).status_code)
+        self.assertEqual([], self.read())
+
+
+admin = "admin"
+bob = "bob"
@@ -0,0 +1,132 @@
+import logging
+import queue
+import unittest
+
+from sqlalchemy.exc import DBAPIError
+
+import database
+import logs
+from api_test_case import ApiTestCase
+
+
+class TestSamplingFilter(unittest.TestCase):
+    def record(self, message):
+        return logging.LogRecord("health", logging.ERROR, "", 0, message, (), None)
+
+    def test_budget_per_second(self):
+        sampling = logs.SamplingFilter(per_second=2)
+        passed = [sampling.filter(self.record(f"error {i}")) for i in range(5)]
+        self.assertEqual([True, True, False, False, False], passed)
+        self.assertEqual(3, sampling.suppressed)
+
+        sampling._second -= 1  # A new second
+        record = self.record("error 5")
+        self.assertTrue(sampling.filter(record))
+        self.assertEqual("error 5 (3 earlier records suppressed)", record.msg)
+        self.assertEqual(0, sampling.suppressed)
+
+    def test_no_limit(self):
+        sampling = logs.SamplingFilter(per_second=0)
+        self.assertTrue(all(sampling.filter(self.record("error")) for _ in range(100)))
+
+    def test_full_queue_drops(self):
+        handler = logs.AsyncHandler(queue.Queue(1))
+        handler.handle(self.record("first"))
+        handler.handle(self.record("second"))
+        self.assertEqual(1, handler.dropped)
+        self.assertEqual("first", handler.queue.get_nowait().msg)
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestErrorHandlers(ApiTestCase):
+    users = []
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.records = _Records()
+        logs.logger.addHandler(self.records)
+
+    def tearDown(self):
+        logs.logger.removeHandler(self.records)
+        super().tearDown()
+
+    def test_known_errors(self):
+        body, code = self.get("/calories/42", "admin")
+        self.assertEqual(404, code)
+        self.assertEqual({"error": "Calorie not found."}, body)
+        _, code = self.get("/nowhere", None)
+        self.assertEqual(404, code)
+        self.assertEqual([], self.records.records)
+
+    def test_unexpected_error_is_logged(self):
+        response = self.client.post(
+            "/calories", headers=self.headers("admin"), json={"food": "kiwi"}
+        )
+        self.assertEqual(500, response.status_code)
+        self.assertIn("food", response.json["error"])
+        [record] = self.records.records
+        self.assertEqual(
+            "Error on POST /calories, request " + response.headers["X-Request-ID"],
+            record.getMessage(),
+        )
+        self.assertIsInstance(record.exc_info[1], TypeError)
+
+
+class TestAccessLog(ApiTestCase):
+    users = []
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.records = _Records()
+        logs.access_logger.addHandler(self.records)
+
+    def tearDown(self):
+        logs.access_logger.removeHandler(self.records)
+        super().tearDown()
+
+    def test_access_record(self):
+        token = self.client.post(
+            "/login", json={"username": "admin", "password": "admin"}
+        ).json["auth_token"]
+        response = self.client.get(
+            "/users/admin", headers={"access-token": token, "X-Request-ID": "abc-1"}
+        )
+        self.assertEqual("abc-1", response.headers["X-Request-ID"])
+        login, read = [record.msg for record in self.records.records]
+        self.assertEqual(32, len(login["request_id"]))
+        self.assertEqual(
+            ("POST", "/login", None, 200),
+            (login["method"], login["route"], login["user"], login["status"]),
+        )
+        self.assertEqual("abc-1", read["request_id"])
+        self.assertEqual("/users/<username>", read["route"])
+        self.assertEqual("admin", read["user"])
+        self.assertGreater(read["db_queries"], 0)
+        self.assertGreaterEqual(read["latency_ms"], read["db_ms"])
+
+    def test_failed_query_leaves_no_start_time(self):
+        with database.engine.connect() as connection:
+            self.assertRaises(DBAPIError, connection.execute, "SELECT * FROM nowhere")
+            connection.execute("SELECT 1")
+            self.assertNotIn("query_started", connection.info)
+
+    def test_bad_request_id_replaced(self):
+        response = self.client.get("/nowhere", headers={"X-Request-ID": "a b;c"})
+        self.assertEqual(32, len(response.headers["X-Request-ID"]))
+        [record] = self.records.records
+        self.assertEqual((404, None), (record.msg["status"], record.msg["route"]))
+
+    def test_sampling(self):
+        sampler = logs.AccessSampler(ratio=0)
+        record = logging.LogRecord("access", logging.INFO, "", 0, {}, (), None)
+        for status, passed in [(200, False), (404, False), (500, True)]:
+            record.msg = {"status": status}
+            self.assertEqual(passed, sampler.filter(record))
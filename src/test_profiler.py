@@ -0,0 +1,96 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import app
+import profiler
+from api_test_case import ApiTestCase
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestSampler(unittest.TestCase):
+    def test_collapsed_stacks(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+        thread.start()
+        sampler = profiler.Sampler(0.001, {thread.ident}).start()
+        time.sleep(0.1)
+        stacks = sampler.stop()
+        stop.set()
+        thread.join()
+        self.assertGreater(sampler.samples, 0)
+        self.assertTrue(stacks)
+        for stack in stacks:
+            self.assertTrue(stack.startswith("busy;"))
+            self.assertIn(";busy_loop (test_profiler.py:", stack)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = profiler.write_collapsed(stacks, directory, "test")
+            with open(path) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(len(stacks), len(lines))
+        self.assertEqual(sum(stacks.values()), sum(int(l.split()[-1]) for l in lines))
+
+
+class TestProfileRoutes(ApiTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.saved = app.process_profiler
+        app.process_profiler = profiler.Profiler(self.directory.name, 0.001)
+
+    def tearDown(self):
+        app.process_profiler.finish()
+        app.process_profiler = self.saved
+        self.directory.cleanup()
+        super().tearDown()
+
+    def request(self, method, url, user="admin", json=None):
+        return self.client.open(
+            url, method=method, json=json, headers=self.headers(user)
+        )
+
+    def test_profile_requests(self):
+        response = self.request("POST", "/admin/profile", json={"requests": 2})
+        self.assertEqual(200, response.status_code, response.json)
+        self.assertEqual(
+            {"running": True, "requests_left": 2, "last_file": None},
+            response.json["profile"],
+        )
+        self.request("GET", "/calories")
+        self.assertTrue(
+            self.request("GET", "/admin/profile").json["profile"]["running"]
+        )
+        self.request("GET", "/users")
+        status = self.request("GET", "/admin/profile").json["profile"]
+        self.assertFalse(status["running"])
+        self.assertTrue(os.path.exists(status["last_file"]))
+
+    def test_stop_and_errors(self):
+        self.assertEqual(403, self.request("POST", "/admin/profile", "bob").status_code)
+        for json in [{}, {"seconds": 0}, {"seconds": "ten"}, {"requests": 0}]:
+            response = self.request("POST", "/admin/profile", json=json)
+            self.assertEqual(400, response.status_code, json)
+        self.request("POST", "/admin/profile", json={"seconds": 60})
+        response = self.request("POST", "/admin/profile", json={"seconds": 60})
+        self.assertEqual(400, response.status_code)
+        status = self.request("DELETE", "/admin/profile").json["profile"]
+        self.assertFalse(status["running"])
+        self.assertTrue(os.path.exists(status["last_file"]))
+
+    def test_profile_one_request(self):
+        response = self.request("GET", "/calories?profile=1")
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn("X-Profile", response.headers)
+
+        app.process_profiler.per_request = True
+        response = self.request("GET", "/calories?profile=1&format=array")
+        self.assertEqual(200, response.status_code, response.json)
+        self.assertEqual({"calories": []}, response.json)
+        self.assertTrue(os.path.exists(response.headers["X-Profile"]))
@@ -0,0 +1,114 @@
+import unittest
+
+import app
+from api_test_case import ApiTestCase
+from exceptions import OverloadedException, RateLimitedException
+from ratelimit import (
+    AdmissionControl,
+    InProcessBackend,
+    RateLimiter,
+    StoreBackend,
+    admission_control_from_env,
+)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_token_bucket(self):
+        backend = InProcessBackend()
+        for _ in range(3):
+            self.assertEqual(0, backend.take("bob", 1, 1, 3, now=100))
+        self.assertEqual(1, backend.take("bob", 1, 1, 3, now=100))
+        # Other keys have their own bucket
+        self.assertEqual(0, backend.take("alice", 1, 1, 3, now=100))
+        # Refills at rate tokens per second
+        self.assertEqual(0, backend.take("bob", 1, 1, 3, now=101))
+        self.assertEqual(0.25, backend.take("bob", 1, 2, 3, now=101.25))
+
+    def test_route_costs(self):
+        limiter = RateLimiter(1, 10, costs={"GET /calories": 5})
+        limiter.check("bob", "GET /calories")
+        limiter.check("bob", "GET /calories")
+        self.assertRaises(RateLimitedException, limiter.check, "bob", "GET /calories")
+
+    def test_pluggable_backend(self):
+        calls = []
+
+        class StandIn:
+            def take(self, key, cost, rate, capacity, now):
+                calls.append((key, cost))
+                return 0
+
+        RateLimiter(1, 10, backend=StandIn()).check("bob", "GET /users")
+        self.assertEqual([("bob", 2)], calls)
+
+    def test_shared_store(self):
+        calls = []
+
+        class StandIn:
+            def register_script(self, script):
+                def take(keys, args):
+                    calls.append((keys, args[:3]))  # Without the time
+                    return b"0.5"
+
+                return take
+
+        limiter = RateLimiter(2, 10, backend=StoreBackend(StandIn()))
+        with self.assertRaises(RateLimitedException) as raised:
+            limiter.check("bob", "GET /users")
+        self.assertEqual(0.5, raised.exception.retry_after)
+        self.assertEqual([(["rate-limit:bob"], [2, 2, 10])], calls)
+
+    def test_admission_control(self):
+        admission = AdmissionControl(2)
+        admission.enter()
+        admission.enter()
+        self.assertRaises(OverloadedException, admission.enter)
+        admission.leave()
+        admission.enter()
+
+    def test_admission_defaults_to_the_pool(self):
+        admission = admission_control_from_env(pool_connections=15)
+        for _ in range(15):
+            admission.enter()
+        self.assertRaises(OverloadedException, admission.enter)
+
+
+class TestRateLimitedApp(ApiTestCase):
+    users = []
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.saved = app.rate_limiter, app.admission_control
+
+    def tearDown(self):
+        app.rate_limiter, app.admission_control = self.saved
+        super().tearDown()
+
+    def test_rate_limited_per_user(self):
+        app.rate_limiter = RateLimiter(0.01, 6)
+        response = self.client.get("/calories", headers=self.headers("admin"))
+        self.assertEqual(200, response.status_code)
+        response = self.client.get("/calories", headers=self.headers("admin"))
+        self.assertEqual(429, response.status_code)
+        self.assertEqual({"error": "Too many requests."}, response.json)
+        self.assertEqual("400", response.headers["Retry-After"])
+        # Cheaper routes still have a token left
+        response = self.client.get("/users/admin", headers=self.headers("admin"))
+        self.assertEqual(200, response.status_code)
+
+    def test_login_limited_by_ip(self):
+        app.rate_limiter = RateLimiter(0.01, 5)
+        self.assertEqual(200, self.client.post("/login", json=admin_creds).status_code)
+        self.assertEqual(429, self.client.post("/login", json=admin_creds).status_code)
+
+    def test_overloaded(self):
+        app.admission_control = AdmissionControl(1)
+        app.admission_control.enter()  # Simulate another request in flight
+        response = self.client.post("/login", json=admin_creds)
+        self.assertEqual(503, response.status_code)
+        self.assertEqual({"error": "Server busy."}, response.json)
+        app.admission_control.leave()
+        self.assertEqual(200, self.client.post("/login", json=admin_creds).status_code)
+
+
+admin_creds = {"username": "admin", "password": "admin"}
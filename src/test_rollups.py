@@ -0,0 +1,195 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import select
+
+import database
+import rollups
+from api_test_case import ApiTestCase
+from database import CalorieRollup
+
+
+class TestPeriods(unittest.TestCase):
+    def test_period_start_and_end(self):
+        self.assertEqual("2020-06-01", rollups.period_start("month", "2020-06-17"))
+        self.assertEqual("2020-06-15", rollups.period_start("week", "2020-06-17"))
+        self.assertEqual("2020-06-17", rollups.period_start("day", "2020-06-17"))
+        self.assertEqual("2020-02-29", rollups.period_end("month", "2020-02-01"))
+        self.assertEqual("2020-06-21", rollups.period_end("week", "2020-06-15"))
+
+    def test_coarsest_period(self):
+        self.assertEqual("month", rollups.coarsest_period("2020-01-01", "2020-12-31"))
+        self.assertEqual("week", rollups.coarsest_period("2020-06-01", "2020-06-14"))
+        self.assertEqual("day", rollups.coarsest_period("2020-06-02", "2020-06-30"))
+
+
+class TestBackgroundWorker(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "rollups.db")
+        self.engine = database.create_sqlite_file_engine("sqlite:///" + path)
+        database.create_schema(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def rollups(self, worker):
+        worker.flush()
+        query = select(
+            [
+                CalorieRollup.period,
+                CalorieRollup.period_start,
+                CalorieRollup.calories,
+                CalorieRollup.entries,
+            ]
+        ).order_by(CalorieRollup.period, CalorieRollup.period_start)
+        return [tuple(row) for row in self.engine.execute(query)]
+
+    def test_deltas_and_reconcile(self):
+        worker = rollups.RollupWorker(self.engine, reconcile_seconds=0)
+        worker.start()
+        calorie = {"username": "bob", "date": "2020-06-30", "number_of_calories": 100}
+        for _ in range(3):
+            worker._calorie_created(calorie)
+        worker._calorie_removed(calorie)
+        worker._calorie_created({**calorie, "date": "not a date"})
+        self.assertEqual(
+            [
+                ("day", "2020-06-30", 200, 2),
+                ("month", "2020-06-01", 200, 2),
+                ("week", "2020-06-29", 200, 2),
+            ],
+            self.rollups(worker),
+        )
+
+        # Entries written without events, e.g. by another process
+        self.engine.execute(database.User.__table__.insert(), {"username": "bob"})
+        self.engine.execute(
+            database.Calorie.__table__.insert(),
+            [
+                {"username": "bob", "date": "2020-07-01", "number_of_calories": 50},
+                {"username": "bob", "date": "2020-06-30", "number_of_calories": 25},
+            ],
+        )
+        worker.reconcile()
+        self.assertEqual(
+            [
+                ("day", "2020-06-30", 25, 1),
+                ("day", "2020-07-01", 50, 1),
+                ("month", "2020-06-01", 25, 1),
+                ("month", "2020-07-01", 50, 1),
+                ("week", "2020-06-29", 75, 2),
+            ],
+            self.rollups(worker),
+        )
+
+        # Archived entries stay in their days, deleted ones leave
+        calorie_table = database.Calorie.__table__
+        with self.engine.begin() as connection:
+            rollups.add_archived(connection, {("bob", "2020-07-01"): (50, 1)})
+            connection.execute(calorie_table.delete())
+        worker.reconcile()
+        self.assertEqual(
+            [
+                ("day", "2020-07-01", 50, 1),
+                ("month", "2020-07-01", 50, 1),
+                ("week", "2020-06-29", 50, 1),
+            ],
+            self.rollups(worker),
+        )
+
+    def test_deltas_counted_by_a_reconcile_are_skipped(self):
+        worker = rollups.RollupWorker(self.engine, reconcile_seconds=0)
+        worker.start()
+        self.engine.execute(database.User.__table__.insert(), {"username": "bob"})
+        calorie = {"username": "bob", "date": "2020-06-30", "number_of_calories": 100}
+        self.engine.execute(database.Calorie.__table__.insert(), calorie)
+        self.engine.execute(database.Change.__table__.insert(), {"seq": 7})
+        worker.reconcile(["bob"])
+
+        # Its delta arrives after the reconcile counted the entry
+        worker._calorie_created(calorie, seq=7)
+        worker._calorie_created(calorie, seq=8)
+        self.assertEqual(
+            [
+                ("day", "2020-06-30", 200, 2),
+                ("month", "2020-06-01", 200, 2),
+                ("week", "2020-06-29", 200, 2),
+            ],
+            self.rollups(worker),
+        )
+
+
+class TestRollupRoutes(ApiTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for date, calories in [
+            ("2020-05-31", 10),
+            ("2020-06-01", 20),
+            ("2020-06-30", 40),
+        ]:
+            self.create(bob, number_of_calories=calories, date=date)
+
+    def test_coarsest_rollup(self):
+        body, code = self.get("/users/bob/rollups?from=2020-05-01&to=2020-06-30", bob)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual(
+            {
+                "period": "month",
+                "totals": [
+                    {"start": "2020-05-01", "calories": 10, "entries": 1},
+                    {"start": "2020-06-01", "calories": 60, "entries": 2},
+                ],
+                "calories": 70,
+                "entries": 3,
+            },
+            body["rollups"],
+        )
+        body, _ = self.get("/users/bob/rollups?from=2020-06-01&to=2020-06-29", bob)
+        self.assertEqual("day", body["rollups"]["period"])
+        self.assertEqual(20, body["rollups"]["calories"])
+        body, _ = self.get(
+            "/users/bob/rollups?from=2020-06-01&to=2020-06-30&period=week", bob
+        )
+        self.assertEqual(
+            ["2020-06-01", "2020-06-29"],
+            [total["start"] for total in body["rollups"]["totals"]],
+        )
+
+    def test_removal(self):
+        self.delete("/calories?username=bob", admin)
+        body, _ = self.get("/users/bob/rollups?from=2020-05-01&to=2020-06-30", bob)
+        self.assertEqual([], body["rollups"]["totals"])
+
+    def test_removal_keeps_archived_days(self):
+        # Archiving deletes entries without events
+        database.engine.execute(
+            database.Calorie.__table__.delete().where(
+                database.Calorie.date == "2020-05-31"
+            )
+        )
+        self.delete("/calories?username=bob&before=2020-06-15", admin)
+        self.delete("/calories", admin)
+        body, _ = self.get("/users/bob/rollups?from=2020-05-01&to=2020-06-30", bob)
+        self.assertEqual(
+            [{"start": "2020-05-01", "calories": 10, "entries": 1}],
+            body["rollups"]["totals"],
+        )
+
+    def test_errors(self):
+        _, code = self.get("/users/admin/rollups?from=2020-05-01&to=2020-06-30", bob)
+        self.assertEqual(403, code)
+        _, code = self.get("/users/bob/rollups?from=2020-05-01", bob)
+        self.assertEqual(400, code)
+        _, code = self.get("/users/bob/rollups?from=June&to=July", bob)
+        self.assertEqual(400, code)
+        _, code = self.get(
+            "/users/bob/rollups?from=2020-05-01&to=2020-06-30&period=year", bob
+        )
+        self.assertEqual(400, code)
+
+
+admin = "admin"
+bob = "bob"
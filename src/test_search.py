@@ -0,0 +1,59 @@
+import search
+from api_test_case import ApiTestCase
+
+
+class TestSearch(ApiTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for user, text in [
+            (bob, "Banana bread"),
+            (bob, "banana"),
+            (bob, "Bread and butter"),
+            (admin, "banana split"),
+        ]:
+            self.create(user, text)
+
+    def search(self, query, user="bob"):
+        return self.get(f"/calories/search?{query}", user)
+
+    def texts(self, query, user="bob"):
+        body, code = self.search(query, user)
+        self.assertEqual(200, code, body.get("error", ""))
+        return sorted(calorie["text"] for calorie in body["calories"])
+
+    def test_words_and_prefix(self):
+        body, _ = self.search("q=banana")
+        self.assertEqual(
+            [bool] * 2, [type(c["below_expected"]) for c in body["calories"]]
+        )
+        self.assertEqual(["Banana bread", "banana"], self.texts("q=banana"))
+        self.assertEqual(["Banana bread"], self.texts("q=banana br"))
+        self.assertEqual(["Banana bread", "Bread and butter"], self.texts("q=BREAD"))
+        self.assertEqual(["Bread and butter"], self.texts("q=butt"))
+        self.assertEqual([], self.texts("q=apple"))
+
+    def test_scope(self):
+        self.assertEqual(
+            ["Banana bread", "banana", "banana split"], self.texts("q=banana", admin)
+        )
+        self.assertEqual(["banana split"], self.texts("q=banana&username=admin", admin))
+        _, code = self.search("q=banana&username=admin")
+        self.assertEqual(403, code)
+        _, code = self.search("q=%20")
+        self.assertEqual(400, code)
+
+    def test_follows_writes(self):
+        calorie_id = self.search("q=split", admin)[0]["calories"][0]["id"]
+        self.delete(f"/calories/{calorie_id}", admin)
+        self.assertEqual([], self.texts("q=split", admin))
+
+    def test_without_fts(self):
+        search.sqlite_fts = False
+        try:
+            self.assertEqual(["Banana bread"], self.texts("q=bread banana"))
+        finally:
+            search.sqlite_fts = True
+
+
+admin = "admin"
+bob = "bob"
@@ -0,0 +1,87 @@
+import unittest
+
+import stats
+from api_test_case import ApiTestCase
+
+
+class TestTrends(unittest.TestCase):
+    def test_trends(self):
+        # 2020-06-01 was a Monday
+        days = {
+            "2020-06-01": 2500,
+            "2020-06-02": 2100,
+            "2020-06-03": 1000,
+            "2020-06-05": 2200,
+            "2020-06-06": 2300,
+            "2020-06-07": 2400,
+            "2020-06-08": 1500,
+        }
+        result = stats.trends(list(days), list(days.values()), 2000, window=3)
+        self.assertEqual(("2020-06-01", "2020-06-08"), (result["from"], result["to"]))
+        self.assertEqual((8, 7), (result["days"], result["days_logged"]))
+        self.assertEqual(14000, result["calories"])
+        self.assertEqual(2000.0, result["average"])
+        self.assertEqual(5, result["days_over"])
+        self.assertEqual(
+            {"days": 3, "from": "2020-06-05"}, result["longest_streak_over"]
+        )
+        self.assertEqual(0, result["current_streak_over"])
+        self.assertEqual(
+            [2500.0, 2300.0, 1866.7, 1550.0, 1600.0, 2250.0, 2300.0, 2066.7],
+            result["rolling"]["averages"],
+        )
+        self.assertEqual(2000.0, result["weekdays"]["monday"])
+        self.assertIsNone(result["weekdays"]["thursday"])
+
+    def test_range_and_bad_dates(self):
+        result = stats.trends(
+            ["2020-06-01", "someday", "2020-06-02", "2020-06-04"],
+            [2500, 100, 2600, 10],
+            2000,
+            "2020-06-02",
+            "2020-06-03",
+        )
+        self.assertEqual(
+            (2, 1, 2600), (result["days"], result["days_logged"], result["calories"])
+        )
+        self.assertEqual(0, result["current_streak_over"])
+        self.assertEqual([2600.0, 2600.0], result["rolling"]["averages"])
+
+        self.assertEqual(0, stats.trends([], [], 2000)["days"])
+        self.assertEqual(0, stats.trends([], [], 2000, "2020-06-01")["days"])
+        with self.assertRaises(ValueError):
+            stats.trends([], [], 2000, "2000-01-01", "2020-01-01")
+
+
+class TestStatsRoute(ApiTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        for date, calories in [("2020-06-01", 1500), ("2020-06-01", 1000)]:
+            self.create(bob, number_of_calories=calories, date=date)
+
+    def test_stats_follow_writes(self):
+        body, code = self.get("/users/bob/stats", bob)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual(
+            (2500, 1), (body["stats"]["calories"], body["stats"]["days_over"])
+        )
+        self.create(bob, number_of_calories=2100, date="2020-06-02")
+        body, _ = self.get("/users/bob/stats", bob)
+        self.assertEqual(2, body["stats"]["current_streak_over"])
+        self.put("/users/bob", bob, {"expected_calories_per_day": 3000})
+        body, _ = self.get(
+            "/users/bob/stats?from=2020-06-01&to=2020-06-07&window=2", bob
+        )
+        self.assertEqual(0, body["stats"]["days_over"])
+        self.assertEqual(7, len(body["stats"]["rolling"]["averages"]))
+
+    def test_errors(self):
+        self.assertEqual(403, self.get("/users/admin/stats", bob)[1])
+        self.assertEqual(404, self.get("/users/nobody/stats", admin)[1])
+        self.assertEqual(400, self.get("/users/bob/stats?from=June", bob)[1])
+        self.assertEqual(400, self.get("/users/bob/stats?window=0", bob)[1])
+        self.assertEqual(400, self.get("/users/bob/stats?from=1900-01-01", bob)[1])
+
+
+admin = "admin"
+bob = "bob"
@@ -0,0 +1,93 @@
+import datetime
+
+import calories
+import database
+from api_test_case import ApiTestCase
+
+
+class TestDeltaSync(ApiTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.overlap = calories.sync_overlap
+        calories.sync_overlap = datetime.timedelta(0)
+        for text in ["kiwi", "apple"]:
+            self.create(bob, text, 10)
+
+    def tearDown(self):
+        calories.sync_overlap = self.overlap
+        super().tearDown()
+
+    def sync(self, query, user="bob"):
+        return self.get(f"/calories?{query}", user)
+
+    def test_changes_and_deletions(self):
+        body, code = self.sync("username=bob&updated_since=2020-01-01T00:00:00Z")
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertTrue(body["reset"])
+        self.assertEqual(["1", "2"], sorted(body["calories"]))
+        since = body["updated_at"]
+
+        body, _ = self.sync(f"username=bob&updated_since={since}")
+        self.assertEqual(
+            ({}, [], False), (body["calories"], body["deleted"], body["reset"])
+        )
+
+        pear = self.create(bob, "pear", 10)["id"]
+        self.delete("/calories/1", bob)
+        body, _ = self.sync(f"username=bob&updated_since={since}&format=array")
+        self.assertEqual(["pear"], [calorie["text"] for calorie in body["calories"]])
+        self.assertEqual(pear, body["calories"][0]["id"])
+        self.assertEqual([1], body["deleted"])
+
+        body, _ = self.sync(f"username=bob&updated_since={body['updated_at']}")
+        self.assertEqual(({}, []), (body["calories"], body["deleted"]))
+
+    def test_bulk_deletions(self):
+        since = self.sync("updated_since=2020-01-01", admin)[0]["updated_at"]
+        self.create(admin, "banana split", 10)
+        self.delete("/calories?username=bob", admin)
+        body, _ = self.sync(f"updated_since={since}&fields=text", admin)
+        self.assertEqual(
+            ["banana split"], [c["text"] for c in body["calories"].values()]
+        )
+        self.assertEqual([1, 2], body["deleted"])
+
+    def test_imported(self):
+        since = self.sync("username=bob&updated_since=2020-01-01")[0]["updated_at"]
+        response = self.client.post(
+            "/calories/import?format=csv",
+            data=(
+                "username,date,time,text,number_of_calories\n"
+                "bob,2020-06-02,12:00,soup,300\n"
+            ),
+            headers=self.headers(admin),
+        )
+        self.assertEqual(1, response.json["imported"]["calories"])
+        body, _ = self.sync(f"username=bob&updated_since={since}&fields=text")
+        self.assertEqual(["soup"], [c["text"] for c in body["calories"].values()])
+
+        # COPY on PostgreSQL skips column defaults, so it has to write every column but the id
+        self.assertEqual(
+            set(database.Calorie.__table__.columns.keys()) - {"id"},
+            set(calories._copy_columns),
+        )
+
+    def test_reused_id(self):
+        since = self.sync("updated_since=2020-01-01")[0]["updated_at"]
+        self.delete("/calories/2", bob)
+        self.assertEqual(
+            2, self.create(bob, "plum", 10)["id"]
+        )  # SQLite hands out the id again
+        body, _ = self.sync(f"username=bob&updated_since={since}")
+        self.assertEqual(["2"], list(body["calories"]))
+        self.assertEqual([], body["deleted"])
+
+    def test_errors(self):
+        _, code = self.sync("username=bob&updated_since=yesterday")
+        self.assertEqual(400, code)
+        _, code = self.sync("username=admin&updated_since=2020-01-01")
+        self.assertEqual(403, code)
+
+
+admin = "admin"
+bob = "bob"
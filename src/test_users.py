@@ -1,5 +1,7 @@
 import unittest
 
+from sqlalchemy import event
+
 from users import Role, Users
 from exceptions import NotAllowedException, UnknownUserException
 import database
@@ -121,6 +123,51 @@ class TestUsers(unittest.TestCase):
         self.update_password(USER_MANAGER, BOB, PASSWORD_2)
         self.update_password(ADMIN, BOB, PASSWORD_2)
 
+    def test_modify_higher_role(self):
+        self.update_role(ADMIN, ALICE, Role.ADMIN)
+        self.assertRaises(
+            NotAllowedException, self.update_password, USER_MANAGER, ALICE, PASSWORD_2
+        )
+        self.assertRaises(NotAllowedException, self.remove, USER_MANAGER, ALICE)
+        self.assertEqual(PASSWORD_1, self.users.non_session_read(ALICE).hashed_password)
+
+    def test_modify_unknown_user(self):
+        self.assertRaises(
+            UnknownUserException, self.update_password, ADMIN, "nobody", PASSWORD_2
+        )
+        self.assertRaises(
+            UnknownUserException, self.update_password, BOB, "nobody", PASSWORD_2
+        )
+        self.assertRaises(UnknownUserException, self.remove, ADMIN, "nobody")
+
+    def test_update_returns_user(self):
+        self.users.set_user_session(ADMIN)
+        expected = {
+            "username": BOB,
+            "role": Role.USER_MANAGER.value,
+            "expected_calories_per_day": 2000,
+        }
+        self.assertEqual(expected, self.users.update_role(BOB, Role.USER_MANAGER))
+        expected["expected_calories_per_day"] = 1500
+        self.assertEqual(
+            expected, self.users.update_expected_calories_per_day(BOB, 1500)
+        )
+
+    def test_update_checks_permission_in_statement(self):
+        self.users.set_user_session(USER_MANAGER)
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement.split()[0])
+
+        event.listen(database.engine, "before_cursor_execute", record)
+        try:
+            self.users.update_expected_calories_per_day(BOB, 1500)
+        finally:
+            event.remove(database.engine, "before_cursor_execute", record)
+        self.assertEqual("UPDATE", statements[0])
+        self.assertEqual(1, statements.count("UPDATE"))
+
     def update_role(self, logged_in_user, user_to_change, new_role):
         """Helper function."""
         self.users.set_user_session(logged_in_user)
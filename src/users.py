@@ -1,15 +1,30 @@
 from exceptions import (
+    InvalidRequestException,
     NotAllowedException,
     UnknownUserException,
     InitialAdminRoleException,
     UserAlreadyExistsException,
 )
-from database import User, DBSession
-from calories import Calories
-from role import Role
+from sqlalchemy import and_, case, delete, func, or_, select, text, update
 
+from database import (
+    Calorie,
+    CalorieRollup,
+    Change,
+    User,
+    DBSession,
+    filter_to_sql,
+)
+from calories import Calories, insert_tombstones
+from role import Role
+import changes
+import datetime
+import events
+import heapq
+import json
 
 initial_admin = "admin"
+max_cohort_limit = 1000
 
 
 class UserManagement:
@@ -22,6 +37,7 @@ class UserManagement:
 
 
 class Users:
+    columns = ["username", "role", "expected_calories_per_day"]
 
     # Functions used outside of a user session
     def __init__(self, db_session):
@@ -51,6 +67,7 @@ class Users:
                 expected_calories_per_day=2000,
             )
             self._storage.create(user)
+            events.publish("user_changed", username=initial_admin)
             return user
 
     def create(self, username, hashed_password, expected_calories_per_day):
@@ -64,6 +81,7 @@ class Users:
             expected_calories_per_day=expected_calories_per_day,
         )
         self._storage.create(user)
+        events.publish("user_changed", username=username)
         return user
 
     # Functions used during a user session
@@ -82,23 +100,140 @@ class Users:
                 user_dict[user.username] = entry
         return user_dict
 
+    def read_rows(self, columns=None):
+        """Same users as read(), as tuples of columns (default all of them) ordered by username."""
+        self._modify_read_user_check()
+        if not columns:
+            columns = self.columns
+        elif not set(columns) <= set(self.columns):
+            raise InvalidRequestException
+        return self._storage.get_rows(columns)
+
+    def read_changes(self, since, limit=1000):
+        """Changes after seq since that the current user may see, all of them for admins.
+
+        reset means changes after since are no longer all kept (or since is from another
+        database): the client should reload everything and continue from seq.
+        """
+        username = None if self._current_role == Role.ADMIN else self._current_user
+        first, last = self._storage.get_change_range()
+        if since > (last or 0) or (first is not None and since + 1 < first):
+            return {"changes": [], "seq": last or 0, "more": False, "reset": True}
+        changes = [
+            {
+                "seq": change.seq,
+                "entity": change.entity,
+                "op": change.op,
+                "key": change.key,
+                "username": change.username,
+                "data": json.loads(change.data) if change.data else None,
+            }
+            for change in self._storage.get_changes(since, username, limit)
+        ]
+        return {
+            "changes": changes,
+            "seq": changes[-1]["seq"] if changes else since,
+            "more": len(changes) == limit,
+            "reset": False,
+        }
+
+    def read_scope(self):
+        """Permission checked scope of the user listing, equal scopes list equal users."""
+        self._modify_read_user_check()
+        return (self._current_role,)
+
+    def replica_queries(self):
+        """Statements this session has read from a replica so far."""
+        return self._storage.replica_queries()
+
+    def cohort(self, start, end, limit=10, source="calories"):
+        """Adherence of the users the current user may manage over the inclusive range start to end.
+
+        Per user days logged, days over expected calories and the average per logged day, from one
+        grouped query over the calorie table or, with source "rollups", the day rollups. Returns the
+        limit users with the largest share of days over, picked with a heap.
+        """
+        self._modify_read_user_check()
+        try:
+            datetime.date.fromisoformat(start)
+            datetime.date.fromisoformat(end)
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise InvalidRequestException
+        if source not in ("calories", "rollups") or not 0 < limit <= max_cohort_limit:
+            raise InvalidRequestException
+        rows = self._storage.get_adherence(
+            start, end, self._current_role, source == "rollups"
+        )
+        users = [
+            {
+                "username": username,
+                "expected_calories_per_day": expected,
+                "days_logged": days_logged,
+                "days_over": days_over,
+                "share_over": round(days_over / days_logged, 3),
+                "average": round(calories / days_logged, 1),
+            }
+            for username, expected, days_logged, days_over, calories in rows
+        ]
+        top = heapq.nlargest(
+            limit,
+            users,
+            key=lambda user: (
+                user["share_over"],
+                user["average"] - user["expected_calories_per_day"],
+            ),
+        )
+        return {
+            "from": start,
+            "to": end,
+            "source": source,
+            "users_logged": len(users),
+            "users": top,
+        }
+
+    def check_admin(self):
+        """For admin only operations on the service itself, e.g. profiling."""
+        if self._current_role != Role.ADMIN:
+            raise NotAllowedException
+
     def remove(self, user_to_delete):
         if user_to_delete == initial_admin:
             raise InitialAdminRoleException
-        self._modify_read_user_check(user_to_delete)
-        self._storage.remove(user_to_delete)
+        if (
+            not self._may_modify(user_to_delete)
+            or not self._storage.remove_where(
+                self._modify_clause(user_to_delete), user_to_delete
+            )[0]
+        ):
+            self._raise_modify_error(user_to_delete)
+        events.publish("user_removed", username=user_to_delete)
+
+    def bulk_remove(self, search_filter=None):
+        """Admin only. Remove every user matching search_filter (all but the initial admin if None).
+
+        Returns the number of users and calories removed.
+        """
+        if self._current_role != Role.ADMIN:
+            raise NotAllowedException
+        where_clause = and_(
+            User.username != initial_admin, User.role <= self._current_role
+        )
+        if search_filter:
+            where_clause = and_(where_clause, text(filter_to_sql(search_filter)))
+        counts = self._storage.remove_where(where_clause)
+        events.publish("users_removed")
+        return counts
 
     def update_password(self, user_to_change, hashed_password):
-        self._modify_read_user_check(user_to_change)
-        self._storage.update_field(user_to_change, "hashed_password", hashed_password)
+        self._update(user_to_change, hashed_password=hashed_password)
 
     def update_role(self, user_to_change, new_role):
         if user_to_change == initial_admin:
             raise InitialAdminRoleException
         if new_role > self._current_role:
             raise NotAllowedException
-        self._modify_read_user_check(user_to_change)
-        self._storage.update_field(user_to_change, "role", new_role)
+        return self._update(user_to_change, role=new_role)
 
     def _modify_read_user_check(self, username=None):
         if (
@@ -118,32 +253,174 @@ class Users:
                 raise NotAllowedException
 
     def update_expected_calories_per_day(self, user_to_change, new_expected):
-        self._modify_read_user_check(user_to_change)
-        self._storage.update_field(
-            user_to_change, "expected_calories_per_day", new_expected
-        )
-        return self.read(user_to_change)
+        return self._update(user_to_change, expected_calories_per_day=new_expected)
+
+    def _update(self, user_to_change, **values):
+        """Permission check and update in one statement. Returns the updated user dict."""
+        user_dict = None
+        if self._may_modify(user_to_change):
+            user_dict = self._storage.update_where(
+                user_to_change, self._modify_clause(user_to_change), values
+            )
+        if not user_dict:
+            self._raise_modify_error(user_to_change)
+        events.publish("user_changed", username=user_to_change)
+        return user_dict
+
+    def _may_modify(self, username):
+        """False when no row can pass the check, so the statement can be skipped."""
+        return self._current_user == username or self._current_role != Role.REGULAR
+
+    def _modify_clause(self, username):
+        """The rules of _modify_read_user_check as a WHERE clause."""
+        if self._current_user == username:
+            return User.username == username
+        return and_(User.username == username, User.role <= self._current_role)
+
+    def _raise_modify_error(self, username):
+        """Nothing matched the modify clause. Only this error path pays for a lookup."""
+        if not self._storage.get(username):
+            raise UnknownUserException
+        raise NotAllowedException
 
 
 class _Storage:
     def __init__(self, db_session):
         self._db_session = db_session
 
-    def remove(self, username):
-        self._db_session.delete(self.get(username))
-        self._db_session.commit()
-
     def create(self, user_obj):
         self._db_session.add(user_obj)
+        changes.record(
+            self._db_session, "user", "update", user_obj.username, user_obj.username
+        )
         self._db_session.commit()
 
     def get(self, username=None):
         return self._db_session.query(User).get(username)
 
+    def replica_queries(self):
+        return self._db_session.replica_queries
+
     def get_all(self):
-        return self._db_session.query(User)
+        with self._db_session.replica_reads():
+            return self._db_session.query(User).all()
+
+    def get_rows(self, columns):
+        query = self._db_session.query(*[getattr(User, column) for column in columns])
+        with self._db_session.replica_reads():
+            return query.order_by(User.username).all()
 
-    def update_field(self, username, field, value):
-        user = self._db_session.query(User).filter_by(username=username).first()
-        setattr(user, field, value)
+    def get_change_range(self):
+        first, last = self._db_session.query(
+            func.min(Change.seq), func.max(Change.seq)
+        ).one()
+        self._db_session.commit()  # Don't keep a snapshot open between long-poll reads
+        return first, last
+
+    def get_changes(self, since, username, limit):
+        query = self._db_session.query(
+            Change.seq,
+            Change.entity,
+            Change.op,
+            Change.key,
+            Change.username,
+            Change.data,
+        ).filter(Change.seq > since)
+        if username:
+            query = query.filter(
+                or_(Change.username == username, Change.username.is_(None))
+            )
+        changes = query.order_by(Change.seq).limit(limit).all()
         self._db_session.commit()
+        return changes
+
+    def get_adherence(self, start, end, max_role, from_rollups=False):
+        """(username, expected, days logged, days over expected, calories) of each user up to
+        max_role with entries from start to end, from one query grouped by user."""
+        if from_rollups:
+            day_totals = select(
+                [
+                    CalorieRollup.username,
+                    CalorieRollup.calories.label("calories"),
+                ]
+            ).where(
+                and_(
+                    CalorieRollup.period == "day",
+                    CalorieRollup.period_start.between(start, end),
+                    CalorieRollup.entries > 0,
+                )
+            )
+        else:
+            day_totals = (
+                select(
+                    [
+                        Calorie.username,
+                        func.sum(Calorie.number_of_calories).label("calories"),
+                    ]
+                )
+                .where(Calorie.date.between(start, end))
+                .group_by(Calorie.username, Calorie.date)
+            )
+        days = day_totals.alias("days")
+        query = (
+            self._db_session.query(
+                User.username,
+                User.expected_calories_per_day,
+                func.count(),
+                func.sum(
+                    case(
+                        [(days.c.calories > User.expected_calories_per_day, 1)], else_=0
+                    )
+                ),
+                func.sum(days.c.calories),
+            )
+            .join(days, days.c.username == User.username)
+            .filter(User.role <= max_role)
+            .group_by(User.username, User.expected_calories_per_day)
+        )
+        with self._db_session.replica_reads():
+            return query.all()
+
+    def update_where(self, username, where_clause, values):
+        """Conditional UPDATE of one user. Returns the user's public fields or None if no match."""
+        statement = update(User).where(where_clause).values(**values)
+        if self._supports_returning():
+            row = self._db_session.execute(
+                statement.returning(*_public_columns)
+            ).first()
+        else:
+            row = None
+            if self._db_session.execute(statement).rowcount:
+                row = self._db_session.execute(
+                    select(_public_columns).where(User.username == username)
+                ).first()
+        if row:
+            changes.record(self._db_session, "user", "update", username, username)
+        self._db_session.commit()
+        return dict(row) if row else None
+
+    def remove_where(self, where_clause, username=None):
+        """Set based DELETE of matching users and their calories, in one transaction.
+
+        username is the one user where_clause can match, if it is a single removal. Calories are
+        removed explicitly rather than trusting the foreign key cascade, which SQLite only
+        enforces with PRAGMA foreign_keys. Returns (users removed, calories removed).
+        """
+        usernames = select([User.username]).where(where_clause)
+        insert_tombstones(self._db_session, Calorie.username.in_(usernames))
+        calories = self._db_session.execute(
+            delete(Calorie).where(Calorie.username.in_(usernames))
+        ).rowcount
+        users = self._db_session.execute(delete(User).where(where_clause)).rowcount
+        if username and users:
+            changes.record(self._db_session, "user", "delete", username, username)
+        elif not username:
+            changes.record(self._db_session, "user", "bulk_delete")
+        self._db_session.commit()
+        return users, calories
+
+    def _supports_returning(self):
+        return self._db_session.get_bind().dialect.name == "postgresql"
+
+
+_public_columns = [User.username, User.role, User.expected_calories_per_day]
@@ -279,23 +279,36 @@ class TestCalorieCounter(unittest.TestCase):
             self.assertEqual(200, code, body.get("error", ""))
             self.assertEqual(under_expected, body["calorie"]["below_expected"])
 
+    def test_bulk_delete(self):
+        for day in ["2020-05-31", "2020-06-01", "2020-06-02"]:
+            self.post("/calories", bob, self.make_calorie(day, "06:30", "kiwi", 42))
+        body, code = self.delete("/calories?username=bob", bob)
+        self.assertEqual(403, code)
+        body, code = self.delete("/users", bob)
+        self.assertEqual(403, code)
+
+        body, code = self.delete("/calories?username=bob&before=2020-06-01", admin)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual({"deleted": {"calories": 1}}, body)
+
+        body, code = self.delete("/users?filter=role+eq+1", admin)
+        self.assertEqual(200, code, body.get("error", ""))
+        self.assertEqual({"deleted": {"users": 2, "calories": 2}}, body)
+        body, code = self.get("/calories", admin)
+        self.assertEqual({}, body["calories"])
+        body, code = self.get("/users", admin)
+        self.assertEqual([admin], list(body["users"]))
+
     def setUp(self) -> None:
         self.bob_token = None
         self.admin_token = None
         self.sally_token = None
 
         #  use admin user to remove all users (apart from admin) and calories
-        body, code = self.get("/users", admin)
+        body, code = self.delete("/users", admin)
         self.assertEqual(200, code, body.get("error", ""))
-        for user in body["users"]:
-            if user != "admin":
-                body, code = self.delete(f"/users/{user}", admin)
-                self.assertEqual(200, code, body.get("error", ""))
-        body, code = self.get("/calories", admin)
+        body, code = self.delete("/calories", admin)
         self.assertEqual(200, code, body.get("error", ""))
-        for calorie_id in body["calories"]:
-            body, code = self.delete(f"/calories/{calorie_id}", admin)
-            self.assertEqual(200, code, body.get("error", ""))
 
         # Confirm Bob and Sally no longer exist then re-add them
         body, code = self.get("/users", admin)